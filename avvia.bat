@@ -29,7 +29,7 @@ echo [2/4] Verifico dipendenze Python...
 python -c "import flask" >nul 2>&1
 if errorlevel 1 (
     echo [WARN] Flask non trovato, installazione in corso...
-    pip install flask flask-cors watchdog
+    pip install flask flask-cors watchdog markdown pygments
     if errorlevel 1 (
         echo [ERRORE] Installazione dipendenze fallita
         pause
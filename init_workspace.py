@@ -40,7 +40,7 @@ MD_DIR = ROOT / 'md'
 # Check and install dependencies
 def check_and_install_dependencies():
     """Controlla se le dipendenze sono installate e le installa se necessario."""
-    dependencies = ['flask', 'flask_cors', 'watchdog']
+    dependencies = ['flask', 'flask_cors', 'watchdog', 'markdown', 'pygments']
     missing = []
     
     print('Controllo dipendenze...')
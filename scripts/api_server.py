@@ -1,102 +1,392 @@
-from flask import Flask, jsonify, request, send_from_directory, abort
+from flask import Flask, Response, g, jsonify, request, send_from_directory, abort
 from pathlib import Path
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
 import os
 import datetime
-import subprocess
+import hashlib
 import sys
+import atexit
 import json
-import re
+import mimetypes
 import shutil
+import threading
+import time
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+if str(SCRIPTS_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPTS_DIR))
+
+from compression import (DYNAMIC_BROTLI_QUALITY, DYNAMIC_GZIP_LEVEL, MIN_SIZE, SUFFIXES,
+                         compress, negotiate, sibling)
+from event_bus import EventBus, EventBusHandler, format_sse
+from file_lock import hold, is_held
+from file_tree import FileTree
+from image_store import HASH_NAME_RE, ImageStore, UploadError
+from log_setup import LogStore, filter_entries, parse_log_line, setup_logging
+from log_tail import decode_cursor, encode_cursor, end_cursor, read_since, tail_lines
+from md_render import RenderCache
+from metadata_store import MetadataStore
+from metrics import BUILD_BUCKETS, Registry
+import pagination
+from regen_service import RegenerationService
+import regenerate_preview
+from search_index import SearchIndex
 
 ROOT = Path(__file__).resolve().parent.parent
 MD_DIR = ROOT / 'md'
 WEB_DIR = ROOT / 'web'
 LOG_DIR = ROOT / 'logs'
+CACHE_DIR = ROOT / 'cache'
 MD_DIR.mkdir(exist_ok=True)
 WEB_DIR.mkdir(exist_ok=True)
 LOG_DIR.mkdir(exist_ok=True)
 
-app = Flask(__name__, static_folder=str(WEB_DIR), static_url_path='')
+# Processi worker del server (impostato da serve.py): con più worker lo stato in
+# memoria è per processo e viene tenuto allineato dall'observer di ciascuno
+WORKERS = int(os.environ.get('APPUNTI_WORKERS', '1'))
+
+# web/ è servita da static_proxy (non dalla route static di Flask) per poter
+# impostare Cache-Control per percorso
+app = Flask(__name__, static_folder=None)
 CORS(app)
 
-# Cache per file stats
-FILE_CACHE = {}
+# Metriche per /api/metrics (per processo): latenza, richieste in corso e byte
+# per route; build, cache e letture dei servizi sono lette all'esportazione
+metrics = Registry()
+http_requests = metrics.counter('appunti_http_requests_total', 'Richieste HTTP servite',
+                                ('route', 'method', 'status'))
+http_duration = metrics.histogram('appunti_http_request_duration_seconds',
+                                  'Tempo di risposta (fino alla risposta pronta, senza streaming)',
+                                  ('route', 'method'))
+http_in_flight = metrics.gauge('appunti_http_requests_in_flight', 'Richieste in corso', ('route',))
+http_response_bytes = metrics.counter('appunti_http_response_bytes_total',
+                                      'Byte dei corpi di risposta (dopo la compressione)', ('route',))
+regen_duration = metrics.histogram('appunti_regen_duration_seconds', 'Durata delle build di rigenerazione',
+                                   buckets=BUILD_BUCKETS)
+regen_builds = metrics.counter('appunti_regen_builds_total', 'Build di rigenerazione eseguite', ('status',))
+file_read_bytes = metrics.counter('appunti_file_read_bytes_total',
+                                  'Byte letti da md/ per richieste e build', ('source',))
+
+def route_label():
+    """Regola della route (non il percorso: cardinalità limitata), 'unmatched' per i 404"""
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+@app.before_request
+def start_request_timer():
+    g.metrics_route = route_label()
+    g.metrics_started = time.perf_counter()
+    http_in_flight.inc(1, g.metrics_route)
 
-# Logging personalizzato
-import logging
-from logging.handlers import RotatingFileHandler
+# Registrato prima di compress_api_response: Flask esegue gli after_request in
+# ordine inverso, quindi qui la risposta è già compressa
+@app.after_request
+def record_request_metrics(response):
+    route = g.get('metrics_route')
+    if route is None:
+        return response
+    http_duration.observe(time.perf_counter() - g.metrics_started, route, request.method)
+    http_requests.inc(1, route, request.method, str(response.status_code))
+    if not response.is_streamed and response.content_length:
+        http_response_bytes.inc(response.content_length, route)
+    return response
 
+@app.teardown_request
+def end_request_timer(exc):
+    route = g.pop('metrics_route', None)
+    if route is not None:
+        http_in_flight.dec(1, route)
+
+def record_build(seconds, result, error):
+    """Callback del RegenerationService a fine build"""
+    regen_duration.observe(seconds)
+    regen_builds.inc(1, 'error' if error else 'ok')
+    if result:
+        file_read_bytes.inc(result.get('bytes_read', 0), 'generator')
+
+# Cache per file stats: metadati in memoria validati con stat()
+FILE_CACHE = MetadataStore(MD_DIR)
+
+# Logging personalizzato: i record passano da una coda, console/file/eventi/store
+# sono scritti dal thread del QueueListener (testo o JSON lines, vedi log_setup.py)
 API_LOG_FILE = LOG_DIR / 'api_server.log'
 
-# Configura logger
-api_logger = logging.getLogger('api_server')
-api_logger.setLevel(logging.INFO)
-api_logger.handlers.clear()  # Rimuovi handler esistenti
+# Notifiche push per /api/events: cambiamenti dei file e righe di log
+event_bus = EventBus()
 
-# Console handler
-console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setFormatter(logging.Formatter('%(message)s'))
-api_logger.addHandler(console_handler)
+# Ultimi record strutturati, per /api/logs con filtri
+api_log_store = LogStore()
+api_log_store.seed(tail_lines(API_LOG_FILE, 5000)[0])
 
-# File handler
-file_handler = RotatingFileHandler(str(API_LOG_FILE), maxBytes=1024*1024, backupCount=3, encoding='utf-8')
-file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-api_logger.addHandler(file_handler)
+# Con più worker sullo stesso file nessuno ruota il log (la rotazione non è sicura tra processi)
+api_logger, file_handler = setup_logging('api_server', API_LOG_FILE,
+                                         [EventBusHandler(event_bus, 'api'), api_log_store],
+                                         rotate=WORKERS == 1)
 
-def build_file_tree(base_path):
-    """Costruisce una struttura ad albero di cartelle e file"""
-    tree = {'type': 'folder', 'name': base_path.name, 'children': []}
-    
-    def add_to_tree(node, path_parts, file_obj):
-        if not path_parts:
+def publish_changes(events):
+    """Pubblica sul bus gli eventi per percorso prodotti da una rigenerazione"""
+    for event in events:
+        event_bus.publish(event['type'], event)
+
+# Rigenerazione HTML in-process: le mutazioni accodano job e rispondono subito
+regen_service = RegenerationService(logger=api_logger, on_events=publish_changes, on_build=record_build)
+
+# Indice full-text per /api/search, caricato all'avvio e aggiornato dalle mutazioni
+search_index = SearchIndex(MD_DIR, CACHE_DIR / 'search_index.pickle', logger=api_logger)
+
+# Render Markdown lato server per /api/render, in cache per hash del contenuto
+render_cache = RenderCache()
+
+# Immagini caricate: nomi da hash del contenuto, varianti generate in background
+image_store = ImageStore(ROOT / 'images', logger=api_logger)
+
+# Albero di md/ per /api/files, aggiornato in place da mutazioni ed eventi del filesystem
+file_tree = FileTree(MD_DIR)
+
+def cache_counters():
+    render = render_cache.stats()
+    return {'render': (render['hits'], render['misses']), 'file_tree': (file_tree.hits, file_tree.misses)}
+
+metrics.collect('appunti_regen_queue_depth', 'Job in attesa della prossima build', 'gauge',
+                regen_service.queue_depth)
+metrics.collect('appunti_cache_hits_total', 'Risposte servite dalla cache', 'counter',
+                lambda: {name: hits for name, (hits, _) in cache_counters().items()}, ('cache',))
+metrics.collect('appunti_cache_misses_total', 'Risposte calcolate di nuovo', 'counter',
+                lambda: {name: misses for name, (_, misses) in cache_counters().items()}, ('cache',))
+metrics.collect('appunti_index_files_read_total', 'File letti dagli indici in memoria', 'counter',
+                lambda: {'metadata': FILE_CACHE.reads, 'search': search_index.reads}, ('index',))
+metrics.collect('appunti_index_read_bytes_total', 'Byte letti dagli indici in memoria', 'counter',
+                lambda: {'metadata': FILE_CACHE.bytes_read, 'search': search_index.bytes_read}, ('index',))
+
+def rel_md_path(path):
+    """Percorso relativo a md/ in formato posix"""
+    return str(path.relative_to(MD_DIR)).replace('\\', '/')
+
+# Cache-Control per tipo di risposta: JSON e HTML generati vanno sempre
+# rivalidati (ETag), le immagini caricate cambiano solo se ricaricate
+CACHE_REVALIDATE = 'no-cache'
+CACHE_STATIC = 'public, max-age=3600'
+CACHE_IMAGES = 'public, max-age=86400'
+CACHE_IMMUTABLE = 'public, max-age=31536000, immutable'   # web/assets/: nomi con hash del contenuto
+
+def file_etag(st):
+    """ETag forte da mtime e dimensione (nessuna lettura del file)"""
+    return f'{st.st_mtime_ns:x}-{st.st_size:x}'
+
+def is_not_modified(etag, last_modified=None):
+    """True se If-None-Match / If-Modified-Since della richiesta corrispondono"""
+    if request.if_none_match:
+        # Confronto debole: le risposte compresse hanno l'ETag W/ (vedi compress_api_response)
+        return request.if_none_match.contains_weak(etag)
+    if last_modified is not None and request.if_modified_since:
+        return int(last_modified) <= request.if_modified_since.timestamp()
+    return False
+
+def conditional_response(etag, make_body, last_modified=None, cache_control=CACHE_REVALIDATE,
+                         mimetype='application/json'):
+    """Risposta con validatori: 304 senza corpo se il client ha già questa versione.
+
+    make_body (bytes o callable) viene valutato solo se serve il corpo.
+    """
+    if is_not_modified(etag, last_modified):
+        response = app.response_class(status=304)
+    else:
+        body = make_body() if callable(make_body) else make_body
+        response = app.response_class(body, mimetype=mimetype)
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+def after_mutation(paths, reason):
+    """Propaga una modifica di file/cartelle in md/: aggiorna gli indici e accoda la rigenerazione"""
+    FILE_CACHE.refresh(paths)
+    search_index.refresh(paths)
+    file_tree.refresh(paths)
+    return regen_service.enqueue(paths, reason)
+
+def builds_external_changes():
+    """True se tocca a questo processo rigenerare le modifiche fatte fuori dall'API.
+
+    Il watcher, se attivo, ha la precedenza; tra i worker rigenera solo quello
+    che tiene EXTERNAL_LOCK_FILE (se esce, il lock passa al primo che lo riprende).
+    """
+    if is_held(regenerate_preview.WATCHER_LOCK_FILE):
+        return False
+    with _services_lock:
+        if _services.get('external_lock') is None:
+            _services['external_lock'] = hold(regenerate_preview.EXTERNAL_LOCK_FILE)
+        return _services['external_lock'] is not None
+
+class MdEventHandler:
+    """Raccoglie gli eventi watchdog su md/ e aggiorna gli indici in blocco.
+
+    Copre le modifiche fatte fuori dall'API (editor esterni, sync, altri
+    worker). Ogni worker aggiorna i propri indici; la rigenerazione la accoda
+    un solo processo (vedi builds_external_changes), gli altri ne ricevono gli
+    eventi dal manifest (ManifestEventHandler).
+    """
+    def __init__(self, delay=0.25):
+        self.delay = delay
+        self._paths = set()
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def dispatch(self, event):
+        # Solo cambiamenti: le aperture/chiusure in lettura (anche degli altri worker) vanno ignorate
+        if event.event_type not in ('created', 'deleted', 'modified', 'moved'):
             return
-        
-        part = path_parts[0]
-        remaining = path_parts[1:]
-        
-        if remaining:  # È una cartella
-            # Cerca se la cartella esiste già
-            folder_node = None
-            for child in node['children']:
-                if child['type'] == 'folder' and child['name'] == part:
-                    folder_node = child
-                    break
-            
-            if not folder_node:
-                folder_node = {'type': 'folder', 'name': part, 'children': []}
-                node['children'].append(folder_node)
-            
-            add_to_tree(folder_node, remaining, file_obj)
-        else:  # È un file
-            node['children'].append({
-                'type': 'file',
-                'name': part,
-                'path': str(file_obj.relative_to(MD_DIR)).replace('\\', '/')
-            })
-    
-    # Trova tutti i file .md ricorsivamente
-    md_files = sorted([f for f in base_path.rglob('*.md') if f.is_file()])
-    
-    for md_file in md_files:
-        rel_path = md_file.relative_to(base_path)
-        add_to_tree(tree, rel_path.parts, md_file)
-    
-    # Ordina ricorsivamente
-    def sort_tree(node):
-        if node['type'] == 'folder' and 'children' in node:
-            node['children'].sort(key=lambda x: (x['type'] == 'file', x['name']))
-            for child in node['children']:
-                sort_tree(child)
-    
-    sort_tree(tree)
-    return tree
+        if event.event_type == 'modified' and event.is_directory:
+            return
+        for raw in (event.src_path, getattr(event, 'dest_path', None)):
+            if not raw:
+                continue
+            try:
+                rel = rel_md_path(Path(raw))
+            except ValueError:
+                continue
+            if event.is_directory or rel.lower().endswith('.md'):
+                with self._lock:
+                    self._paths.add(rel)
+                    if self._timer:
+                        self._timer.cancel()
+                    self._timer = threading.Timer(self.delay, self._flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+
+    def _flush(self):
+        with self._lock:
+            paths, self._paths = self._paths, set()
+        try:
+            FILE_CACHE.refresh(paths)
+            search_index.refresh(paths)
+            file_tree.refresh(paths)
+            if builds_external_changes():
+                regen_service.enqueue(paths, 'external')
+        except Exception as e:
+            api_logger.error(f'Errore aggiornamento indici: {e}')
+
+class ManifestEventHandler:
+    """Pubblica sul bus i cambiamenti delle build fatte da altri processi (worker, watcher)"""
+    def __init__(self, delay=0.25):
+        self.delay = delay
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def dispatch(self, event):
+        # Il manifest è scritto in modo atomico: file temporaneo rinominato
+        names = {Path(p).name for p in (event.src_path, getattr(event, 'dest_path', None)) if p}
+        if regenerate_preview.MANIFEST_FILE.name not in names:
+            return
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.delay, self._flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush(self):
+        try:
+            publish_changes(regenerate_preview.manifest_changes())
+        except Exception as e:
+            api_logger.error(f'Errore lettura manifest: {e}')
+
+def start_md_observer():
+    """Avvia l'observer watchdog su md/ (None se watchdog non è installato)"""
+    try:
+        from watchdog.observers import Observer
+    except ImportError:
+        api_logger.warning('watchdog non installato: modifiche esterne rilevate solo a intervalli')
+        return None
+    observer = Observer()
+    observer.schedule(MdEventHandler(), str(MD_DIR), recursive=True)
+    regenerate_preview.CACHE_DIR.mkdir(exist_ok=True)
+    observer.schedule(ManifestEventHandler(), str(regenerate_preview.CACHE_DIR), recursive=False)
+    observer.daemon = True
+    observer.start()
+    return observer
+
+_services_lock = threading.Lock()
+_services = {}
+
+def start_background_services():
+    """Carica indici e albero e avvia l'observer su md/ (una volta per processo).
+
+    Chiamata da __main__ e da wsgi.py in ogni worker: ogni processo ha i propri
+    indici in memoria e il proprio observer, che vede anche le modifiche fatte
+    dagli altri worker.
+    """
+    with _services_lock:
+        if _services:
+            return
+        FILE_CACHE.validate(force=True)
+        search_index.ensure_loaded()
+        file_tree.build()
+        # Manifest attuale come riferimento: le build fatte da altri processi
+        # (worker, watcher) diventano eventi per i client di questo
+        regenerate_preview.load_manifest()
+        _services['observer'] = start_md_observer()
+        file_tree.watched = _services['observer'] is not None
+        atexit.register(stop_background_services)
+
+def stop_background_services():
+    """Ferma l'observer e salva l'indice di ricerca (idempotente)"""
+    with _services_lock:
+        observer = _services.pop('observer', None)
+        if observer:
+            observer.stop()
+        file_tree.watched = False
+    image_store.shutdown()
+    search_index.flush()
+
+def page_response(make_body):
+    """Risposta paginata dagli indici in memoria; 400 per parametri o cursore non validi.
+
+    ETag dall'hash del corpo, come /api/stats: un contatore di versione in
+    memoria ripartirebbe da zero a ogni riavvio e sarebbe diverso per worker.
+    """
+    FILE_CACHE.validate()
+    try:
+        body = make_body().encode('utf-8')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return conditional_response(hashlib.sha1(body).hexdigest(), body)
 
 @app.route('/api/files')
 def list_files():
+    """Albero completo di md/, un solo ramo con path/depth, o con limit/cursor/sort/folder una pagina di file.
+
+    ?path=corsi&depth=1 -> la cartella con i figli diretti (le sottocartelle con i soli conteggi)
+    ?sort=-modified&folder=corsi/analisi&limit=50&cursor=... -> {'files', 'total', 'next_cursor'}
+    """
     api_logger.info('Richiesta lista file')
-    tree = build_file_tree(MD_DIR)
-    return jsonify(tree)
+    args = request.args
+    if 'path' in args or 'depth' in args:
+        try:
+            depth = max(0, int(args.get('depth') or 1))
+        except ValueError:
+            return jsonify({'error': 'invalid_depth'}), 400
+        file_tree.validate()
+        payload = file_tree.subtree_payload(pagination.normalize_folder(args.get('path')), depth)
+        if payload is None:
+            return jsonify({'error': 'not_found'}), 404
+        body, etag = payload
+        return conditional_response(etag, body)
+    if not any(k in args for k in ('limit', 'cursor', 'sort', 'folder')):
+        file_tree.validate()
+        body, etag = file_tree.payload()
+        return conditional_response(etag, body)
+
+    def make_body():
+        total, files, next_cursor = FILE_CACHE.page(
+            args.get('sort') or 'path', pagination.parse_limit(args.get('limit')),
+            pagination.decode_cursor(args.get('cursor')), pagination.normalize_folder(args.get('folder')))
+        return json.dumps({'files': files, 'total': total,
+                           'next_cursor': next_cursor and pagination.encode_cursor(next_cursor)},
+                          ensure_ascii=False)
+
+    return page_response(make_body)
 
 @app.route('/api/create', methods=['POST'])
 def create_file():
@@ -129,73 +419,119 @@ def create_file():
     dest.parent.mkdir(parents=True, exist_ok=True)
     try:
         dest.write_text(content or f'# {name}\n\n', encoding='utf-8')
-        api_logger.info(f'✓ File creato: {name} (cartella: {folder or "root"})')
-        # Try to run the generator script to create the viewer immediately
-        gen = Path(__file__).resolve().parent / 'regenerate_preview.py'
-        result = None
-        if gen.is_file():
-            try:
-                cmd = [sys.executable, str(gen)]
-                proc = subprocess.run(cmd, check=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-                result = {'returncode': proc.returncode, 'stdout': proc.stdout, 'stderr': proc.stderr}
-            except Exception as e:
-                result = {'error': 'generator_failed', 'msg': str(e)}
-        return jsonify({'ok': True, 'name': name, 'generator': result}), 201
+        api_logger.info(f'✓ File creato: {name} (cartella: {folder or "root"})', extra={'path': rel_md_path(dest)})
+        # Accoda la generazione del viewer
+        job = after_mutation([rel_md_path(dest)], 'create')
+        return jsonify({'ok': True, 'name': name, 'regen': job}), 201
     except Exception as e:
         return jsonify({'error': 'write_failed', 'msg': str(e)}), 500
 
-@app.route('/<path:path>')
-def static_proxy(path):
-    # serve static files from web/ (supporta sottocartelle)
+def send_web_file(path):
+    """File di web/, precompresso (.br/.gz del generatore) se il client lo accetta.
+
+    La copia compressa si usa solo se non è più vecchia dell'originale (es.
+    HTML modificato a mano); ha ETag proprio, quindi i 304 restano corretti
+    per codifica. send_from_directory rifiuta i percorsi fuori da web/.
+    """
+    full = WEB_DIR / path
+    encoding = None
+    accepted = request.headers.get('Accept-Encoding')
+    if accepted:
+        encoding = negotiate(accepted, [enc for enc in SUFFIXES if sibling(full, enc).is_file()])
+    if encoding:
+        try:
+            if sibling(full, encoding).stat().st_mtime < full.stat().st_mtime:
+                encoding = None
+        except OSError:
+            encoding = None
     try:
-        return send_from_directory(str(WEB_DIR), path)
+        if encoding:
+            mimetype = mimetypes.guess_type(full.name)[0] or 'application/octet-stream'
+            response = send_from_directory(str(WEB_DIR), str(sibling(Path(path), encoding)), mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+        else:
+            response = send_from_directory(str(WEB_DIR), path)
     except Exception:
         abort(404)
+    response.vary.add('Accept-Encoding')
+    return response
+
+@app.route('/<path:path>')
+def static_proxy(path):
+    # serve static files from web/ (supporta sottocartelle)
+    # send_from_directory imposta ETag (mtime+dimensione) e Last-Modified e risponde 304
+    response = send_web_file(path)
+    if path.startswith('assets/'):
+        response.headers['Cache-Control'] = CACHE_IMMUTABLE
+    elif path.endswith('.html'):
+        response.headers['Cache-Control'] = CACHE_REVALIDATE
+    else:
+        response.headers['Cache-Control'] = CACHE_STATIC
+    return response
 
 @app.route('/')
 def index():
-    return send_from_directory(str(WEB_DIR), 'preview.html')
+    response = send_web_file('preview.html')
+    response.headers['Cache-Control'] = CACHE_REVALIDATE
+    return response
+
+@app.after_request
+def compress_api_response(response):
+    """Comprime le risposte JSON dell'API sopra MIN_SIZE secondo Accept-Encoding.
+
+    Le risposte in streaming (SSE, file) e quelle già codificate passano
+    invariate. L'ETag diventa debole: stessa risorsa, byte diversi per codifica.
+    """
+    response.vary.add('Accept-Encoding')
+    if (response.mimetype != 'application/json' or response.direct_passthrough
+            or response.is_streamed or 'Content-Encoding' in response.headers
+            or response.status_code < 200 or response.status_code in (204, 304)):
+        return response
+    encoding = negotiate(request.headers.get('Accept-Encoding'))
+    if not encoding:
+        return response
+    data = response.get_data()
+    if len(data) < MIN_SIZE:
+        return response
+    quality = DYNAMIC_BROTLI_QUALITY if encoding == 'br' else DYNAMIC_GZIP_LEVEL
+    response.set_data(compress(data, encoding, quality))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
 
 @app.route('/api/file/<path:filepath>', methods=['GET'])
 def get_file_content(filepath):
     """Ottieni il contenuto di un file specifico"""
-    api_logger.info(f'Richiesta lettura file: {filepath}')
+    api_logger.info(f'Richiesta lettura file: {filepath}', extra={'path': filepath})
     try:
         file_path = MD_DIR / filepath
         if not file_path.exists() or not file_path.is_file():
-            api_logger.warning(f'File non trovato: {filepath}')
+            api_logger.warning(f'File non trovato: {filepath}', extra={'path': filepath})
             return jsonify({'error': 'file_not_found'}), 404
         
-        content = file_path.read_text(encoding='utf-8')
         stats = file_path.stat()
-        
-        # Parse frontmatter YAML se presente
-        tags = []
-        title = file_path.stem
-        frontmatter_match = re.match(r'^---\s*\n(.*?)\n---\s*\n', content, re.DOTALL)
-        if frontmatter_match:
-            fm = frontmatter_match.group(1)
-            tags_match = re.search(r'tags:\s*\[(.*?)\]', fm)
-            if tags_match:
-                tags = [t.strip().strip('"\'') for t in tags_match.group(1).split(',')]
-            title_match = re.search(r'title:\s*(.+)', fm)
-            if title_match:
-                title = title_match.group(1).strip().strip('"\'')
-        
-        # Conta parole
-        word_count = len(re.findall(r'\b\w+\b', content))
-        
-        return jsonify({
-            'content': content,
-            'name': file_path.name,
-            'path': filepath,
-            'size': stats.st_size,
-            'modified': stats.st_mtime,
-            'created': stats.st_ctime,
-            'word_count': word_count,
-            'tags': tags,
-            'title': title
-        })
+        etag = file_etag(stats)
+
+        def make_body():
+            # Metadati dal MetadataStore (stesso parsing del generatore), contenuto letto una volta
+            meta = FILE_CACHE.get(rel_md_path(file_path)) or {}
+            content = file_path.read_text(encoding='utf-8')
+            file_read_bytes.inc(stats.st_size, 'api_file')
+            return json.dumps({
+                'content': content,
+                'name': file_path.name,
+                'path': filepath,
+                'size': stats.st_size,
+                'modified': stats.st_mtime,
+                'created': stats.st_ctime,
+                'word_count': meta.get('word_count', 0),
+                'tags': meta.get('tags', []),
+                'title': meta.get('title', file_path.stem)
+            }, ensure_ascii=False)
+
+        return conditional_response(etag, make_body, last_modified=stats.st_mtime)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -208,33 +544,31 @@ def update_file(filepath):
         
         file_path = MD_DIR / filepath
         if not file_path.exists():
-            api_logger.warning(f'Tentativo di aggiornare file inesistente: {filepath}')
+            api_logger.warning(f'Tentativo di aggiornare file inesistente: {filepath}', extra={'path': filepath})
             return jsonify({'error': 'file_not_found'}), 404
         
         file_path.write_text(content, encoding='utf-8')
-        api_logger.info(f'✓ File aggiornato: {filepath}')
+        api_logger.info(f'✓ File aggiornato: {filepath}', extra={'path': filepath})
         
         # Rigenera HTML
-        gen = Path(__file__).resolve().parent / 'regenerate_preview.py'
-        if gen.is_file():
-            subprocess.run([sys.executable, str(gen)], check=False)
+        job = after_mutation([rel_md_path(file_path)], 'update')
         
-        return jsonify({'ok': True, 'path': filepath})
+        return jsonify({'ok': True, 'path': filepath, 'regen': job})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/file/<path:filepath>', methods=['DELETE'])
 def delete_file(filepath):
     """Elimina un file"""
-    api_logger.info(f'Richiesta eliminazione file: {filepath}')
+    api_logger.info(f'Richiesta eliminazione file: {filepath}', extra={'path': filepath})
     try:
         file_path = MD_DIR / filepath
         if not file_path.exists():
-            api_logger.warning(f'File da eliminare non trovato: {filepath}')
+            api_logger.warning(f'File da eliminare non trovato: {filepath}', extra={'path': filepath})
             return jsonify({'error': 'file_not_found'}), 404
         
         file_path.unlink()
-        api_logger.info(f'✓ File eliminato: {filepath}')
+        api_logger.info(f'✓ File eliminato: {filepath}', extra={'path': filepath})
         
         # Elimina anche l'HTML corrispondente
         html_path = WEB_DIR / Path(filepath).with_suffix('.html')
@@ -242,11 +576,9 @@ def delete_file(filepath):
             html_path.unlink()
         
         # Rigenera preview
-        gen = Path(__file__).resolve().parent / 'regenerate_preview.py'
-        if gen.is_file():
-            subprocess.run([sys.executable, str(gen)], check=False)
+        job = after_mutation([rel_md_path(file_path)], 'delete')
         
-        return jsonify({'ok': True})
+        return jsonify({'ok': True, 'regen': job})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -275,12 +607,10 @@ def rename_file(filepath):
         
         file_path.rename(new_path)
         
-        # Rigenera tutto
-        gen = Path(__file__).resolve().parent / 'regenerate_preview.py'
-        if gen.is_file():
-            subprocess.run([sys.executable, str(gen)], check=False)
+        # Rigenera vecchio e nuovo percorso
+        job = after_mutation([rel_md_path(file_path), rel_md_path(new_path)], 'rename')
         
-        return jsonify({'ok': True, 'new_path': str(new_path.relative_to(MD_DIR))})
+        return jsonify({'ok': True, 'new_path': str(new_path.relative_to(MD_DIR)), 'regen': job})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -317,12 +647,10 @@ def move_file(filepath):
         if old_html.exists():
             old_html.unlink()
         
-        # Rigenera tutto
-        gen = Path(__file__).resolve().parent / 'regenerate_preview.py'
-        if gen.is_file():
-            subprocess.run([sys.executable, str(gen)], check=False)
+        # Rigenera vecchio e nuovo percorso
+        job = after_mutation([rel_md_path(file_path), rel_md_path(new_path)], 'move')
         
-        return jsonify({'ok': True, 'new_path': str(new_path.relative_to(MD_DIR))})
+        return jsonify({'ok': True, 'new_path': str(new_path.relative_to(MD_DIR)), 'regen': job})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -344,6 +672,7 @@ def create_folder():
             return jsonify({'error': 'folder_exists'}), 409
         
         full_path.mkdir(parents=True, exist_ok=True)
+        file_tree.refresh([rel_md_path(full_path)])
         
         return jsonify({'ok': True, 'path': folder_path})
     except Exception as e:
@@ -366,11 +695,9 @@ def delete_folder(folderpath):
             shutil.rmtree(html_folder)
         
         # Rigenera preview
-        gen = Path(__file__).resolve().parent / 'regenerate_preview.py'
-        if gen.is_file():
-            subprocess.run([sys.executable, str(gen)], check=False)
+        job = after_mutation([rel_md_path(folder_path)], 'delete_folder')
         
-        return jsonify({'ok': True})
+        return jsonify({'ok': True, 'regen': job})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -397,105 +724,212 @@ def rename_folder(folderpath):
         
         folder_path.rename(new_path)
         
-        # Rigenera tutto
-        gen = Path(__file__).resolve().parent / 'regenerate_preview.py'
-        if gen.is_file():
-            subprocess.run([sys.executable, str(gen)], check=False)
+        # Rigenera vecchio e nuovo percorso
+        job = after_mutation([rel_md_path(folder_path), rel_md_path(new_path)], 'rename_folder')
         
-        return jsonify({'ok': True, 'new_path': str(new_path.relative_to(MD_DIR))})
+        return jsonify({'ok': True, 'new_path': str(new_path.relative_to(MD_DIR)), 'regen': job})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/regen/<int:job_id>', methods=['GET'])
+def regen_status(job_id):
+    """Stato di un job di rigenerazione"""
+    job = regen_service.status(job_id)
+    if job is None:
+        return jsonify({'error': 'job_not_found'}), 404
+    return jsonify(job)
+
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+# Con gunicorn gthread e waitress ogni stream /api/events occupa un thread per
+# tutta la sua durata: oltre questo limite per processo si risponde 503 e i
+# client ripiegano sul polling, così restano thread liberi per il resto dell'API
+SSE_MAX_STREAMS = int(os.environ.get('APPUNTI_SSE_MAX')
+                      or max(1, int(os.environ.get('APPUNTI_THREADS', '32')) // 2))
+_sse_lock = threading.Lock()
+_sse_streams = 0
+
+def acquire_sse_slot():
+    """True se c'è posto per un altro stream in questo processo"""
+    global _sse_streams
+    with _sse_lock:
+        if _sse_streams >= SSE_MAX_STREAMS:
+            return False
+        _sse_streams += 1
+        return True
+
+def release_sse_slot():
+    global _sse_streams
+    with _sse_lock:
+        _sse_streams -= 1
+
+metrics.collect('appunti_sse_streams', 'Stream /api/events aperti', 'gauge', lambda: _sse_streams)
+
+def sse_params(args, headers):
+    """(types, Last-Event-ID) di una richiesta /api/events da query string e header"""
+    types = {t for t in args.get('types', '').split(',') if t} or None
+    return types, headers.get('Last-Event-ID') or args.get('since') or None
+
+@app.route('/api/events', methods=['GET'])
+def events_stream():
+    """Server-Sent Events: changed/deleted/renamed per percorso e righe di log.
+
+    ?types=changed,deleted filtra i tipi; Last-Event-ID (o ?since=) recupera
+    gli eventi persi durante una riconnessione, o produce 'resync' se non può. Oltre SSE_MAX_STREAMS stream
+    aperti nel processo risponde 503.
+    """
+    types, last_id = sse_params(request.args, request.headers)
+    if not acquire_sse_slot():
+        api_logger.warning(f'Troppi stream /api/events ({SSE_MAX_STREAMS}): il client userà il polling')
+        return jsonify({'error': 'too_many_streams'}), 503, {'Retry-After': '60'}
+
+    def stream():
+        yield 'retry: 3000\n\n'
+        for event in event_bus.listen(last_id, types):
+            yield ': keep-alive\n\n' if event is None else format_sse(event)
+
+    response = Response(stream(), mimetype='text/event-stream', headers=SSE_HEADERS)
+    # close() del server WSGI a fine stream (anche se il client si disconnette)
+    response.call_on_close(release_sse_slot)
+    return response
+
+@app.route('/api/render', methods=['POST'])
+def render_markdown_api():
+    """Markdown -> HTML (id sui titoli, TOC, codice evidenziato) con cache LRU"""
+    data = request.get_json() or {}
+    content = data.get('content', '')
+    if not isinstance(content, str):
+        return jsonify({'error': 'content must be a string'}), 400
+    key, result = render_cache.render(content)
+    if result is None:
+        return jsonify({'error': 'renderer_unavailable'}), 501
+    return jsonify({'hash': key, 'html': result['html'], 'toc': result['toc']})
+
 @app.route('/api/search', methods=['GET'])
 def search_files():
-    """Cerca nei file"""
-    query = request.args.get('q', '').lower()
-    if not query:
+    """Cerca nei file tramite l'indice invertito (parole, prefissi*, "frasi")"""
+    query = request.args.get('q', '')
+    if not query.strip():
         return jsonify({'results': []})
     
-    api_logger.info(f'Ricerca: "{query}"')
-    
-    results = []
-    for md_file in MD_DIR.rglob('*.md'):
-        try:
-            content = md_file.read_text(encoding='utf-8')
-            if query in content.lower() or query in md_file.name.lower():
-                # Trova contesto
-                lines = content.split('\n')
-                matches = []
-                for i, line in enumerate(lines):
-                    if query in line.lower():
-                        start = max(0, i - 1)
-                        end = min(len(lines), i + 2)
-                        context = '\n'.join(lines[start:end])
-                        matches.append({
-                            'line': i + 1,
-                            'context': context[:200]
-                        })
-                        if len(matches) >= 3:
-                            break
-                
-                results.append({
-                    'path': str(md_file.relative_to(MD_DIR)).replace('\\', '/'),
-                    'name': md_file.name,
-                    'matches': matches
-                })
-        except:
-            pass
+    api_logger.info(f'Ricerca: "{query.lower()}"')
     
-    return jsonify({'results': results})
+    try:
+        limit = pagination.parse_limit(request.args.get('limit'), 50, 500)
+    except ValueError:
+        return jsonify({'error': 'invalid_limit'}), 400
+    sort = request.args.get('sort', 'relevance')
+    folder = pagination.normalize_folder(request.args.get('folder'))
+
+    search_index.ensure_loaded()
+    # Recupera in background modifiche fatte fuori dalle API
+    search_index.sync_in_background()
+    try:
+        cursor = pagination.decode_cursor(request.args.get('cursor'))
+        if sort == 'relevance':
+            total, results, next_cursor = search_index.search(query, limit, cursor, folder)
+        else:
+            # Altri ordinamenti: i file trovati, nell'ordine mantenuto dall'indice dei metadati
+            FILE_CACHE.validate()
+
+            def order(paths):
+                total, records, next_cursor = FILE_CACHE.page(sort, limit, cursor, folder, paths)
+                return total, [r['path'] for r in records], next_cursor
+
+            total, results, next_cursor = search_index.search(query, limit, folder=folder, order=order)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({'results': results, 'total': total,
+                    'next_cursor': next_cursor and pagination.encode_cursor(next_cursor)})
+
+@app.route('/api/query', methods=['GET'])
+def query_files():
+    """Documenti per tag (tutti richiesti) e campi del frontmatter, dagli indici in memoria.
+
+    ?tag=a&tag=b&field=data>=2025-01-01&field=voto=18..30&field=autore&sort=-modified&limit=N
+    Con gli ordinamenti name/path/title/modified/words/size anche &folder= e &cursor=.
+    """
+    try:
+        limit = pagination.parse_limit(request.args.get('limit'))
+    except ValueError:
+        return jsonify({'error': 'invalid_limit'}), 400
+    tags = request.args.getlist('tag')
+    filters = request.args.getlist('field')
+    sort = request.args.get('sort', 'name')
+    folder = pagination.normalize_folder(request.args.get('folder'))
+
+    def make_body():
+        total, results, next_cursor = FILE_CACHE.query(
+            tags, filters, sort, limit, pagination.decode_cursor(request.args.get('cursor')), folder)
+        return json.dumps({'results': results, 'total': total,
+                           'next_cursor': next_cursor and pagination.encode_cursor(next_cursor)},
+                          ensure_ascii=False)
+
+    return page_response(make_body)
+
+@app.route('/api/tags', methods=['GET'])
+def list_tags():
+    """Tag con numero di file, dal più usato"""
+    FILE_CACHE.validate()
+    body = json.dumps({'tags': FILE_CACHE.tags()}, ensure_ascii=False).encode('utf-8')
+    return conditional_response(hashlib.sha1(body).hexdigest(), body)
 
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
-    """Ottieni statistiche globali"""
+    """Ottieni statistiche globali (dai metadati in memoria)"""
     try:
-        all_files = list(MD_DIR.rglob('*.md'))
-        total_files = len(all_files)
-        total_words = 0
-        total_size = 0
-        tags_counter = {}
-        recent_files = []
-        
-        for f in all_files:
-            try:
-                stats = f.stat()
-                content = f.read_text(encoding='utf-8')
-                word_count = len(re.findall(r'\b\w+\b', content))
-                total_words += word_count
-                total_size += stats.st_size
-                
-                # Parse tags
-                frontmatter_match = re.match(r'^---\s*\n(.*?)\n---\s*\n', content, re.DOTALL)
-                if frontmatter_match:
-                    fm = frontmatter_match.group(1)
-                    tags_match = re.search(r'tags:\s*\[(.*?)\]', fm)
-                    if tags_match:
-                        tags = [t.strip().strip('"\'') for t in tags_match.group(1).split(',')]
-                        for tag in tags:
-                            tags_counter[tag] = tags_counter.get(tag, 0) + 1
-                
-                recent_files.append({
-                    'path': str(f.relative_to(MD_DIR)).replace('\\', '/'),
-                    'name': f.name,
-                    'modified': stats.st_mtime,
-                    'word_count': word_count
-                })
-            except:
-                pass
-        
-        # Ordina per data modifica
-        recent_files.sort(key=lambda x: x['modified'], reverse=True)
-        
-        return jsonify({
-            'total_files': total_files,
-            'total_words': total_words,
-            'total_size': total_size,
-            'tags': tags_counter,
-            'recent_files': recent_files[:10]
-        })
+        body = json.dumps(FILE_CACHE.stats(), ensure_ascii=False).encode('utf-8')
+        return conditional_response(hashlib.sha1(body).hexdigest(), body)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def metrics_summary():
+    """Riepilogo per stats.html: latenze per route in ms, build, cache e letture"""
+    def ms(value):
+        return round(value * 1000, 3) if value is not None else None
+
+    counts = http_requests.values()
+    sizes = http_response_bytes.values()
+    in_flight = http_in_flight.values()
+    routes = []
+    for (route, method), row in sorted(http_duration.summary().items()):
+        statuses = {status: n for (r, m, status), n in counts.items() if (r, m) == (route, method)}
+        routes.append({
+            'route': route, 'method': method, 'count': row['count'],
+            'errors': sum(n for status, n in statuses.items() if int(status) >= 500),
+            'mean_ms': ms(row['mean']), 'p50_ms': ms(row['p50']),
+            'p95_ms': ms(row['p95']), 'p99_ms': ms(row['p99']),
+            'bytes': sizes.get((route,), 0), 'in_flight': in_flight.get((route,), 0)
+        })
+    build = regen_duration.summary().get((), {})
+    builds = regen_builds.values()
+    return {
+        'pid': os.getpid(),
+        'workers': WORKERS,
+        'routes': routes,
+        'regen': {'builds': build.get('count', 0), 'errors': builds.get(('error',), 0),
+                  'mean_ms': ms(build.get('mean')), 'p95_ms': ms(build.get('p95')),
+                  'queue_depth': regen_service.queue_depth()},
+        'caches': {name: {'hits': hits, 'misses': misses,
+                          'hit_ratio': round(hits / (hits + misses), 3) if hits + misses else None}
+                   for name, (hits, misses) in cache_counters().items()},
+        'reads': {'metadata': {'files': FILE_CACHE.reads, 'bytes': FILE_CACHE.bytes_read},
+                  'search': {'files': search_index.reads, 'bytes': search_index.bytes_read},
+                  **{source: {'bytes': n} for (source,), n in file_read_bytes.values().items()}}
+    }
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Metriche del processo nel formato di Prometheus (?format=json: riepilogo per stats.html)"""
+    if request.args.get('format') == 'json':
+        response = jsonify(metrics_summary())
+    else:
+        response = Response(metrics.render(), mimetype='text/plain')
+        response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
 @app.route('/api/templates', methods=['GET'])
 def get_templates():
     """Ottieni lista template disponibili"""
@@ -516,73 +950,100 @@ def get_templates():
     }
     return jsonify(templates)
 
+def upload_body_limit():
+    """Byte massimi del corpo di /api/upload-image: il margine copre l'overhead multipart"""
+    return image_store.max_bytes + 64 * 1024
+
 @app.route('/api/upload-image', methods=['POST'])
 def upload_image():
-    """Upload di un'immagine"""
+    """Upload di un'immagine (multipart con campo `file` o corpo grezzo con ?name=)"""
+    # Oltre questo limite il body non viene letto (413)
+    request.max_content_length = upload_body_limit()
     try:
-        if 'file' not in request.files:
-            return jsonify({'error': 'no_file'}), 400
-        
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'error': 'empty_filename'}), 400
-        
-        # Crea cartella images se non esiste
-        images_dir = ROOT / 'images'
-        images_dir.mkdir(exist_ok=True)
-        
-        # Salva con nome sicuro
-        filename = datetime.datetime.now().strftime('%Y%m%d-%H%M%S-') + file.filename
-        filepath = images_dir / filename
-        file.save(filepath)
-        
-        return jsonify({
-            'ok': True,
-            'url': f'/images/{filename}',
-            'filename': filename
-        })
+        if request.mimetype == 'multipart/form-data':
+            if 'file' not in request.files:
+                return jsonify({'error': 'no_file'}), 400
+            file = request.files['file']
+            if file.filename == '':
+                return jsonify({'error': 'empty_filename'}), 400
+            filename, stream = file.filename, file.stream
+        else:
+            # Corpo grezzo (usato dall'editor): copiato su disco a blocchi senza parsing
+            filename, stream = request.args.get('name', ''), request.stream
+
+        info = image_store.save(stream, filename)
+        api_logger.info(f'Immagine caricata: {info["filename"]}'
+                        f'{" (già presente)" if info["deduplicated"] else ""}',
+                        extra={'path': info['filename']})
+        return jsonify(dict(info, ok=True))
+    except UploadError as e:
+        body = {'error': e.code}
+        if e.status == 413:
+            body['max_bytes'] = image_store.max_bytes
+        return jsonify(body), e.status
+    except RequestEntityTooLarge:
+        return jsonify({'error': 'too_large', 'max_bytes': image_store.max_bytes}), 413
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/images/<path:filename>')
 def serve_image(filename):
-    """Serve immagini"""
-    images_dir = ROOT / 'images'
-    return send_from_directory(str(images_dir), filename)
+    """Serve immagini; le varianti mancanti vengono generate (o si serve l'originale)"""
+    name = image_store.resolve(filename)
+    response = send_from_directory(str(image_store.images_dir), name)
+    # Nome da hash: il contenuto di quell'URL non cambia mai
+    if name == filename and HASH_NAME_RE.fullmatch(name):
+        response.headers['Cache-Control'] = CACHE_IMMUTABLE
+    else:
+        response.headers['Cache-Control'] = CACHE_IMAGES
+    return response
+
+LOG_SOURCES = {'api': API_LOG_FILE, 'watcher': LOG_DIR / 'watcher.log'}
+
+def parse_time_arg(value):
+    """Parametro temporale (secondi epoch o data ISO) -> secondi epoch"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
 
 @app.route('/api/logs', methods=['GET'])
 def get_logs():
-    """Ottieni i log dei server"""
+    """Ottieni i log dei server.
+
+    Senza `since` ritorna le ultime 100 righe di ogni log (lette a ritroso dalla
+    fine del file). Con `since=<cursor>` (il `cursor` della risposta precedente)
+    ritorna solo le righe nuove. `source=api|watcher` limita la lettura a un log;
+    `level` (livello minimo), `from` e `to` (epoch o ISO) filtrano le righe: per
+    l'API la query è servita dai record strutturati in memoria.
+    """
     try:
+        level = request.args.get('level')
+        try:
+            time_from = parse_time_arg(request.args.get('from'))
+            time_to = parse_time_arg(request.args.get('to'))
+        except ValueError:
+            return jsonify({'error': 'invalid_time', 'api': [], 'watcher': []}), 400
+        filtered = bool(level or time_from is not None or time_to is not None)
+        cursors = decode_cursor(request.args.get('since'))
+        source = request.args.get('source')
+        sources = [source] if source in LOG_SOURCES else list(LOG_SOURCES)
         logs_data = {'api': [], 'watcher': []}
-        
-        # Leggi log API server
-        if API_LOG_FILE.exists():
-            with open(API_LOG_FILE, 'r', encoding='utf-8') as f:
-                for line in f.readlines()[-100:]:  # Ultimi 100 messaggi
-                    if line.strip():
-                        parts = line.strip().split(' - ', 2)
-                        if len(parts) >= 3:
-                            logs_data['api'].append({
-                                'timestamp': parts[0],
-                                'level': parts[1],
-                                'message': parts[2]
-                            })
-        
-        # Leggi log Watcher
-        watcher_log = LOG_DIR / 'watcher.log'
-        if watcher_log.exists():
-            with open(watcher_log, 'r', encoding='utf-8') as f:
-                for line in f.readlines()[-100:]:
-                    if line.strip():
-                        parts = line.strip().split(' - ', 2)
-                        if len(parts) >= 3:
-                            logs_data['watcher'].append({
-                                'timestamp': parts[0],
-                                'level': parts[1],
-                                'message': parts[2]
-                            })
-        
+        for name in sources:
+            if name in cursors:
+                lines, cursors[name] = read_since(LOG_SOURCES[name], cursors[name])
+            elif filtered and name == 'api':
+                cursors[name] = end_cursor(API_LOG_FILE)
+                logs_data[name] = api_log_store.query(level, time_from, time_to)
+                continue
+            else:
+                # Ultimi 100 messaggi (più righe se poi vanno filtrate)
+                lines, cursors[name] = tail_lines(LOG_SOURCES[name], 1000 if filtered else 100)
+            entries = [entry for entry in map(parse_log_line, lines) if entry]
+            logs_data[name] = filter_entries(entries, level, time_from, time_to)[-100:] if filtered else entries
+        logs_data['cursor'] = encode_cursor(cursors)
         return jsonify(logs_data)
     except Exception as e:
         return jsonify({'error': str(e), 'api': [], 'watcher': []}), 500
@@ -591,25 +1052,18 @@ def get_logs():
 def clear_logs():
     """Pulisci tutti i log"""
     try:
-        # Chiudi e riapri i file handler per svuotare i file
-        for handler in api_logger.handlers:
-            if isinstance(handler, RotatingFileHandler):
-                handler.close()
-                api_logger.removeHandler(handler)
+        # Chiudi il file handler per svuotare il file: viene riaperto alla prossima riga
+        file_handler.close()
+        api_log_store.clear()
         
         # Svuota i file di log
         if API_LOG_FILE.exists():
             API_LOG_FILE.write_text('', encoding='utf-8')
         
-        watcher_log = LOG_DIR / 'watcher.log'
+        watcher_log = LOG_SOURCES['watcher']
         if watcher_log.exists():
             watcher_log.write_text('', encoding='utf-8')
         
-        # Ricrea il file handler per API
-        new_handler = RotatingFileHandler(str(API_LOG_FILE), maxBytes=1024*1024, backupCount=3, encoding='utf-8')
-        new_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-        api_logger.addHandler(new_handler)
-        
         api_logger.info('Log cancellati')
         
         return jsonify({'ok': True})
@@ -625,9 +1079,12 @@ if __name__ == '__main__':
     
     api_logger.info('=== API Server avviato su http://localhost:5000 ===')
     print(f'Serving web/ and API on http://localhost:5000')
+    print('Server di sviluppo: per la produzione usare scripts/serve.py')
+    start_background_services()
     try:
-        app.run(host='0.0.0.0', port=5000, debug=False)
+        app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
     finally:
+        stop_background_services()
         api_logger.info('Server Flask terminato')
         # Rimuovi file PID alla chiusura
         if pid_file.exists():
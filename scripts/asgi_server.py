@@ -0,0 +1,305 @@
+"""
+asgi_server.py
+Variante asyncio (ASGI) dell'API server, pensata per molte connessioni SSE aperte.
+
+Uso:
+  python scripts/asgi_server.py --port 5000 --io-threads 16
+  cd scripts && uvicorn asgi_server:app --port 5000
+
+Espone le stesse route di api_server.py. /api/events è servito direttamente
+nel loop asyncio: un viewer in attesa di eventi costa una coroutine, non un
+thread, quindi un solo processo regge migliaia di connessioni inattive. Tutte
+le altre richieste eseguono l'handler Flask in un ThreadPoolExecutor di
+dimensione fissa: letture e scritture su disco, scansioni e render non
+bloccano mai il loop, e sotto carico le richieste si accodano invece di
+moltiplicare i thread. Le risposte Flask sono inviate a pezzi man mano che
+l'iteratore WSGI li produce (file grandi, risposte in streaming), senza
+bufferizzarle per intero. La rigenerazione resta un job in background
+(RegenerationService) e i suoi eventi arrivano agli stream SSE.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import parse_qsl
+import argparse
+import asyncio
+import io
+import json
+import os
+import queue
+import sys
+
+os.environ.setdefault('APPUNTI_WORKERS', '1')
+
+from api_server import (SSE_HEADERS, app as flask_app, api_logger, event_bus, image_store, sse_params,
+                        start_background_services, stop_background_services, upload_body_limit)
+from event_bus import format_sse
+
+SSE_KEEPALIVE = 15.0   # secondi tra i commenti di keep-alive
+
+
+class AsgiApp:
+    """App ASGI: SSE nativo in asyncio, il resto all'app Flask nel pool di thread"""
+
+    def __init__(self, wsgi_app, io_threads=16):
+        self.wsgi_app = wsgi_app
+        self.io_threads = io_threads
+        self._executor = None
+
+    @property
+    def executor(self):
+        # Creato alla prima richiesta (o all'avvio): main() può ancora cambiare io_threads
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.io_threads, thread_name_prefix='asgi-io')
+        return self._executor
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            if scope['path'] == '/api/events' and scope['method'] == 'GET':
+                await self.events(scope, receive, send)
+            else:
+                await self.call_wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await loop.run_in_executor(self.executor, start_background_services)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await loop.run_in_executor(self.executor, stop_background_services)
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def events(self, scope, receive, send):
+        """Stream SSE: attende i publish del bus senza occupare thread"""
+        headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope['headers']}
+        args = dict(parse_qsl(scope['query_string'].decode('latin-1')))
+        types, last_id = sse_params(args, {'Last-Event-ID': headers.get('last-event-id')})
+
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+
+        def notify():
+            loop.call_soon_threadsafe(wake.set)
+
+        event_bus.subscribe(notify)
+        disconnected = asyncio.ensure_future(self._wait_disconnect(receive))
+        try:
+            response_headers = [(b'content-type', b'text/event-stream; charset=utf-8'),
+                                (b'access-control-allow-origin', b'*')]
+            response_headers.extend((k.lower().encode(), v.encode()) for k, v in SSE_HEADERS.items())
+            await send({'type': 'http.response.start', 'status': 200, 'headers': response_headers})
+            await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+            last_id, resync = event_bus.resume(last_id)
+            if resync:
+                await send({'type': 'http.response.body', 'body': format_sse(resync).encode('utf-8'),
+                            'more_body': True})
+            while not disconnected.done():
+                # clear prima di leggere: un publish successivo risveglia comunque
+                wake.clear()
+                events, last_id = event_bus.events_since(last_id, types)
+                if events:
+                    body = ''.join(format_sse(e) for e in events).encode('utf-8')
+                    await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+                    continue
+                waiter = asyncio.ensure_future(wake.wait())
+                done, _ = await asyncio.wait({waiter, disconnected}, timeout=SSE_KEEPALIVE,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                waiter.cancel()
+                if not done:
+                    await send({'type': 'http.response.body', 'body': b': keep-alive\n\n', 'more_body': True})
+        except OSError:
+            pass   # client già disconnesso
+        finally:
+            event_bus.unsubscribe(notify)
+            disconnected.cancel()
+
+    @staticmethod
+    async def _wait_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def call_wsgi(self, scope, receive, send):
+        """Esegue l'handler Flask nel pool e invia la risposta a pezzi.
+
+        Il corpo della richiesta non viene accumulato: arriva all'handler come
+        wsgi.input man mano che il client lo invia (vedi RequestBody).
+        """
+        length = next((v for k, v in scope['headers'] if k == b'content-length'), None)
+        if scope['path'] == '/api/upload-image' and length and length.isdigit() and int(length) > upload_body_limit():
+            # Come in upload_image, ma prima di ricevere il corpo
+            await self.send_json(send, 413, {'error': 'too_large', 'max_bytes': image_store.max_bytes})
+            return
+        loop = asyncio.get_running_loop()
+        body = RequestBody(loop)
+        feeding = asyncio.ensure_future(body.feed(receive))
+        environ = self.build_environ(scope, io.BufferedReader(body))
+        try:
+            status, headers, first, chunks, result = await loop.run_in_executor(
+                self.executor, self.run_wsgi, environ)
+        finally:
+            # Corpo non letto per intero dall'handler (es. errore): il resto si scarta
+            feeding.cancel()
+        try:
+            await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+            length = next((v for k, v in headers if k == b'content-length'), None)
+            if first is None or (length is not None and int(length) == len(first)):
+                # Risposta completa nel primo pezzo (il caso comune): un solo invio
+                await send({'type': 'http.response.body', 'body': first or b''})
+                return
+            await send({'type': 'http.response.body', 'body': first, 'more_body': True})
+            while True:
+                chunk = await loop.run_in_executor(self.executor, next, chunks, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        except OSError:
+            pass   # client disconnesso durante l'invio
+        finally:
+            if hasattr(result, 'close'):
+                await loop.run_in_executor(self.executor, result.close)
+
+    def run_wsgi(self, environ):
+        """Chiamata WSGI (nel thread del pool): (status, header ASGI, primo pezzo,
+        iteratore dei pezzi restanti, risposta WSGI da chiudere a fine invio).
+
+        Il primo pezzo è None se il corpo è vuoto.
+        """
+        started = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1'))
+                                  for k, v in response_headers]
+
+        result = self.wsgi_app(environ, start_response)
+        chunks = iter(result)
+        first = next(chunks, None)
+        # Il pezzo vuoto di alcuni iteratori non conta come primo
+        while first == b'':
+            first = next(chunks, None)
+        return started['status'], started['headers'], first, chunks, result
+
+    @staticmethod
+    async def send_json(send, status, data):
+        body = json.dumps(data).encode('utf-8')
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json'),
+                                (b'content-length', str(len(body)).encode())]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    @staticmethod
+    def build_environ(scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_NAME': str(server[0]),
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+            'REMOTE_ADDR': client[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.input_terminated': True,   # senza Content-Length si legge fino alla fine del corpo
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False
+        }
+        for key, value in scope['headers']:
+            name = key.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[name] = value
+            else:
+                name = 'HTTP_' + name
+                environ[name] = f'{environ[name]},{value}' if name in environ else value
+        return environ
+
+
+class RequestBody(io.RawIOBase):
+    """wsgi.input alimentato dai messaggi http.request del loop e letto dal thread del pool.
+
+    Al massimo `max_chunks` pezzi in attesa: se l'handler legge più lentamente
+    di quanto il client invia, feed() smette di ricevere (contropressione).
+    """
+
+    def __init__(self, loop, max_chunks=8):
+        self._loop = loop
+        self._queue = queue.Queue()
+        self._space = asyncio.Semaphore(max_chunks)
+        self._buffer = b''
+        self._eof = False
+
+    async def feed(self, receive):
+        try:
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    break
+                chunk = message.get('body', b'')
+                if chunk:
+                    await self._space.acquire()
+                    self._queue.put(chunk)
+                if not message.get('more_body'):
+                    break
+        finally:
+            self._queue.put(None)   # fine del corpo (anche se il client si disconnette)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._buffer and not self._eof:
+            chunk = self._queue.get()
+            if chunk is None:
+                self._eof = True
+            else:
+                self._buffer = chunk
+                self._loop.call_soon_threadsafe(self._space.release)
+        n = min(len(buffer), len(self._buffer))
+        buffer[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+# Per `uvicorn asgi_server:app`; main() usa la stessa app con --io-threads
+app = AsgiApp(flask_app, io_threads=int(os.environ.get('APPUNTI_IO_THREADS', '16')))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='API server asyncio (ASGI) con uvicorn')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--io-threads', type=int, default=16,
+                        help='thread per gli handler (I/O su disco); gli stream SSE non ne usano')
+    args = parser.parse_args(argv)
+    try:
+        import uvicorn
+    except ImportError:
+        print('uvicorn non installato. Installa con: python -m pip install uvicorn')
+        sys.exit(1)
+
+    app.io_threads = args.io_threads
+    pid_file = Path(__file__).resolve().parent.parent / 'api_server.pid'
+    pid_file.write_text(str(os.getpid()))
+    api_logger.info(f'=== API Server (asyncio) avviato su http://localhost:{args.port} ===')
+    try:
+        uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+    finally:
+        if pid_file.exists():
+            pid_file.unlink()
+
+
+if __name__ == '__main__':
+    main()
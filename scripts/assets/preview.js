@@ -0,0 +1,312 @@
+// Script di preview.html (indice dei documenti)
+
+// Gestione tema
+function setTheme(theme) {
+  document.documentElement.setAttribute('data-theme', theme);
+  localStorage.setItem('theme', theme);
+  document.querySelectorAll('.theme-toggle button').forEach(b => {
+    b.classList.toggle('active', b.dataset.theme === theme);
+  });
+}
+const savedTheme = localStorage.getItem('theme') || 'dark';
+setTheme(savedTheme);
+
+// Keyboard shortcuts
+document.addEventListener('keydown', e => {
+  if (e.key === '/' && e.target.tagName !== 'INPUT') {
+    e.preventDefault();
+    document.getElementById('search-input').focus();
+  }
+  if (e.key === 'Escape') {
+    document.getElementById('search-input').blur();
+    document.getElementById('search-input').value = '';
+    showTree(true);
+    filterFiles('');
+  }
+  if (e.key === 'n' && e.ctrlKey) {
+    e.preventDefault();
+    window.location.href = 'editor.html';
+  }
+});
+
+// Ricerca
+const searchInput = document.getElementById('search-input');
+let searchTimeout;
+searchInput.addEventListener('input', e => {
+  clearTimeout(searchTimeout);
+  searchTimeout = setTimeout(() => filterFiles(e.target.value), 300);
+});
+
+// Ricerca: i risultati vengono dall'indice del server (/api/search); senza
+// server si filtra per testo l'albero, caricando prima tutte le cartelle
+const SEARCH_LIMIT = 200;
+let searchGeneration = 0;
+
+async function filterFiles(query) {
+  query = query.toLowerCase();
+  const generation = ++searchGeneration;
+  if (!query) {
+    showTree(true);
+  } else {
+    try {
+      const res = await fetch(`/api/search?limit=${SEARCH_LIMIT}&q=` + encodeURIComponent(query));
+      if (!res.ok) throw new Error(res.status);
+      const data = await res.json();
+      // Nel frattempo è stata digitata un'altra ricerca
+      if (generation === searchGeneration) showRecords(data.results);
+      return;
+    } catch (e) {
+      await loadAllFolders();
+      if (generation !== searchGeneration) return;
+    }
+  }
+  const items = document.querySelectorAll('.file-item');
+  let visibleCount = 0;
+
+  items.forEach(item => {
+    const text = item.textContent.toLowerCase();
+    const match = text.includes(query);
+    item.style.display = match ? '' : 'none';
+    if (match) visibleCount++;
+  });
+
+  if (query) {
+    document.querySelectorAll('.folder-content').forEach(f => {
+      f.classList.toggle('open', Array.from(f.querySelectorAll('.file-item')).some(i => i.style.display !== 'none'));
+    });
+  }
+
+  document.getElementById('no-results').style.display = visibleCount === 0 ? 'block' : 'none';
+  document.getElementById('file-list').style.display = visibleCount === 0 ? 'none' : 'block';
+}
+
+// Mostra come lista piatta i record restituiti dal server
+function showRecords(records) {
+  const view = sortedView();
+  view.innerHTML = '';
+  records.forEach(r => view.appendChild(fileItem(r)));
+  showTree(false);
+  document.getElementById('no-results').style.display = records.length === 0 ? 'block' : 'none';
+  document.getElementById('file-list').style.display = records.length === 0 ? 'none' : 'block';
+}
+
+// Tag cloud: i file col tag vengono dall'indice del server (/api/query),
+// il filtro sul testo resta per la pagina aperta senza server
+document.querySelectorAll('.tag-cloud-item').forEach(tag => {
+  tag.addEventListener('click', async () => {
+    searchInput.value = tag.textContent;
+    const generation = ++searchGeneration;
+    try {
+      const res = await fetch('/api/query?limit=1000&tag=' + encodeURIComponent(tag.textContent));
+      if (!res.ok) throw new Error(res.status);
+      const data = await res.json();
+      if (generation === searchGeneration) showRecords(data.results);
+    } catch (e) {
+      filterFiles(tag.textContent);
+    }
+  });
+});
+
+// Cartelle: preview.html contiene solo il primo livello, il contenuto di ogni
+// cartella è un frammento in _tree/ caricato alla prima apertura
+const folderLoads = new WeakMap();
+
+function loadFolder(content, retry) {
+  const state = content.dataset.loaded;
+  if (state === 'loading') return folderLoads.get(content);
+  if (!content.dataset.src || state === 'yes' || (state === 'error' && !retry)) return Promise.resolve();
+  content.dataset.loaded = 'loading';
+  const load = fetch(content.dataset.src)
+    .then(res => {
+      if (!res.ok) throw new Error(res.status);
+      return res.text();
+    })
+    .then(text => {
+      content.innerHTML = text;
+      content.dataset.loaded = 'yes';
+    })
+    .catch(() => {
+      content.innerHTML = '<div class="empty">Cartella non disponibile (serve il server)</div>';
+      content.dataset.loaded = 'error';
+    });
+  folderLoads.set(content, load);
+  return load;
+}
+
+// Carica tutte le cartelle (un livello alla volta), per filtri e ordinamenti nel browser
+async function loadAllFolders() {
+  let pending;
+  while ((pending = Array.from(document.querySelectorAll('.folder-content[data-src]:not([data-loaded="yes"]):not([data-loaded="error"])'))).length) {
+    await Promise.all(pending.map(f => loadFolder(f)));
+  }
+}
+
+async function toggleFolder(id) {
+  const folder = document.getElementById(id);
+  if (!folder) return;
+  if (!folder.classList.contains('open')) await loadFolder(folder, true);
+  folder.classList.toggle('open');
+}
+
+// Ordinamento: per data e parole l'ordine viene dal server (/api/files?sort=),
+// a pagine con cursore; il nome ripristina l'albero delle cartelle
+const SORT_PARAMS = { date: '-modified', words: '-words' };
+const SORT_PAGE = 200;
+let sortGeneration = 0;
+
+function sortedView() {
+  let view = document.getElementById('sorted-list');
+  if (!view) {
+    view = document.createElement('div');
+    view.id = 'sorted-list';
+    document.getElementById('file-list').appendChild(view);
+  }
+  return view;
+}
+
+function showTree(visible) {
+  const list = document.getElementById('file-list');
+  Array.from(list.children).forEach(child => {
+    if (child.tagName !== 'H3' && child.id !== 'sorted-list') child.style.display = visible ? '' : 'none';
+  });
+  sortedView().style.display = visible ? 'none' : '';
+}
+
+function fileItem(file) {
+  const item = document.createElement('a');
+  item.className = 'file-item';
+  item.href = file.path.replace(/\.md$/i, '.html');
+  // I risultati di /api/search hanno il contesto delle occorrenze al posto dei metadati
+  let meta = file.matches && file.matches.length ? file.matches[0].context : file.path;
+  if (file.word_count !== undefined) {
+    item.dataset.words = file.word_count;
+    item.dataset.readtime = file.read_time;
+    item.dataset.modified = file.modified;
+    meta = `${file.word_count} parole • ${file.read_time} min`;
+  }
+  const parts = [['file-icon', '📄'], ['file-name', file.name], ['file-meta', meta]];
+  parts.forEach(([cls, text]) => {
+    const span = document.createElement('span');
+    span.className = cls;
+    span.textContent = text;
+    item.appendChild(span);
+  });
+  if (file.tags && file.tags.length) {
+    const tags = document.createElement('span');
+    tags.className = 'file-tags';
+    file.tags.forEach(t => {
+      const tag = document.createElement('span');
+      tag.className = 'tag';
+      tag.textContent = t;
+      tags.appendChild(tag);
+    });
+    item.appendChild(tags);
+  }
+  return item;
+}
+
+async function loadSortedPage(sort, cursor, generation) {
+  let url = `/api/files?sort=${sort}&limit=${SORT_PAGE}`;
+  if (cursor) url += '&cursor=' + encodeURIComponent(cursor);
+  const res = await fetch(url);
+  if (!res.ok) throw new Error(res.status);
+  const data = await res.json();
+  // Nel frattempo è stato scelto un altro ordinamento
+  if (generation !== sortGeneration) return;
+  const view = sortedView();
+  const more = document.getElementById('load-more');
+  if (more) more.remove();
+  data.files.forEach(f => view.appendChild(fileItem(f)));
+  if (data.next_cursor) {
+    const button = document.createElement('button');
+    button.id = 'load-more';
+    button.className = 'filter-btn';
+    button.textContent = `Carica altri (${view.children.length} di ${data.total})`;
+    button.onclick = () => loadSortedPage(sort, data.next_cursor, generation).catch(() => {});
+    view.appendChild(button);
+  }
+}
+
+async function sortBy(type) {
+  document.querySelectorAll('.filter-btn').forEach(b => b.classList.remove('active'));
+  event.target.classList.add('active');
+  const generation = ++sortGeneration;
+  searchGeneration++;
+
+  if (!SORT_PARAMS[type]) {
+    showTree(true);
+    return;
+  }
+  const view = sortedView();
+  view.innerHTML = '';
+  showTree(false);
+  try {
+    await loadSortedPage(SORT_PARAMS[type], null, generation);
+  } catch (e) {
+    // Senza server: copie delle voci dell'albero ordinate nel browser
+    await loadAllFolders();
+    if (generation !== sortGeneration) return;
+    const items = Array.from(document.querySelectorAll('#file-list .file-item')).filter(el => !view.contains(el));
+    const key = type === 'date' ? (el => parseFloat(el.dataset.modified)) : (el => parseInt(el.dataset.words));
+    items.sort((a, b) => key(b) - key(a));
+    view.innerHTML = '';
+    items.forEach(item => view.appendChild(item.cloneNode(true)));
+  }
+}
+
+function showAll() {
+  searchInput.value = '';
+  showTree(true);
+  filterFiles('');
+  document.querySelectorAll('.filter-btn').forEach(b => b.classList.remove('active'));
+  event.target.classList.add('active');
+}
+
+// Tabs
+function switchTab(tab) {
+  document.querySelectorAll('.tab').forEach(t => t.classList.remove('active'));
+  document.querySelectorAll('.tab-content').forEach(t => t.classList.remove('active'));
+  event.target.classList.add('active');
+  document.getElementById(tab + '-tab').classList.add('active');
+}
+
+// Recenti e Preferiti
+function loadRecents() {
+  const recent = JSON.parse(localStorage.getItem('recentFiles') || '[]');
+  const container = document.getElementById('recent-list');
+  if (recent.length === 0) {
+    container.innerHTML = '<div class="empty">Nessun file recente</div>';
+    return;
+  }
+  container.innerHTML = recent.slice(0, 10).map(path => 
+    `<a href="${path.replace(/\.md$/i, '.html')}" class="recent-item">
+      <span>📄</span>
+      <span>${path.split('/').pop()}</span>
+    </a>`
+  ).join('');
+}
+
+function loadFavorites() {
+  const favs = JSON.parse(localStorage.getItem('favorites') || '[]');
+  const container = document.getElementById('fav-list');
+  if (favs.length === 0) {
+    container.innerHTML = '<div class="empty">Nessun preferito</div>';
+    return;
+  }
+  container.innerHTML = favs.map(path => 
+    `<a href="${path.replace(/\.md$/i, '.html')}" class="fav-item">
+      <span>⭐</span>
+      <span>${path.split('/').pop()}</span>
+    </a>`
+  ).join('');
+}
+
+loadRecents();
+loadFavorites();
+
+// Check server live
+fetch('/api/files?depth=0')
+  .then(() => {
+    document.getElementById('live-indicator').innerHTML = '🟢 Live';
+  })
+  .catch(() => {});
@@ -0,0 +1,158 @@
+// Script condiviso dei viewer generati da regenerate_preview.py.
+// Percorso e nome del file arrivano dagli attributi data-* del <body>.
+
+// Gestione tema
+function setTheme(theme) {
+  document.documentElement.setAttribute('data-theme', theme);
+  localStorage.setItem('theme', theme);
+  document.querySelectorAll('.theme-toggle button').forEach(b => {
+    b.classList.toggle('active', b.dataset.theme === theme);
+  });
+}
+const savedTheme = localStorage.getItem('theme') || 'dark';
+setTheme(savedTheme);
+
+// Gestione code theme
+function changeCodeTheme(theme) {
+  document.documentElement.setAttribute('data-code-theme', theme);
+  const link = document.getElementById('hljs-theme');
+  if (link) link.href = `https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.8.0/styles/${theme}.min.css`;
+  localStorage.setItem('codeTheme', theme);
+}
+const savedCodeTheme = localStorage.getItem('codeTheme') || 'atom-one-dark';
+document.getElementById('hljs-selector').value = savedCodeTheme;
+changeCodeTheme(savedCodeTheme);
+
+const content = document.getElementById('content');
+
+// Render markdown nel browser, solo se il generatore non ha potuto farlo lato server
+const mdSource = document.getElementById('md-content');
+if (mdSource && window.marked) {
+  marked.setOptions({ headerIds: true, mangle: false });
+  content.innerHTML = marked.parse(mdSource.textContent);
+  document.querySelectorAll('pre code').forEach(el => hljs.highlightElement(el));
+}
+
+// Genera TOC (se non è già stata generata lato server)
+const tocList = document.getElementById('toc-list');
+if (!tocList.children.length) {
+  content.querySelectorAll('h1, h2, h3').forEach(h => {
+    const li = document.createElement('li');
+    li.className = 'level-' + h.tagName.substring(1);
+    const a = document.createElement('a');
+    a.textContent = h.textContent;
+    a.href = '#' + h.id;
+    li.appendChild(a);
+    tocList.appendChild(li);
+  });
+}
+tocList.querySelectorAll('a').forEach(a => {
+  a.onclick = (e) => {
+    e.preventDefault();
+    const target = document.getElementById(decodeURIComponent(a.hash.substring(1)));
+    if (target) target.scrollIntoView({ behavior: 'smooth', block: 'start' });
+  };
+});
+
+// Favoriti
+function toggleFavorite() {
+  let favs = JSON.parse(localStorage.getItem('favorites') || '[]');
+  const index = favs.indexOf(path);
+  if (index > -1) {
+    favs.splice(index, 1);
+    document.getElementById('fav-btn').textContent = '⭐';
+  } else {
+    favs.push(path);
+    document.getElementById('fav-btn').textContent = '⭐✨';
+  }
+  localStorage.setItem('favorites', JSON.stringify(favs));
+}
+const path = document.body.dataset.path;
+const favs = JSON.parse(localStorage.getItem('favorites') || '[]');
+if (favs.includes(path)) {
+  document.getElementById('fav-btn').textContent = '⭐✨';
+}
+
+// Export PDF
+function exportPDF() {
+  window.print();
+}
+
+// Recent files
+let recent = JSON.parse(localStorage.getItem('recentFiles') || '[]');
+recent = recent.filter(r => r !== path);
+recent.unshift(path);
+recent = recent.slice(0, 20);
+localStorage.setItem('recentFiles', JSON.stringify(recent));
+
+// Auto-reload: notifiche push dal server (/api/events); il polling HEAD
+// condizionale (ETag) parte solo se la connessione SSE non è disponibile
+let lastCheck = Date.now();
+let knownTag = null;
+let pollTimer = null;
+
+function reloadViewer() {
+  if (Notification.permission === 'granted') {
+    new Notification('File aggiornato', {body: document.body.dataset.name});
+  }
+  location.reload();
+}
+
+function pollForChanges() {
+  fetch(location.href, {method: 'HEAD', cache: 'no-cache'})
+    .then(res => {
+      const lastMod = res.headers.get('last-modified');
+      const tag = res.headers.get('etag');
+      const changed = (knownTag && tag && tag !== knownTag) ||
+        (lastMod && new Date(lastMod).getTime() > lastCheck);
+      knownTag = tag || knownTag;
+      if (changed) reloadViewer();
+    }).catch(() => {});
+}
+
+function startPolling() {
+  if (!pollTimer) pollTimer = setInterval(pollForChanges, 2000);
+}
+
+function stopPolling() {
+  if (pollTimer) clearInterval(pollTimer);
+  pollTimer = null;
+}
+
+function connectEvents() {
+  const events = new EventSource('/api/events?types=changed,deleted,renamed');
+  events.onopen = stopPolling;
+  events.onerror = () => {
+    // EventSource ritenta da solo, intanto si fa polling; dopo un 503 (troppi
+    // stream aperti sul server) non ritenta più: nuovo tentativo fra un minuto
+    startPolling();
+    if (events.readyState === EventSource.CLOSED) setTimeout(connectEvents, 60000);
+  };
+  // Eventi persi non recuperabili (server riavviato, altro worker): si ricontrolla il file
+  events.addEventListener('resync', pollForChanges);
+  events.addEventListener('changed', e => {
+    if (JSON.parse(e.data).path === path) reloadViewer();
+  });
+  events.addEventListener('renamed', e => {
+    const data = JSON.parse(e.data);
+    if (data.from === path) location.href = '/' + encodeURI(data.url);
+  });
+  events.addEventListener('deleted', e => {
+    if (JSON.parse(e.data).path === path) {
+      events.close();
+      document.body.insertAdjacentHTML('afterbegin',
+        '<div style="background:#c0392b;color:#fff;padding:8px 16px;text-align:center">⚠️ Questo file è stato eliminato</div>');
+    }
+  });
+}
+
+if (window.EventSource && location.protocol.startsWith('http')) {
+  connectEvents();
+} else {
+  startPolling();
+}
+
+// Chiedi permesso notifiche
+if (Notification.permission === 'default') {
+  Notification.requestPermission();
+}
@@ -1,14 +1,26 @@
 """
 auto_regen_watcher.py
-Guarda la cartella md/ e invoca scripts/regenerate_preview.py quando cambiano i file.
+Guarda la cartella md/ e rigenera i viewer (regenerate_preview.build) quando cambiano i file.
+
+Gli eventi vengono raccolti per percorso (creati, modificati, eliminati,
+spostati) e ogni blocco diventa una build incrementale mirata. Le build
+passano da RegenerationService: al massimo una in esecuzione, e i blocchi
+arrivati nel frattempo vengono uniti in un'unica build successiva.
+
+Il generatore gira nel processo del watcher: moduli importati, manifest e
+frammenti HTML restano in memoria tra un evento e l'altro, quindi una
+modifica costa solo il render dei file toccati. Finché il watcher è attivo
+tiene cache/watcher.lock: i worker dell'API lasciano a lui le modifiche
+fatte fuori dall'API.
 """
 import time
 import threading
-import subprocess
-import sys
 from pathlib import Path
-import logging
-from logging.handlers import RotatingFileHandler
+
+from file_lock import hold
+from log_setup import setup_logging
+from regen_service import RegenerationService
+import regenerate_preview
 
 try:
     from watchdog.observers import Observer
@@ -20,37 +32,35 @@ except Exception:
 ROOT = Path(__file__).resolve().parent.parent
 MD_DIR = ROOT / 'md'
 LOG_DIR = ROOT / 'logs'
-SCRIPT = ROOT / 'scripts' / 'regenerate_preview.py'
-CMD = f'"{sys.executable}" "{SCRIPT.as_posix()}"'
 
 # Setup logging
 LOG_DIR.mkdir(exist_ok=True)
 WATCHER_LOG_FILE = LOG_DIR / 'watcher.log'
 
-watcher_logger = logging.getLogger('watcher')
-watcher_logger.setLevel(logging.INFO)
-watcher_logger.handlers.clear()  # Rimuovi handler esistenti
-
-# Console handler
-console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setFormatter(logging.Formatter('%(message)s'))
-watcher_logger.addHandler(console_handler)
+# Console e file (testo o JSON lines) scritti dal thread del QueueListener
+watcher_logger, _ = setup_logging('watcher', WATCHER_LOG_FILE)
 
-# File handler
-file_handler = RotatingFileHandler(str(WATCHER_LOG_FILE), maxBytes=1024*1024, backupCount=3, encoding='utf-8')
-file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-watcher_logger.addHandler(file_handler)
+def rel_path(path):
+    """Percorso relativo a md/ (None se è fuori da md/: l'evento va ignorato)"""
+    try:
+        return Path(path).resolve().relative_to(MD_DIR).as_posix()
+    except ValueError:
+        return None
 
 class DebouncedHandler(FileSystemEventHandler):
+    """Accumula i percorsi cambiati e li passa in blocco all'azione dopo `delay` secondi di quiete"""
+
     def __init__(self, action, delay=0.25):
         super().__init__()
-        self.action = action
+        self.action = action   # action(percorsi relativi a md/)
         self.delay = delay
+        self._paths = set()
         self._timer = None
         self._lock = threading.Lock()
 
-    def _schedule(self):
+    def _schedule(self, *paths):
         with self._lock:
+            self._paths.update(paths)
             if self._timer:
                 self._timer.cancel()
             self._timer = threading.Timer(self.delay, self._run_action)
@@ -58,51 +68,50 @@ class DebouncedHandler(FileSystemEventHandler):
             self._timer.start()
 
     def _run_action(self):
+        with self._lock:
+            paths, self._paths = self._paths, set()
         try:
-            self.action()
+            self.action(paths)
         except Exception as e:
-            print(f'Errore durante l''azione: {e}')
+            watcher_logger.error(f'Errore durante l\'azione: {e}')
+
+    @staticmethod
+    def _relevant(event, path):
+        """Percorso relativo a md/ se l'evento conta, altrimenti None.
+
+        Le cartelle contano per creazioni, eliminazioni e spostamenti (contengono .md).
+        """
+        if event.is_directory or path.lower().endswith('.md'):
+            return rel_path(path)
+        return None
 
     def on_created(self, event):
-        if not event.is_directory and event.src_path.lower().endswith('.md'):
-            msg = f'File creato: {Path(event.src_path).name}'
-            print(msg)
-            watcher_logger.info(msg)
-            self._schedule()
+        rel = self._relevant(event, event.src_path)
+        if rel:
+            msg = f'{"Cartella creata" if event.is_directory else "File creato"}: {Path(event.src_path).name}'
+            watcher_logger.info(msg, extra={'path': rel})
+            self._schedule(rel)
 
     def on_deleted(self, event):
-        if not event.is_directory and event.src_path.lower().endswith('.md'):
-            msg = f'File eliminato: {Path(event.src_path).name}'
-            print(msg)
-            watcher_logger.info(msg)
-            self._schedule()
+        rel = self._relevant(event, event.src_path)
+        if rel:
+            msg = f'{"Cartella eliminata" if event.is_directory else "File eliminato"}: {Path(event.src_path).name}'
+            watcher_logger.info(msg, extra={'path': rel})
+            self._schedule(rel)
 
     def on_modified(self, event):
-        if not event.is_directory and event.src_path.lower().endswith('.md'):
-            msg = f'File modificato: {Path(event.src_path).name}'
-            print(msg)
-            watcher_logger.info(msg)
-            self._schedule()
-
+        rel = None if event.is_directory else self._relevant(event, event.src_path)
+        if rel:
+            watcher_logger.info(f'File modificato: {Path(event.src_path).name}', extra={'path': rel})
+            self._schedule(rel)
 
-def run_command(cmd):
-    watcher_logger.info('Rigenerazione HTML in corso...')
-    print(f'Eseguo: {cmd}')
-    try:
-        completed = subprocess.run(cmd, shell=True, check=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        if completed.returncode == 0:
-            watcher_logger.info('✓ HTML rigenerato con successo')
-        else:
-            watcher_logger.error(f'Errore rigenerazione (exit code: {completed.returncode})')
-        if completed.stdout:
-            print(completed.stdout)
-        if completed.stderr:
-            print(completed.stderr, file=sys.stderr)
-            watcher_logger.error(completed.stderr)
-    except Exception as e:
-        msg = f'Errore esecuzione comando: {e}'
-        print(msg, file=sys.stderr)
-        watcher_logger.error(msg)
+    def on_moved(self, event):
+        # Rinomina o spostamento: cambiano sia l'origine (viewer da rimuovere) sia la destinazione;
+        # se una delle due è fuori da md/ resta solo l'altra
+        paths = [rel for rel in (self._relevant(event, event.src_path), self._relevant(event, event.dest_path)) if rel]
+        if paths:
+            watcher_logger.info(f'Spostato: {" → ".join(paths)}', extra={'path': paths[-1]})
+            self._schedule(*paths)
 
 
 def main():
@@ -110,9 +119,19 @@ def main():
     import os
     pid_file = ROOT / 'watcher.pid'
     pid_file.write_text(str(os.getpid()))
-    
-    def action():
-        run_command(CMD)
+    # Tenuto fino all'uscita: segnala ai worker dell'API che le build esterne le fa il watcher
+    watcher_lock = hold(regenerate_preview.WATCHER_LOCK_FILE)
+    if watcher_lock is None:
+        watcher_logger.warning('Un altro watcher è già attivo: le stesse modifiche verranno rigenerate due volte')
+
+    # Build in-process; la prima (completa e incrementale) riallinea le modifiche
+    # fatte a watcher spento e scalda manifest e cache
+    regen_service = RegenerationService(logger=watcher_logger)
+    regen_service.enqueue(None, 'startup')
+
+    def action(paths):
+        watcher_logger.info(f'Rigenerazione HTML accodata ({len(paths)} percorsi)')
+        regen_service.enqueue(paths, 'watcher')
 
     event_handler = DebouncedHandler(action, delay=0.25)
     observer = Observer()
@@ -120,17 +139,16 @@ def main():
     observer.start()
 
     try:
-        msg = 'In ascolto di cambiamenti su md/** (ricorsivo). Premere Ctrl+C per terminare.'
-        print(msg)
         watcher_logger.info('=== File Watcher avviato - Monitoraggio cartella md/ ===')
+        watcher_logger.info('In ascolto di cambiamenti su md/** (ricorsivo). Premere Ctrl+C per terminare.')
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
-        print('Interruzione richiesta, fermo watcher...')
         watcher_logger.info('Watcher terminato dall\'utente')
     finally:
         observer.stop()
         observer.join()
+        regen_service.stop(timeout=30)
         # Rimuovi file PID alla chiusura
         if pid_file.exists():
             pid_file.unlink()
@@ -0,0 +1,16 @@
+"""
+benchmark
+Benchmark di generatore e API su un vault sintetico riproducibile.
+
+Uso (dalla radice del progetto):
+  python scripts/benchmark --files 2000 --depth 3                 # misura e stampa il report
+  python scripts/benchmark --files 2000 --save-baseline main      # salva come baseline
+  python scripts/benchmark --files 2000 --compare main            # confronta e segnala regressioni
+
+Il vault (md/ e images/) viene generato in cache/bench/ da vault.py con un
+seed fisso: stessi parametri, stessi file. Il codice misurato è una copia di
+scripts/ nello stesso spazio di lavoro, così i percorsi ROOT/md/web dei moduli
+puntano al vault sintetico e quello vero non viene toccato. Generatore e API
+girano in due processi separati (runner.py) per avere il picco di memoria di
+ciascuno; report.py salva i risultati in JSON e li confronta con una baseline.
+"""
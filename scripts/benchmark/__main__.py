@@ -0,0 +1,142 @@
+"""
+Avvio del benchmark: python scripts/benchmark [opzioni] (vedi benchmark/__init__.py)
+"""
+from pathlib import Path
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent
+if str(SCRIPTS_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPTS_DIR))
+
+from benchmark import report
+from benchmark.vault import DEFAULTS, generate_vault, load_vault
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark di generatore e API su un vault sintetico')
+    vault = parser.add_argument_group('vault sintetico')
+    vault.add_argument('--files', type=int, default=DEFAULTS['files'])
+    vault.add_argument('--depth', type=int, default=DEFAULTS['depth'], help='livelli di cartelle')
+    vault.add_argument('--fanout', type=int, default=DEFAULTS['fanout'], help='sottocartelle per cartella')
+    vault.add_argument('--min-words', type=int, default=DEFAULTS['min_words'])
+    vault.add_argument('--max-words', type=int, default=DEFAULTS['max_words'])
+    vault.add_argument('--tags', type=int, default=DEFAULTS['tags'], help='tag distinti')
+    vault.add_argument('--tag-skew', type=float, default=DEFAULTS['tag_skew'],
+                       help='esponente Zipf della distribuzione dei tag (0 = uniforme)')
+    vault.add_argument('--frontmatter', type=float, default=DEFAULTS['frontmatter'],
+                       help='frazione di note con frontmatter')
+    vault.add_argument('--images', type=float, default=DEFAULTS['images'],
+                       help='frazione di note con un\'immagine')
+    vault.add_argument('--seed', type=int, default=DEFAULTS['seed'])
+    parser.add_argument('--requests', type=int, default=200, help='richieste misurate per endpoint')
+    parser.add_argument('--jobs', type=int, default=1, help='processi per la build completa')
+    parser.add_argument('--accept-encoding', default='',
+                        help='header Accept-Encoding delle richieste (es. "br, gzip")')
+    parser.add_argument('--only', choices=['generator', 'api'], help='esegue una sola fase')
+    parser.add_argument('--workdir', type=Path, help='spazio di lavoro (default cache/bench/vault-<parametri>)')
+    parser.add_argument('--regenerate', action='store_true', help='rigenera il vault anche se esiste')
+    parser.add_argument('--output', type=Path, help='file JSON dei risultati (default cache/bench/results/)')
+    parser.add_argument('--save-baseline', metavar='NOME', help='salva i risultati come baseline')
+    parser.add_argument('--compare', metavar='NOME', help='confronta con una baseline (nome o file .json)')
+    parser.add_argument('--threshold', type=float, default=report.DEFAULT_THRESHOLD,
+                        help='variazione relativa oltre cui segnalare una regressione (default 0.10)')
+    parser.add_argument('--verbose', action='store_true', help='mostra l\'output delle fasi e tutte le metriche')
+    return parser.parse_args(argv)
+
+
+def vault_params(args):
+    return {key: getattr(args, key) for key in DEFAULTS}
+
+
+def prepare_workspace(workdir, params, regenerate):
+    """Vault (riusato se i parametri coincidono) e copia aggiornata di scripts/"""
+    summary = None if regenerate else load_vault(workdir, **params)
+    if summary is None:
+        print(f'Generazione vault sintetico in {workdir}...')
+        summary = generate_vault(workdir, **params)
+    # Il codice misurato è quello attuale: la copia si rifà a ogni esecuzione
+    scripts = workdir / 'scripts'
+    if scripts.exists():
+        shutil.rmtree(scripts)
+    shutil.copytree(SCRIPTS_DIR, scripts, ignore=shutil.ignore_patterns('__pycache__'))
+    # Output, cache e log della volta precedente: la build completa parte da zero
+    for name in ('web', 'cache', 'logs'):
+        shutil.rmtree(workdir / name, ignore_errors=True)
+    return summary
+
+
+def run_phase(phase, workdir, config, verbose):
+    """Esegue una fase in un processo figlio e ne legge il risultato"""
+    output = workdir / f'{phase}.json'
+    if output.exists():
+        output.unlink()
+    env = dict(os.environ, APPUNTI_WORKERS='1')
+    quiet = None if verbose else subprocess.DEVNULL
+    completed = subprocess.run([sys.executable, '-m', 'benchmark.runner', phase, json.dumps(config), str(output)],
+                               cwd=workdir / 'scripts', env=env, stdout=quiet, stderr=quiet)
+    if completed.returncode != 0 or not output.exists():
+        raise SystemExit(f'Fase {phase} fallita (codice {completed.returncode}); '
+                         f'ripeti con --verbose per vedere l\'errore')
+    return json.loads(output.read_text(encoding='utf-8'))
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPTS_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    params = vault_params(args)
+    label = '-'.join(f'{params[k]}' for k in ('files', 'depth', 'fanout', 'seed'))
+    workdir = (args.workdir or report.BENCH_DIR / f'vault-{label}').resolve()
+    summary = prepare_workspace(workdir, params, args.regenerate)
+
+    config = {'seed': args.seed, 'requests': args.requests, 'jobs': args.jobs,
+              'accept_encoding': args.accept_encoding}
+    result = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': config,
+        'vault': summary
+    }
+    # Prima il generatore: la fase API trova web/ già generato
+    for phase in ('generator', 'api'):
+        if args.only in (None, phase):
+            print(f'Fase {phase}...')
+            result[phase] = run_phase(phase, workdir, config, args.verbose)
+
+    print()
+    report.print_report(result)
+    stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    output = report.save(result, args.output or report.RESULTS_DIR / f'{stamp}-{label}.json')
+    print(f'\nRisultati: {output}')
+    if args.save_baseline:
+        print(f'Baseline salvata: {report.save(result, report.baseline_path(args.save_baseline))}')
+
+    if args.compare:
+        path = report.baseline_path(args.compare)
+        if not path.exists():
+            raise SystemExit(f'Baseline non trovata: {path}')
+        baseline = report.load(path)
+        if not report.same_vault(baseline, result):
+            print('Attenzione: la baseline è stata misurata su un vault con parametri diversi')
+        rows = report.compare(baseline, result, args.threshold)
+        if report.print_comparison(rows, args.threshold, args.verbose):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
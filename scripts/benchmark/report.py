@@ -0,0 +1,132 @@
+"""
+report.py
+Risultati dei benchmark: salvataggio in JSON, baseline e confronto con soglia.
+
+Le metriche confrontate sono i tempi (secondi, *_ms), il picco di memoria e
+i byte scritti (meno è meglio) e il throughput (più è meglio). Una variazione
+peggiore della soglia relativa è una regressione, ma solo oltre un minimo
+assoluto: differenze di pochi microsecondi sono rumore di misura.
+"""
+from pathlib import Path
+import json
+
+ROOT = Path(__file__).resolve().parent.parent.parent
+BENCH_DIR = ROOT / 'cache' / 'bench'
+RESULTS_DIR = BENCH_DIR / 'results'
+BASELINES_DIR = BENCH_DIR / 'baselines'
+
+DEFAULT_THRESHOLD = 0.10
+
+# Suffisso della metrica -> (più alto è meglio, variazione assoluta minima significativa)
+METRICS = (
+    ('_ms', False, 0.05),
+    ('seconds', False, 0.005),
+    ('peak_rss', False, 1024 * 1024),
+    ('bytes_written', False, 1024),
+    ('throughput', True, 0),
+    ('files_per_second', True, 0)
+)
+# Misure di un solo campione (la peggiore, la prima richiesta): riportate ma non confrontate
+UNCOMPARED = ('max_ms', 'cold_ms')
+
+
+def save(result, path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(result, indent=2, ensure_ascii=False), encoding='utf-8')
+    return path
+
+
+def baseline_path(name):
+    """Percorso di una baseline: nome in cache/bench/baselines/ o percorso di un file JSON"""
+    path = Path(name)
+    return path if path.suffix == '.json' else BASELINES_DIR / f'{name}.json'
+
+
+def load(path):
+    return json.loads(Path(path).read_text(encoding='utf-8'))
+
+
+def flatten(result, prefix=''):
+    """Metriche numeriche confrontabili: 'api.endpoints.search.p95_ms' -> valore"""
+    values = {}
+    for key, value in result.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            values.update(flatten(value, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            if key not in UNCOMPARED and any(key.endswith(suffix) for suffix, _, _ in METRICS):
+                values[name] = value
+    return values
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """Righe (metrica, baseline, attuale, variazione relativa, stato) per le metriche comuni.
+
+    stato: 'regressione', 'migliorato' o 'ok'.
+    """
+    before = flatten({k: baseline.get(k, {}) for k in ('generator', 'api')})
+    after = flatten({k: current.get(k, {}) for k in ('generator', 'api')})
+    rows = []
+    for name in sorted(before.keys() & after.keys()):
+        old, new = before[name], after[name]
+        higher_better, min_delta = next((h, m) for suffix, h, m in METRICS if name.endswith(suffix))
+        change = (new - old) / old if old else 0.0
+        worse = -change if higher_better else change
+        status = 'ok'
+        if abs(new - old) >= min_delta and abs(change) > threshold:
+            status = 'regressione' if worse > 0 else 'migliorato'
+        rows.append((name, old, new, change, status))
+    return rows
+
+
+def same_vault(baseline, current):
+    return baseline.get('vault', {}).get('params') == current.get('vault', {}).get('params')
+
+
+def format_value(name, value):
+    if value is None:
+        return '-'
+    if name.endswith('peak_rss'):
+        return f'{value / 1024 / 1024:.1f} MB'
+    if name.endswith('bytes_written'):
+        return f'{value / 1024:.1f} KB'
+    return f'{value:g}'
+
+
+def print_report(result):
+    vault = result['vault']
+    print(f"Vault: {vault['files']} file, {vault['folders']} cartelle, "
+          f"{vault['bytes'] / 1024 / 1024:.1f} MB, {vault['images']} immagini")
+    generator = result.get('generator')
+    if generator:
+        print('\nGeneratore            secondi   file/s   byte scritti')
+        for name in ('full', 'noop', 'one_file'):
+            row = generator[name]
+            print(f"  {name:<18} {row['seconds']:>8.3f} {row['files_per_second'] or 0:>8.0f}"
+                  f"   {format_value('bytes_written', row['bytes_written']):>12}")
+        print(f"  picco RSS: {format_value('peak_rss', generator['peak_rss'])}")
+    api = result.get('api')
+    if api:
+        startup = ', '.join(f'{k[:-3]} {v:.1f} ms' for k, v in api['startup'].items())
+        print(f'\nAvvio indici: {startup}')
+        print('\nEndpoint               req/s      p50      p95      p99   (ms)   risposta')
+        for name, row in api['endpoints'].items():
+            print(f"  {name:<18} {row['throughput'] or 0:>8.0f} {row['p50_ms']:>8.3f} {row['p95_ms']:>8.3f}"
+                  f" {row['p99_ms']:>8.3f}   {row['response_bytes']:>10} B")
+        print(f"  picco RSS: {format_value('peak_rss', api['peak_rss'])}")
+
+
+def print_comparison(rows, threshold=DEFAULT_THRESHOLD, verbose=False):
+    """Stampa le variazioni oltre soglia (tutte con verbose); ritorna il numero di regressioni"""
+    regressions = sum(1 for row in rows if row[4] == 'regressione')
+    print(f'\nConfronto con la baseline (soglia {threshold:.0%}):')
+    for name, old, new, change, status in rows:
+        if status == 'ok' and not verbose:
+            continue
+        mark = {'regressione': '!!', 'migliorato': '++'}.get(status, '  ')
+        print(f'  {mark} {name:<48} {format_value(name, old):>12} -> {format_value(name, new):>12}'
+              f' ({change:+.1%})')
+    print(f'  {regressions} regressioni, '
+          f'{sum(1 for row in rows if row[4] == "migliorato")} miglioramenti su {len(rows)} metriche')
+    return regressions
@@ -0,0 +1,182 @@
+"""
+runner.py
+Misure eseguite in un processo figlio, dentro lo spazio di lavoro del benchmark.
+
+  python -m benchmark.runner generator '<config JSON>' risultato.json
+  python -m benchmark.runner api '<config JSON>' risultato.json
+
+Ogni fase gira in un processo nuovo: il picco di memoria (RSS) riportato è
+quello della sola fase. Le richieste passano dal test client di Flask, quindi
+misurano handler, indici e serializzazione senza rete né server WSGI.
+"""
+from pathlib import Path
+from urllib.parse import quote
+import json
+import os
+import random
+import sys
+import time
+
+try:
+    import resource
+except ImportError:   # Windows
+    resource = None
+
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent
+MD_DIR = SCRIPTS_DIR.parent / 'md'
+
+
+def peak_rss():
+    """Picco di memoria residente del processo in byte (None se non misurabile)"""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    try:
+        import psutil
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    return getattr(info, 'peak_wset', info.rss)
+
+
+def percentile(values, q):
+    """Percentile q (0-100) di una lista ordinata, con interpolazione lineare"""
+    if not values:
+        return None
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(samples, sizes, elapsed):
+    """Latenze (ms) e dimensioni delle risposte di una serie di richieste"""
+    ordered = sorted(samples)
+    return {
+        'requests': len(samples),
+        'throughput': round(len(samples) / elapsed, 1) if elapsed else None,
+        'mean_ms': round(sum(samples) / len(samples), 3),
+        'p50_ms': round(percentile(ordered, 50), 3),
+        'p95_ms': round(percentile(ordered, 95), 3),
+        'p99_ms': round(percentile(ordered, 99), 3),
+        'max_ms': round(ordered[-1], 3),
+        'response_bytes': round(sum(sizes) / len(sizes))
+    }
+
+
+def run_generator(config):
+    """Build completa, build incrementale senza modifiche e con una nota modificata"""
+    import regenerate_preview
+
+    results = {}
+
+    def timed(name, **kwargs):
+        started = time.perf_counter()
+        result = regenerate_preview.build(**kwargs)
+        seconds = time.perf_counter() - started
+        results[name] = {
+            'seconds': round(seconds, 4),
+            'documents': result['documents'],
+            'written': result['written'],
+            'bytes_written': result['bytes_written'],
+            'files_per_second': round(result['documents'] / seconds, 1) if seconds else None
+        }
+
+    timed('full', incremental=False, jobs=config['jobs'])
+    timed('noop', incremental=True)
+    # Una nota a metà vault, modificata e poi ripristinata: il vault resta quello generato
+    notes = sorted(MD_DIR.rglob('*.md'))
+    note = notes[len(notes) // 2]
+    original = note.read_bytes()
+    try:
+        note.write_bytes(original + b'\nRiga aggiunta dal benchmark.\n')
+        timed('one_file', incremental=True, changed=[note.relative_to(MD_DIR).as_posix()])
+    finally:
+        note.write_bytes(original)
+    results['peak_rss'] = peak_rss()
+    return results
+
+
+def api_requests(rng, notes, folders, tags, words):
+    """Endpoint misurati: nome -> funzione che produce l'URL della i-esima richiesta"""
+    return {
+        'files_tree': lambda: '/api/files',
+        'files_level': lambda: '/api/files?depth=1&path=' + quote(rng.choice(folders)),
+        'files_page': lambda: '/api/files?sort=-modified&limit=100',
+        'file': lambda: '/api/file/' + quote(rng.choice(notes)),
+        'search': lambda: '/api/search?q=' + quote(rng.choice(words)),
+        'search_prefix': lambda: '/api/search?q=' + quote(rng.choice(words)[:3] + '*'),
+        'stats': lambda: '/api/stats',
+        'query': lambda: '/api/query?tag=' + quote(rng.choice(tags)) if tags else '/api/query',
+        'tags': lambda: '/api/tags'
+    }
+
+
+def run_api(config):
+    """Avvio degli indici e latenza di ogni endpoint tramite il test client"""
+    import api_server
+    from benchmark.vault import WORDS
+
+    results = {}
+    startup = {}
+    for name, load in (('metadata', lambda: api_server.FILE_CACHE.validate(force=True)),
+                       ('search_index', api_server.search_index.ensure_loaded),
+                       ('file_tree', api_server.file_tree.build)):
+        started = time.perf_counter()
+        load()
+        startup[name + '_ms'] = round((time.perf_counter() - started) * 1000, 3)
+    results['startup'] = startup
+
+    notes = sorted(p.relative_to(MD_DIR).as_posix() for p in MD_DIR.rglob('*.md'))
+    folders = sorted({n.rpartition('/')[0] for n in notes})
+    tags = [t['tag'] for t in api_server.FILE_CACHE.tags()]
+    rng = random.Random(config['seed'])
+    headers = {'Accept-Encoding': config['accept_encoding']} if config['accept_encoding'] else {}
+    client = api_server.app.test_client()
+
+    endpoints = {}
+    for name, make_url in api_requests(rng, notes, folders, tags, WORDS).items():
+        # Prima richiesta a parte: può includere cache fredde e caricamenti pigri
+        started = time.perf_counter()
+        client.get(make_url(), headers=headers)
+        cold_ms = (time.perf_counter() - started) * 1000
+        samples, sizes = [], []
+        series_started = time.perf_counter()
+        for _ in range(config['requests']):
+            url = make_url()
+            started = time.perf_counter()
+            response = client.get(url, headers=headers)
+            data = response.get_data()
+            samples.append((time.perf_counter() - started) * 1000)
+            sizes.append(len(data))
+            if response.status_code >= 400:
+                raise RuntimeError(f'{url}: HTTP {response.status_code}')
+        endpoints[name] = dict(summarize(samples, sizes, time.perf_counter() - series_started),
+                               cold_ms=round(cold_ms, 3))
+
+    # Rivalidazione: stessa risorsa con l'ETag già in mano al client (304)
+    etag = client.get('/api/files', headers=headers).headers['ETag']
+    samples = []
+    series_started = time.perf_counter()
+    for _ in range(config['requests']):
+        started = time.perf_counter()
+        client.get('/api/files', headers=dict(headers, **{'If-None-Match': etag})).get_data()
+        samples.append((time.perf_counter() - started) * 1000)
+    endpoints['files_tree_304'] = summarize(samples, [0], time.perf_counter() - series_started)
+
+    results['endpoints'] = endpoints
+    api_server.stop_background_services()
+    results['peak_rss'] = peak_rss()
+    return results
+
+
+def main(argv=None):
+    phase, config, output = (argv or sys.argv[1:])[:3]
+    os.environ.setdefault('APPUNTI_WORKERS', '1')
+    run = {'generator': run_generator, 'api': run_api}[phase]
+    result = run(json.loads(config))
+    Path(output).write_text(json.dumps(result, indent=2), encoding='utf-8')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""
+vault.py
+Vault sintetici per i benchmark: alberi md/ riproducibili (stesso seed, stessi file).
+
+Parametri: numero di file, profondità e ampiezza delle cartelle, lunghezza
+delle note (distribuita in scala logaritmica tra min e max parole), tag con
+distribuzione Zipf (pochi tag molto usati, molti rari), frazione di note con
+frontmatter e con immagini. Le immagini sono PNG scritti senza Pillow, con
+nome da hash del contenuto come quelle caricate dall'editor, e condivise tra
+più note.
+"""
+from pathlib import Path
+import datetime
+import hashlib
+import json
+import random
+import shutil
+import struct
+import zlib
+
+DEFAULTS = {
+    'files': 1000,
+    'depth': 3,          # livelli di cartelle sotto md/
+    'fanout': 5,         # sottocartelle per cartella
+    'min_words': 100,
+    'max_words': 2000,
+    'tags': 30,          # tag distinti
+    'tag_skew': 1.1,     # esponente della distribuzione Zipf dei tag
+    'frontmatter': 0.8,  # frazione di note con frontmatter
+    'images': 0.1,       # frazione di note con un'immagine
+    'seed': 42
+}
+
+WORDS = (
+    'rete protocollo pacchetto indirizzo livello trasporto sessione client server '
+    'richiesta risposta algoritmo complessità grafo nodo arco albero ricerca ordinamento '
+    'memoria processo thread segnale semaforo chiave cifratura firma certificato hash '
+    'funzione variabile classe oggetto metodo eccezione modulo interfaccia sistema '
+    'operativo file cartella permesso utente gruppo kernel driver dispositivo bus '
+    'teorema dimostrazione lemma ipotesi tesi esempio esercizio soluzione definizione '
+    'proprietà insieme relazione matrice vettore spazio base dimensione limite derivata '
+    'integrale serie successione probabilità evento variabile media varianza campione'
+).split()
+
+TAG_NAMES = ('lezione', 'esercizi', 'esame', 'teoria', 'laboratorio', 'riassunto', 'todo',
+             'reti', 'sicurezza', 'algoritmi', 'database', 'sistemi', 'analisi', 'fisica')
+
+AUTHORS = ('Anna', 'Luca', 'Giulia', 'Marco', 'Sara')
+
+IMAGE_SIZES = ((640, 400), (1280, 800), (1920, 1080))
+
+
+def tag_names(count):
+    """Nomi dei tag: quelli realistici, poi numerati"""
+    names = list(TAG_NAMES[:count])
+    names.extend(f'tag{i:03d}' for i in range(len(names), count))
+    return names
+
+
+def png_bytes(width, height, rng):
+    """PNG RGB a bande orizzontali di colore: deterministico e senza Pillow"""
+    rows = []
+    band = max(1, height // rng.randint(4, 12))
+    for top in range(0, height, band):
+        color = bytes(rng.randrange(256) for _ in range(3))
+        # Una riga con un leggero gradiente, ripetuta per tutta la banda
+        row = b'\x00' + b''.join(bytes(((c + x // 8) & 0xFF) for c in color) for x in range(width))
+        rows.append(row * min(band, height - top))
+    raw = b''.join(rows)
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header)
+            + chunk(b'IDAT', zlib.compress(raw, 6)) + chunk(b'IEND', b''))
+
+
+def folder_paths(depth, fanout):
+    """Cartelle relative a md/ ('' = radice), in ampiezza"""
+    folders = ['']
+    level = ['']
+    for d in range(depth):
+        level = [(parent + '/' if parent else '') + f'Cartella {d + 1}.{i + 1:02d}'
+                 for parent in level for i in range(fanout)]
+        folders.extend(level)
+    return folders
+
+
+def paragraph(rng, words):
+    text = ' '.join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + '.'
+
+
+def note_text(rng, number, params, tags, tag_weights, images):
+    """Contenuto di una nota: frontmatter opzionale, titoli, paragrafi, liste, codice"""
+    target = round(params['min_words'] * (params['max_words'] / params['min_words']) ** rng.random())
+    title = f'Nota {number} - {rng.choice(WORDS)} {rng.choice(WORDS)}'
+    parts = []
+    if rng.random() < params['frontmatter']:
+        chosen = sorted(set(rng.choices(tags, tag_weights, k=rng.randint(1, 4))))
+        date = datetime.date(2024, 1, 1) + datetime.timedelta(days=rng.randrange(730))
+        parts.append('---')
+        parts.append(f'title: {title}')
+        parts.append(f'tags: [{", ".join(chosen)}]')
+        parts.append(f'data: {date.isoformat()}')
+        if rng.random() < 0.5:
+            parts.append(f'voto: {rng.randint(18, 30)}')
+        if rng.random() < 0.5:
+            parts.append(f'autore: {rng.choice(AUTHORS)}')
+        parts.append('---')
+        parts.append('')
+    parts.append(f'# {title}')
+    parts.append('')
+    written = 0
+    section = 0
+    while written < target:
+        section += 1
+        parts.append(f'## Sezione {section}')
+        parts.append('')
+        for _ in range(rng.randint(1, 3)):
+            words = min(rng.randint(30, 90), max(1, target - written))
+            parts.append(paragraph(rng, words))
+            parts.append('')
+            written += words
+        kind = rng.random()
+        if kind < 0.2:
+            parts.extend(f'- {paragraph(rng, rng.randint(3, 8))}' for _ in range(rng.randint(2, 5)))
+            parts.append('')
+        elif kind < 0.3:
+            parts.append('```python')
+            parts.extend(f'def {rng.choice(WORDS)}_{i}(x):\n    return x * {i}' for i in range(rng.randint(1, 3)))
+            parts.append('```')
+            parts.append('')
+    if images and rng.random() < params['images']:
+        parts.append(f'![figura](/images/{rng.choice(images)})')
+        parts.append('')
+    return '\n'.join(parts)
+
+
+def generate_vault(root, **overrides):
+    """Scrive md/ e images/ sotto root (ricreandoli) e ritorna il riepilogo del vault"""
+    params = dict(DEFAULTS, **overrides)
+    root = Path(root)
+    rng = random.Random(params['seed'])
+    md_dir = root / 'md'
+    images_dir = root / 'images'
+    for directory in (md_dir, images_dir):
+        if directory.exists():
+            shutil.rmtree(directory)
+        directory.mkdir(parents=True)
+
+    images = []
+    if params['images'] > 0:
+        for _ in range(max(1, round(params['files'] * params['images'] / 3))):
+            data = png_bytes(*rng.choice(IMAGE_SIZES), rng)
+            name = hashlib.sha256(data).hexdigest()[:20] + '.png'
+            (images_dir / name).write_bytes(data)
+            images.append(name)
+
+    tags = tag_names(params['tags'])
+    tag_weights = [1 / (rank + 1) ** params['tag_skew'] for rank in range(len(tags))]
+    folders = folder_paths(params['depth'], params['fanout'])
+    for folder in folders[1:]:
+        (md_dir / folder).mkdir(parents=True, exist_ok=True)
+    total_bytes = 0
+    for number in range(params['files']):
+        folder = rng.choice(folders)
+        text = note_text(rng, number, params, tags, tag_weights, images)
+        data = text.encode('utf-8')
+        (md_dir / folder / f'nota-{number:05d}.md').write_bytes(data)
+        total_bytes += len(data)
+
+    summary = {'params': params, 'files': params['files'], 'folders': len(folders) - 1,
+               'bytes': total_bytes, 'images': len(images)}
+    (root / 'vault.json').write_text(json.dumps(summary, indent=2), encoding='utf-8')
+    return summary
+
+
+def load_vault(root, **overrides):
+    """Riepilogo del vault in root se è stato generato con gli stessi parametri, altrimenti None"""
+    try:
+        summary = json.loads((Path(root) / 'vault.json').read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+    return summary if summary.get('params') == dict(DEFAULTS, **overrides) else None
@@ -0,0 +1,133 @@
+"""
+compression.py
+Compressione gzip/Brotli: copie precompresse degli output generati e
+negoziazione di Accept-Encoding per le risposte dell'API.
+
+Il generatore scrive accanto a ogni HTML (e agli asset CSS/JS) le copie
+`.gz` e `.br`: static_proxy le serve così come sono, senza comprimere nulla
+per richiesta. Brotli è opzionale (python -m pip install brotli); senza, si
+producono e si servono solo le copie gzip.
+"""
+import gzip
+import re
+
+from output_writer import write_if_changed
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Codifiche supportate in ordine di preferenza (a parità di q)
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+# Livelli: i file statici si comprimono una volta per modifica, le risposte
+# dinamiche a ogni richiesta. Brotli 11 costa ~25 ms per viewer: solo per gli
+# asset, che cambiano di rado
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 6
+BROTLI_QUALITY_ASSETS = 11
+DYNAMIC_GZIP_LEVEL = 6
+DYNAMIC_BROTLI_QUALITY = 4
+
+# Sotto questa dimensione l'overhead di header e CPU non vale il risparmio
+MIN_SIZE = 1024
+
+_CODING_RE = re.compile(r'\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*')
+
+
+def compress(data, encoding, quality=None):
+    """Comprime bytes con 'gzip' o 'br'; quality None = livello per file statici"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY if quality is None else quality)
+    # mtime=0: stessi byte a ogni build, così write_if_changed non riscrive
+    return gzip.compress(data, GZIP_LEVEL if quality is None else quality, mtime=0)
+
+
+def sibling(path, encoding):
+    """Percorso della copia precompressa di path (es. viewer.html.br)"""
+    return path.with_name(path.name + SUFFIXES[encoding])
+
+
+def has_siblings(path):
+    """True se esistono tutte le copie precompresse per le codifiche disponibili"""
+    return all(sibling(path, enc).exists() for enc in ENCODINGS)
+
+
+def write_siblings(path, data, brotli_quality=None):
+    """Scrive (se cambiate) le copie .gz/.br di un output; ritorna i byte scritti"""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    written = 0
+    for encoding in ENCODINGS:
+        quality = brotli_quality if encoding == 'br' else None
+        written += write_if_changed(sibling(path, encoding), compress(data, encoding, quality))
+    return written
+
+
+def remove_siblings(path):
+    """Elimina le copie precompresse di un output rimosso (anche .br senza brotli installato)"""
+    for suffix in SUFFIXES.values():
+        copy = path.with_name(path.name + suffix)
+        if copy.exists():
+            copy.unlink()
+
+
+def is_sibling_name(name):
+    """True per i nomi delle copie precompresse (.gz/.br)"""
+    return name.endswith(tuple(SUFFIXES.values()))
+
+
+def negotiate(accept_encoding, available=ENCODINGS):
+    """Codifica da usare secondo l'header Accept-Encoding (None = identity).
+
+    Rispetta i valori q (q=0 esclude) e il jolly `*`; a parità di q vince
+    l'ordine di `available` (Brotli prima di gzip).
+    """
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(','):
+        match = _CODING_RE.fullmatch(part)
+        if not match:
+            continue
+        try:
+            q = float(match.group(2)) if match.group(2) else 1.0
+        except ValueError:
+            continue
+        weights[match.group(1).lower()] = q
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = weights.get(encoding, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def size_report(web_dir):
+    """Byte degli HTML e degli asset in web/ grezzi e compressi, per categoria.
+
+    Per ogni file conta la copia precompressa se esiste, altrimenti la
+    comprime al volo: il report vale anche prima della prima build.
+    """
+    report = {}
+    for path in web_dir.rglob('*'):
+        if not path.is_file() or path.name.startswith('.') or is_sibling_name(path.name):
+            continue
+        if path.suffix not in ('.html', '.css', '.js'):
+            continue
+        if path.parent.name == 'assets' and path.parent.parent == web_dir:
+            category = 'asset'
+        elif path.parent == web_dir or (path.parent.name == '_tree' and path.parent.parent == web_dir):
+            category = 'pagine'
+        else:
+            category = 'viewer'
+        data = path.read_bytes()
+        row = report.setdefault(category, {'files': 0, 'raw': 0, 'gzip': 0, 'br': 0})
+        row['files'] += 1
+        row['raw'] += len(data)
+        for encoding in ENCODINGS:
+            copy = sibling(path, encoding)
+            row[encoding] += copy.stat().st_size if copy.exists() else len(compress(data, encoding))
+    return report
@@ -0,0 +1,158 @@
+"""
+event_bus.py
+Bus di eventi in memoria per /api/events (Server-Sent Events).
+
+Gli eventi hanno un id crescente e restano in uno storico limitato, così un
+client che si riconnette con Last-Event-ID riceve quelli persi. Tipi usati:
+changed, deleted, renamed (dalla rigenerazione) e log (dai logger).
+
+Le righe di log hanno uno storico separato: il traffico normale dell'API non
+fa uscire dallo storico gli eventi sui file. Gli id SSE portano l'epoca del
+bus ("<epoca>-<n>"): un Last-Event-ID di un altro processo (riavvio, altro
+worker) o più vecchio dello storico è un buco, segnalato al client con un
+evento 'resync' perché ricontrolli lo stato invece di fidarsi del replay.
+
+listen() blocca un thread per sottoscrittore (server WSGI); la variante
+asyncio usa subscribe() + resume() + events_since() e non occupa thread.
+"""
+from collections import deque
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+
+
+class EventBus:
+    """Pubblicazione di eventi a più sottoscrittori con storico"""
+
+    def __init__(self, history=1000, log_history=1000):
+        self._cond = threading.Condition()
+        self._events = deque(maxlen=history)      # (n, tipo, dati) degli eventi sui file
+        self._logs = deque(maxlen=log_history)    # (n, 'log', dati)
+        self._last_id = 0
+        self._evicted_id = 0   # ultimo evento sui file uscito dallo storico
+        self.epoch = f'{time.time_ns():x}{os.getpid():x}'
+        self._callbacks = []   # funzioni chiamate a ogni publish (es. risveglio di un loop asyncio)
+
+    def publish(self, event, data):
+        """Pubblica un evento e sveglia i sottoscrittori; ritorna l'id"""
+        with self._cond:
+            self._last_id += 1
+            history = self._logs if event == 'log' else self._events
+            if event != 'log' and len(history) == history.maxlen:
+                self._evicted_id = history[0][0]
+            history.append((self._last_id, event, data))
+            self._cond.notify_all()
+            event_id = self._last_id
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            callback()
+        return self.sse_id(event_id)
+
+    def subscribe(self, callback):
+        """Registra callback() da chiamare (nel thread che pubblica) a ogni evento"""
+        with self._cond:
+            self._callbacks.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._cond:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def sse_id(self, n):
+        return f'{self.epoch}-{n}'
+
+    def resume(self, last_event_id=None):
+        """Punto di partenza di un sottoscrittore da un Last-Event-ID.
+
+        Ritorna (n, evento resync o None). Senza Last-Event-ID: solo eventi
+        nuovi. Id di un'altra epoca, non valido o più vecchio dello storico
+        dei file: solo eventi nuovi più un evento 'resync' per il client.
+        """
+        with self._cond:
+            current = self._last_id
+            if not last_event_id:
+                return current, None
+            epoch, _, n = str(last_event_id).rpartition('-')
+            try:
+                n = int(n)
+            except ValueError:
+                n = None
+            if epoch != self.epoch or n is None or n > current:
+                reason = 'unknown_id'
+            elif n < self._evicted_id:
+                reason = 'history_exceeded'
+            else:
+                return n, None
+        return current, (self.sse_id(current), 'resync', {'reason': reason})
+
+    def _pending(self, last_id):
+        # Eventi dei due storici successivi a last_id, in ordine di id (chiamata col lock)
+        return list(heapq.merge((e for e in self._events if e[0] > last_id),
+                                (e for e in self._logs if e[0] > last_id)))
+
+    def events_since(self, last_id, types=None):
+        """Eventi successivi a last_id (filtrati per tipo) e nuovo last_id, senza attendere"""
+        with self._cond:
+            pending = self._pending(last_id)
+        if pending:
+            last_id = pending[-1][0]
+        return [(self.sse_id(n), name, data) for n, name, data in pending
+                if types is None or name in types], last_id
+
+    def last_id(self):
+        with self._cond:
+            return self._last_id
+
+    def listen(self, last_event_id=None, types=None, keepalive=15.0):
+        """Generatore infinito di eventi successivi a last_event_id.
+
+        Produce None ogni `keepalive` secondi senza eventi (per i commenti di
+        keep-alive SSE). Se il replay non è possibile il primo evento è
+        'resync' (vedi resume()).
+        """
+        last_id, resync = self.resume(last_event_id)
+        if resync:
+            yield resync
+        while True:
+            with self._cond:
+                pending = self._pending(last_id)
+                if not pending:
+                    self._cond.wait(keepalive)
+                    pending = self._pending(last_id)
+            if not pending:
+                yield None
+                continue
+            last_id = pending[-1][0]
+            for n, name, data in pending:
+                if types is None or name in types:
+                    yield self.sse_id(n), name, data
+
+
+def format_sse(event):
+    """Serializza un evento nel formato text/event-stream"""
+    event_id, name, data = event
+    return f'id: {event_id}\nevent: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+
+class EventBusHandler(logging.Handler):
+    """Handler di logging che pubblica ogni riga come evento 'log'"""
+
+    def __init__(self, bus, source):
+        super().__init__()
+        self.bus = bus
+        self.source = source
+        self.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+
+    def emit(self, record):
+        try:
+            self.bus.publish('log', {
+                'source': self.source,
+                'timestamp': self.formatter.formatTime(record),
+                'level': record.levelname,
+                'message': record.getMessage()
+            })
+        except Exception:
+            self.handleError(record)
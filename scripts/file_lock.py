@@ -0,0 +1,98 @@
+"""
+file_lock.py
+Lock esclusivo tra processi basato su un file (fcntl su Linux/macOS, msvcrt su Windows).
+
+Serializza le build quando più processi scrivono in web/ e nel manifest: i
+worker del server di produzione e il watcher. hold() e is_held() servono a
+scegliere un solo processo per un compito (chi rigenera le modifiche esterne).
+"""
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:   # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """Context manager con lock esclusivo e bloccante sul file `path` (creato se manca)"""
+
+    def __init__(self, path):
+        self.path = path
+        # Il lock sul file è per processo: quello in memoria serializza anche i thread
+        self._thread_lock = threading.Lock()
+        self._fd = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        fd = None
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            else:
+                while True:
+                    try:
+                        # LK_LOCK ritenta per circa 10 secondi, poi solleva OSError
+                        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        continue
+        except BaseException:
+            if fd is not None:
+                os.close(fd)
+            self._thread_lock.release()
+            raise
+        self._fd = fd
+        return self
+
+    def __exit__(self, *exc_info):
+        fd, self._fd = self._fd, None
+        try:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(fd)
+            self._thread_lock.release()
+
+
+def _try_lock(fd):
+    try:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def hold(path):
+    """Prende senza attendere un lock esclusivo tenuto fino alla fine del processo.
+
+    Ritorna il descrittore (il lock si libera chiudendolo o all'uscita del
+    processo) o None se il lock è di un altro processo.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    if _try_lock(fd):
+        return fd
+    os.close(fd)
+    return None
+
+
+def is_held(path):
+    """True se un altro processo tiene il lock su `path` (es. il watcher è attivo)"""
+    if not path.exists():
+        return False
+    fd = hold(path)
+    if fd is None:
+        return True
+    os.close(fd)   # chiudere il descrittore libera anche il lock
+    return False
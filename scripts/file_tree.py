@@ -0,0 +1,191 @@
+"""
+file_tree.py
+Albero di cartelle e file .md di md/ tenuto in memoria per /api/files.
+
+Le cartelle sono indicizzate per percorso relativo, quindi aggiungere o togliere
+un elemento costa un lookup nel dizionario invece di una scansione dei figli.
+L'albero viene costruito una volta, aggiornato dalle mutazioni con refresh() e
+serializzato in JSON una sola volta per versione, con un ETag sul contenuto.
+Le cartelle vuote sono incluse. Con subtree() si serve un solo ramo fino a una
+profondità data: le cartelle più in basso hanno solo il numero di figli e il
+client le carica quando vengono aperte.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class FileTree:
+    """Albero in memoria con serializzazione JSON in cache per versione"""
+
+    def __init__(self, base_dir, max_age=30.0):
+        self.base_dir = base_dir
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._folders = {}        # percorso cartella ('' = radice) -> {'folders': set, 'files': set}
+        self._built_at = 0.0
+        self.watched = False      # True mentre un observer tiene l'albero allineato con refresh()
+        self.version = 0
+        self._payload = None      # (versione, bytes JSON, etag)
+        self._subtrees = {}       # (cartella, profondità) -> (bytes JSON, etag) della versione corrente
+        self._subtrees_version = None
+        self.hits = 0             # JSON servito dalla cache / serializzato di nuovo
+        self.misses = 0
+
+    def build(self):
+        """Ricostruisce l'albero da disco con una sola os.walk"""
+        folders = {'': {'folders': set(), 'files': set()}}
+        for dirpath, dirnames, filenames in os.walk(self.base_dir):
+            rel = os.path.relpath(dirpath, self.base_dir).replace('\\', '/')
+            rel = '' if rel == '.' else rel
+            node = folders.setdefault(rel, {'folders': set(), 'files': set()})
+            node['folders'].update(dirnames)
+            node['files'].update(f for f in filenames if f.lower().endswith('.md'))
+            for name in dirnames:
+                folders.setdefault(self._join(rel, name), {'folders': set(), 'files': set()})
+        with self._lock:
+            self._folders = folders
+            self._built_at = time.time()
+            self.version += 1
+
+    def validate(self, force=False):
+        """Ricostruisce l'albero se più vecchio di max_age secondi.
+
+        È solo una rete di sicurezza per modifiche fatte fuori dal server e non
+        segnalate: il server aggiorna l'albero con refresh() a ogni mutazione.
+        Con un observer attivo (watched) le modifiche esterne arrivano già come
+        refresh(), quindi la os.walk periodica non serve.
+        """
+        if force or not self._folders:
+            self.build()
+        elif not self.watched and time.time() - self._built_at >= self.max_age:
+            self.build()
+
+    def refresh(self, paths):
+        """Riallinea al disco i percorsi relativi indicati (file o cartelle)"""
+        with self._lock:
+            if not self._folders:
+                self.build()
+                return
+            for rel in paths:
+                rel = rel.replace('\\', '/').strip('/')
+                if not rel:
+                    self.build()
+                    return
+                self._remove(rel)
+                full = self.base_dir / rel
+                if full.is_dir():
+                    self._add_folder(rel)
+                    for dirpath, dirnames, filenames in os.walk(full):
+                        sub = os.path.relpath(dirpath, self.base_dir).replace('\\', '/')
+                        for name in dirnames:
+                            self._add_folder(self._join(sub, name))
+                        for name in filenames:
+                            if name.lower().endswith('.md'):
+                                self._folders[sub]['files'].add(name)
+                elif full.is_file() and rel.lower().endswith('.md'):
+                    parent, name = self._split(rel)
+                    self._add_folder(parent)
+                    self._folders[parent]['files'].add(name)
+            self.version += 1
+
+    def _remove(self, rel):
+        parent, name = self._split(rel)
+        node = self._folders.get(parent)
+        if node:
+            node['files'].discard(name)
+            node['folders'].discard(name)
+        if rel in self._folders:
+            prefix = rel + '/'
+            for key in [k for k in self._folders if k == rel or k.startswith(prefix)]:
+                del self._folders[key]
+
+    def _add_folder(self, rel):
+        # Crea la cartella e gli eventuali antenati mancanti
+        if rel in self._folders:
+            return
+        self._folders[rel] = {'folders': set(), 'files': set()}
+        parent, name = self._split(rel)
+        self._add_folder(parent)
+        self._folders[parent]['folders'].add(name)
+
+    @staticmethod
+    def _split(rel):
+        parent, _, name = rel.rpartition('/')
+        return parent, name
+
+    @staticmethod
+    def _join(parent, name):
+        return f'{parent}/{name}' if parent else name
+
+    def to_dict(self):
+        """Albero nel formato di /api/files (cartelle prima, poi file, per nome)"""
+        with self._lock:
+            return self._node(self.base_dir.name, '')
+
+    def _node(self, name, rel):
+        node = self._folders.get(rel, {'folders': (), 'files': ()})
+        children = [self._node(child, self._join(rel, child)) for child in sorted(node['folders'])]
+        children.extend({
+            'type': 'file',
+            'name': child,
+            'path': self._join(rel, child)
+        } for child in sorted(node['files']))
+        return {'type': 'folder', 'name': name, 'children': children}
+
+    def subtree(self, rel='', depth=1):
+        """Ramo della cartella rel con `depth` livelli di figli (None se non esiste).
+
+        Ogni cartella ha 'path' e il numero di sottocartelle e file diretti;
+        quelle oltre l'ultimo livello hanno 'children': None.
+        """
+        with self._lock:
+            if rel not in self._folders:
+                return None
+            return self._level(rel.rpartition('/')[2] or self.base_dir.name, rel, depth)
+
+    def _level(self, name, rel, depth):
+        node = self._folders.get(rel, {'folders': (), 'files': ()})
+        result = {'type': 'folder', 'name': name, 'path': rel,
+                  'folders': len(node['folders']), 'files': len(node['files']), 'children': None}
+        if depth > 0:
+            children = [self._level(child, self._join(rel, child), depth - 1)
+                        for child in sorted(node['folders'])]
+            children.extend({
+                'type': 'file',
+                'name': child,
+                'path': self._join(rel, child)
+            } for child in sorted(node['files']))
+            result['children'] = children
+        return result
+
+    def subtree_payload(self, rel='', depth=1):
+        """Come payload() per un ramo: (bytes JSON, etag), None se la cartella non esiste"""
+        with self._lock:
+            if self._subtrees_version != self.version or len(self._subtrees) > 256:
+                self._subtrees = {}
+                self._subtrees_version = self.version
+            key = (rel, depth)
+            if key in self._subtrees:
+                self.hits += 1
+            else:
+                tree = self.subtree(rel, depth)
+                if tree is None:
+                    return None
+                self.misses += 1
+                body = json.dumps(tree, ensure_ascii=False).encode('utf-8')
+                self._subtrees[key] = (body, hashlib.sha1(body).hexdigest())
+            return self._subtrees[key]
+
+    def payload(self):
+        """JSON serializzato ed ETag dell'albero, ricalcolati solo se la versione cambia"""
+        with self._lock:
+            if self._payload is None or self._payload[0] != self.version:
+                self.misses += 1
+                body = json.dumps(self.to_dict(), ensure_ascii=False).encode('utf-8')
+                self._payload = (self.version, body, hashlib.sha1(body).hexdigest())
+            else:
+                self.hits += 1
+            return self._payload[1], self._payload[2]
@@ -0,0 +1,262 @@
+"""
+image_store.py
+Immagini caricate dall'editor: upload a blocchi con limite di dimensione,
+nomi dati dall'hash del contenuto e varianti ridimensionate per srcset.
+
+Lo stesso file caricato più volte (es. lo stesso screenshot incollato in più
+note) è salvato una volta sola in images/<hash>.<ext>. Le varianti larghe
+480/960/1600 px (images/<hash>-<larghezza>w.webp) sono generate in un thread
+in background dopo l'upload, o alla prima richiesta se mancano. Sono in WebP
+anche per gli originali PNG: ridimensionare uno screenshot ne sfuma il testo
+e un PNG ridotto può pesare più dell'originale. Con Pillow non installato
+(python -m pip install pillow) si salvano solo gli originali.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import functools
+import hashlib
+import io
+import os
+import re
+import threading
+
+from output_writer import atomic_write
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+ROOT = Path(__file__).resolve().parent.parent
+IMAGES_DIR = ROOT / 'images'
+
+CHUNK_SIZE = 64 * 1024
+MAX_UPLOAD_BYTES = int(os.environ.get('APPUNTI_MAX_UPLOAD_MB', '20')) * 1024 * 1024
+
+# Larghezze delle varianti; sizes corrisponde alla colonna del contenuto dei viewer
+VARIANT_WIDTHS = (480, 960, 1600)
+SIZES = '(max-width: 900px) 100vw, 900px'
+
+HASH_LENGTH = 20
+HASH_NAME_RE = re.compile(r'([0-9a-f]{%d})(?:-(\d+)w)?(\.[a-z0-9]+)' % HASH_LENGTH)
+
+# Firme dei formati più comuni; gli altri sono accettati in base all'estensione
+SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'GIF87a', '.gif'),
+    (b'GIF89a', '.gif'),
+)
+EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.webp', '.svg', '.bmp', '.avif'}
+# Formati ridimensionabili (le GIF possono essere animate: restano originali)
+RESIZABLE = {'.png': 'PNG', '.jpg': 'JPEG', '.webp': 'WEBP'}
+# Formato delle varianti: WebP se Pillow lo supporta, altrimenti quello dell'originale
+VARIANT_EXT = '.webp' if Image is not None and features.check('webp') else None
+SAVE_OPTIONS = {
+    'PNG': {'optimize': True},
+    'JPEG': {'quality': 82, 'optimize': True, 'progressive': True},
+    'WEBP': {'quality': 80, 'method': 4}
+}
+
+
+class UploadError(Exception):
+    """Upload rifiutato: status HTTP e codice d'errore per la risposta JSON"""
+
+    def __init__(self, status, code):
+        super().__init__(code)
+        self.status = status
+        self.code = code
+
+
+def sniff_extension(head, filename):
+    """Estensione dai primi byte del file, o dal nome se il formato non ha firma nota"""
+    for signature, ext in SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return '.webp'
+    ext = os.path.splitext(filename or '')[1].lower()
+    if ext == '.jpeg':
+        ext = '.jpg'
+    return ext if ext in EXTENSIONS else None
+
+
+@functools.lru_cache(maxsize=4096)
+def _dimensions(path, mtime_ns):
+    with Image.open(path) as im:
+        width, height = im.size
+        # Orientamento EXIF 5-8: la foto viene mostrata ruotata di 90°
+        if im.getexif().get(0x0112) in (5, 6, 7, 8):
+            width, height = height, width
+    return width, height
+
+
+def image_dimensions(path):
+    """(larghezza, altezza) lette dall'intestazione, None senza Pillow o se illeggibile"""
+    if Image is None:
+        return None
+    try:
+        return _dimensions(str(path), path.stat().st_mtime_ns)
+    except (OSError, ValueError):
+        return None
+
+
+def variant_name(digest, width, ext):
+    return f'{digest}-{width}w{VARIANT_EXT or ext}'
+
+
+def describe(name, images_dir=IMAGES_DIR):
+    """URL, dimensioni e srcset di un'immagine con nome da hash (None se non esiste)"""
+    match = HASH_NAME_RE.fullmatch(name)
+    path = images_dir / name
+    if not match or match.group(2) or not path.is_file():
+        return None
+    digest, ext = match.group(1), match.group(3)
+    info = {'url': f'/images/{name}', 'filename': name, 'width': None, 'height': None,
+            'variants': [], 'srcset': None}
+    dims = image_dimensions(path)
+    if dims is None:
+        return info
+    info['width'], info['height'] = dims
+    if ext in RESIZABLE:
+        info['variants'] = [{'width': w, 'url': f'/images/{variant_name(digest, w, ext)}'}
+                            for w in VARIANT_WIDTHS if w < dims[0]]
+    if info['variants']:
+        candidates = [f'{v["url"]} {v["width"]}w' for v in info['variants']]
+        candidates.append(f'{info["url"]} {dims[0]}w')
+        info['srcset'] = ', '.join(candidates)
+    return info
+
+
+def make_variant(source, width, dest):
+    """Scrive in dest la copia di source larga width px, nel formato dato dall'estensione di dest"""
+    with Image.open(source) as im:
+        im = ImageOps.exif_transpose(im)
+        # Le immagini a palette si ridimensionerebbero senza interpolazione
+        if im.mode not in ('RGB', 'RGBA', 'L'):
+            im = im.convert('RGBA')
+        height = max(1, round(im.height * width / im.width))
+        resized = im.resize((width, height), Image.LANCZOS)
+    fmt = RESIZABLE[dest.suffix]
+    if fmt == 'JPEG' and resized.mode == 'RGBA':
+        resized = resized.convert('RGB')
+    buffer = io.BytesIO()
+    resized.save(buffer, fmt, **SAVE_OPTIONS[fmt])
+    atomic_write(dest, buffer.getvalue())
+
+
+class ImageStore:
+    """Salvataggio degli upload e generazione delle varianti in un thread dedicato"""
+
+    def __init__(self, images_dir=IMAGES_DIR, max_bytes=MAX_UPLOAD_BYTES, logger=None):
+        self.images_dir = images_dir
+        self.max_bytes = max_bytes
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._pending = {}   # nome variante -> Future
+        self._executor = None
+
+    def save(self, stream, filename=''):
+        """Copia lo stream su disco a blocchi calcolando l'hash; ritorna describe() + size e deduplicated.
+
+        Solleva UploadError se il file è vuoto, supera max_bytes o non è un'immagine.
+        """
+        self.images_dir.mkdir(exist_ok=True)
+        tmp_path = self.images_dir / f'.upload.{os.getpid()}.{threading.get_ident()}.tmp'
+        digest = hashlib.sha256()
+        size = 0
+        head = b''
+        try:
+            with open(tmp_path, 'wb') as f:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise UploadError(413, 'too_large')
+                    if len(head) < 16:
+                        head += chunk[:16 - len(head)]
+                    digest.update(chunk)
+                    f.write(chunk)
+            if size == 0:
+                raise UploadError(400, 'empty_file')
+            ext = sniff_extension(head, filename)
+            if ext is None:
+                raise UploadError(415, 'unsupported_type')
+            name = digest.hexdigest()[:HASH_LENGTH] + ext
+            path = self.images_dir / name
+            deduplicated = path.exists()
+            if deduplicated:
+                tmp_path.unlink()
+            else:
+                os.replace(tmp_path, path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+        info = describe(name, self.images_dir)
+        info['size'] = size
+        info['deduplicated'] = deduplicated
+        self.schedule_variants(info)
+        return info
+
+    def schedule_variants(self, info):
+        """Accoda nel thread in background le varianti mancanti di un'immagine"""
+        for variant in info['variants']:
+            name = variant['url'].rsplit('/', 1)[1]
+            if (self.images_dir / name).exists():
+                continue
+            with self._lock:
+                if name in self._pending:
+                    continue
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='image-variants')
+                future = self._executor.submit(self._generate, info['filename'], variant['width'], name)
+                self._pending[name] = future
+            future.add_done_callback(lambda _, name=name: self._done(name))
+
+    def _done(self, name):
+        with self._lock:
+            self._pending.pop(name, None)
+
+    def _generate(self, source_name, width, name):
+        """Scrive una variante (nel thread del pool); gli errori finiscono nel log"""
+        dest = self.images_dir / name
+        if dest.exists():
+            return
+        try:
+            make_variant(self.images_dir / source_name, width, dest)
+        except Exception as e:
+            if self._logger:
+                self._logger.error(f'Errore variante {name}: {e}', extra={'path': name})
+
+    def resolve(self, filename):
+        """Nome del file da servire per una richiesta /images/<filename>.
+
+        Una variante non ancora pronta viene attesa o generata subito; se non
+        si può generare (Pillow assente, larghezza non prevista) si serve
+        l'originale. Gli altri nomi passano invariati.
+        """
+        match = HASH_NAME_RE.fullmatch(filename)
+        if not match or not match.group(2) or (self.images_dir / filename).exists():
+            return filename
+        digest, width = match.group(1), int(match.group(2))
+        # L'estensione della variante può differire da quella dell'originale
+        original = next((p.name for p in self.images_dir.glob(digest + '.*')), None)
+        info = describe(original, self.images_dir) if original else None
+        if not info or filename not in [v['url'].rsplit('/', 1)[1] for v in info['variants']]:
+            return original or filename
+        # Sempre dal thread delle varianti: una sola scrittura per file anche con richieste parallele
+        self.schedule_variants(info)
+        with self._lock:
+            future = self._pending.get(filename)
+        if future:
+            future.result()
+        return filename if (self.images_dir / filename).exists() else original
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False)
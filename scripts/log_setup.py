@@ -0,0 +1,168 @@
+"""
+log_setup.py
+Configurazione condivisa dei logger di API server e watcher.
+
+I record passano da un QueueHandler: il thread che logga mette solo il record
+in coda, mentre console, file e gli altri handler vengono eseguiti dal thread
+del QueueListener. Con APPUNTI_LOG_FORMAT=json il file di log è in formato
+JSON lines (timestamp, level, logger, event, path, duration_ms) invece del
+testo 'timestamp - livello - messaggio'. LogStore tiene in memoria gli ultimi
+record già strutturati per le query di /api/logs.
+"""
+from collections import deque
+import atexit
+import datetime
+import json
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, WatchedFileHandler
+import os
+import queue
+import sys
+import threading
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+TEXT_TIME_FORMAT = '%Y-%m-%d %H:%M:%S,%f'
+
+
+def log_format():
+    """Formato del file di log: 'json' o 'text' (variabile APPUNTI_LOG_FORMAT)"""
+    return 'json' if os.environ.get('APPUNTI_LOG_FORMAT', '').lower() == 'json' else 'text'
+
+
+def record_entry(record):
+    """Record di logging -> dict strutturato (stessi campi delle righe JSON)"""
+    entry = {
+        'timestamp': datetime.datetime.fromtimestamp(record.created).isoformat(sep=' ', timespec='milliseconds'),
+        'level': record.levelname,
+        'logger': record.name,
+        'event': record.getMessage()
+    }
+    for key in ('path', 'duration_ms'):
+        value = getattr(record, key, None)
+        if value is not None:
+            entry[key] = value
+    return entry
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Una riga JSON per record"""
+
+    def format(self, record):
+        return json.dumps(record_entry(record), ensure_ascii=False)
+
+
+def parse_log_line(line):
+    """Riga di log (JSON o testo) -> dict con timestamp, level, message (None se non valida)"""
+    line = line.strip()
+    if line.startswith('{'):
+        try:
+            entry = json.loads(line)
+            entry['message'] = entry.pop('event', '')
+            return entry
+        except ValueError:
+            return None
+    parts = line.split(' - ', 2)
+    if len(parts) < 3:
+        return None
+    return {'timestamp': parts[0], 'level': parts[1], 'message': parts[2]}
+
+
+def entry_time(entry):
+    """Istante di una voce di log in secondi epoch (None se il timestamp non è valido)"""
+    stamp = entry.get('timestamp', '')
+    for parse in (lambda s: datetime.datetime.strptime(s, TEXT_TIME_FORMAT),
+                  datetime.datetime.fromisoformat):
+        try:
+            return parse(stamp).timestamp()
+        except ValueError:
+            continue
+    return None
+
+
+def filter_entries(entries, level=None, since=None, until=None):
+    """Filtra voci di log per livello minimo e intervallo di tempo (secondi epoch)"""
+    min_level = logging.getLevelName(level.upper()) if level else None
+    if not isinstance(min_level, int):
+        min_level = None
+    result = []
+    for entry in entries:
+        if min_level is not None:
+            entry_level = logging.getLevelName(entry.get('level', ''))
+            if isinstance(entry_level, int) and entry_level < min_level:
+                continue
+        if since is not None or until is not None:
+            t = entry['time'] if 'time' in entry else entry_time(entry)
+            if t is None or (since is not None and t < since) or (until is not None and t > until):
+                continue
+        result.append(entry)
+    return result
+
+
+class LogStore(logging.Handler):
+    """Ultimi record in memoria, già strutturati, per le query con filtri"""
+
+    def __init__(self, capacity=5000):
+        super().__init__()
+        self._entries = deque(maxlen=capacity)
+        self._store_lock = threading.Lock()
+
+    def emit(self, record):
+        entry = record_entry(record)
+        entry['message'] = entry.pop('event')
+        entry['time'] = record.created
+        with self._store_lock:
+            self._entries.append(entry)
+
+    def seed(self, lines):
+        """Precarica il contenuto del file di log (es. all'avvio)"""
+        with self._store_lock:
+            for line in lines:
+                entry = parse_log_line(line)
+                if entry:
+                    entry['time'] = entry_time(entry)
+                    self._entries.append(entry)
+
+    def clear(self):
+        with self._store_lock:
+            self._entries.clear()
+
+    def query(self, level=None, since=None, until=None, limit=100):
+        """Ultime `limit` voci che rispettano i filtri (senza il campo interno 'time')"""
+        with self._store_lock:
+            entries = list(self._entries)
+        matched = filter_entries(entries, level, since, until)[-limit:]
+        return [{k: v for k, v in entry.items() if k != 'time'} for entry in matched]
+
+
+def setup_logging(name, log_file, extra_handlers=(), rotate=True):
+    """Configura il logger `name` con console e file dietro una coda.
+
+    Ritorna (logger, file_handler); il QueueListener viene fermato (e la coda
+    svuotata) all'uscita del processo. Con rotate=False (più processi sullo
+    stesso file) il file non viene ruotato ma solo riaperto se ruotato da fuori.
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    logger.handlers.clear()  # Rimuovi handler esistenti
+
+    # Console handler
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(logging.Formatter('%(message)s'))
+
+    # File handler
+    if rotate:
+        file_handler = RotatingFileHandler(str(log_file), maxBytes=1024*1024, backupCount=3, encoding='utf-8')
+    else:
+        file_handler = WatchedFileHandler(str(log_file), encoding='utf-8')
+    if log_format() == 'json':
+        file_handler.setFormatter(JsonLinesFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, console_handler, file_handler, *extra_handlers,
+                             respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    logger.addHandler(QueueHandler(log_queue))
+    return logger, file_handler
@@ -0,0 +1,102 @@
+"""
+log_tail.py
+Lettura efficiente dei file di log per /api/logs.
+
+tail_lines() legge solo gli ultimi blocchi del file cercando a ritroso, e
+read_since() legge solo i byte scritti dopo un cursore. Il cursore contiene
+l'inode del file oltre all'offset, così una rotazione di RotatingFileHandler
+(file rinominato in .1 e ricreato) o uno svuotamento vengono riconosciuti.
+"""
+import os
+
+BLOCK_SIZE = 8192
+MAX_READ = 256 * 1024   # byte massimi letti per chiamata con cursore
+
+
+def _decode(data):
+    return data.decode('utf-8', errors='replace').splitlines()
+
+
+def tail_lines(path, n=100):
+    """Ultime n righe complete del file e cursore alla fine del file"""
+    try:
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            end = st.st_size
+            pos = end
+            data = b''
+            while pos > 0 and data.count(b'\n') <= n:
+                step = min(BLOCK_SIZE, pos)
+                pos -= step
+                f.seek(pos)
+                data = f.read(step) + data
+    except FileNotFoundError:
+        return [], (0, 0)
+    # Scarta l'eventuale riga finale incompleta (verrà letta col cursore)
+    cut = data.rfind(b'\n') + 1
+    end -= len(data) - cut
+    lines = _decode(data[:cut])
+    return lines[-n:], (st.st_ino, end)
+
+
+def end_cursor(path):
+    """Cursore alla fine attuale del file"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return (0, 0)
+    return (st.st_ino, st.st_size)
+
+
+def read_since(path, cursor, n=100):
+    """Righe complete scritte dopo il cursore (inode, offset) e nuovo cursore.
+
+    Se il file è stato ruotato vengono lette prima le righe rimaste nel
+    backup .1, se il file è stato svuotato si riparte dall'inizio. Se ci sono
+    più di MAX_READ byte nuovi si salta alle ultime n righe.
+    """
+    ino, offset = cursor
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return [], (0, 0)
+    lines = []
+    if st.st_ino != ino:
+        rotated = f'{path}.1'
+        try:
+            if os.stat(rotated).st_ino == ino:
+                lines, _ = _read_range(rotated, offset)
+        except FileNotFoundError:
+            pass
+        offset = 0
+    elif st.st_size < offset:
+        offset = 0
+    if st.st_size - offset > MAX_READ:
+        return tail_lines(path, n)
+    new_lines, end = _read_range(path, offset)
+    return lines + new_lines, (st.st_ino, end)
+
+
+def _read_range(path, offset):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(MAX_READ)
+    cut = data.rfind(b'\n') + 1
+    return _decode(data[:cut]), offset + cut
+
+
+def encode_cursor(cursors):
+    """{sorgente: (inode, offset)} -> stringa opaca per i client"""
+    return ','.join(f'{source}:{ino}:{offset}' for source, (ino, offset) in sorted(cursors.items()))
+
+
+def decode_cursor(value):
+    """Inverso di encode_cursor; ignora le parti non valide"""
+    cursors = {}
+    for part in (value or '').split(','):
+        try:
+            source, ino, offset = part.split(':')
+            cursors[source] = (int(ino), int(offset))
+        except ValueError:
+            continue
+    return cursors
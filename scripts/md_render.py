@@ -0,0 +1,173 @@
+"""
+md_render.py
+Rendering Markdown -> HTML lato server (Python-Markdown + Pygments).
+
+Produce l'HTML con id sui titoli, l'indice dei titoli (TOC) e il codice già
+evidenziato, usato dal generatore per i viewer e da /api/render per l'editor.
+Se Python-Markdown non è installato available() è False e i viewer tornano al
+rendering nel browser con marked e highlight.js.
+
+Le immagini sono caricate in modo lazy; quelle caricate dall'editor (nome da
+hash in images/) ricevono anche dimensioni e srcset delle varianti.
+"""
+from collections import OrderedDict
+import functools
+import hashlib
+import html
+import re
+import threading
+
+import image_store
+
+try:
+    import markdown
+    from markdown.extensions.toc import slugify_unicode
+except ImportError:
+    markdown = None
+
+try:
+    from pygments.formatters import HtmlFormatter
+except ImportError:
+    HtmlFormatter = None
+
+FRONTMATTER_RE = re.compile(r'^---\s*\n.*?\n---\s*\n', re.DOTALL)
+IMG_TAG_RE = re.compile(r'<img\b[^>]*>')
+IMAGE_SRC_RE = re.compile(r'\ssrc="/images/([^"/?#]+)"')
+
+# Temi del selettore dei viewer -> stili Pygments equivalenti
+CODE_THEMES = {
+    'atom-one-dark': 'one-dark',
+    'github-dark': 'github-dark',
+    'monokai': 'monokai',
+    'nord': 'nord',
+    'dracula': 'dracula'
+}
+DEFAULT_CODE_THEME = 'atom-one-dark'
+
+_local = threading.local()   # le istanze Markdown non sono thread-safe
+
+
+def available():
+    """True se il rendering lato server è disponibile"""
+    return markdown is not None
+
+
+def engine_version():
+    """Versioni di Python-Markdown e Pygments (entrano nel fingerprint del generatore)"""
+    if markdown is None:
+        return 'client'
+    try:
+        import pygments
+        pygments_version = pygments.__version__
+    except ImportError:
+        pygments_version = 'none'
+    return f'markdown-{markdown.__version__}+pygments-{pygments_version}'
+
+
+def _converter():
+    md = getattr(_local, 'md', None)
+    if md is None:
+        md = markdown.Markdown(
+            extensions=['extra', 'sane_lists', 'toc', 'codehilite'],
+            extension_configs={
+                'toc': {'slugify': slugify_unicode, 'toc_depth': '1-3'},
+                'codehilite': {'css_class': 'codehilite', 'guess_lang': False}
+            })
+        _local.md = md
+    return md.reset()
+
+
+def _flatten_toc(tokens, out):
+    for token in tokens:
+        out.append({'level': token['level'], 'id': token['id'], 'title': html.unescape(token['name'])})
+        _flatten_toc(token['children'], out)
+    return out
+
+
+def render_markdown(text):
+    """Markdown -> {'html', 'toc'} (None se Python-Markdown non è installato).
+
+    Il frontmatter YAML iniziale non viene renderizzato: titolo e tag sono già
+    mostrati dai metadati.
+    """
+    if markdown is None:
+        return None
+    if text.startswith('---'):
+        text = FRONTMATTER_RE.sub('', text, count=1)
+    md = _converter()
+    body = IMG_TAG_RE.sub(_image_tag, md.convert(text))
+    return {'html': body, 'toc': _flatten_toc(md.toc_tokens, [])}
+
+
+def _image_tag(match):
+    """Aggiunge a un <img> lazy loading e, per le immagini caricate, dimensioni e srcset"""
+    tag = match.group(0)
+    attrs = []
+    if ' loading=' not in tag:
+        attrs.append('loading="lazy" decoding="async"')
+    src = IMAGE_SRC_RE.search(tag)
+    info = image_store.describe(src.group(1)) if src else None
+    if info and info['width'] and ' width=' not in tag:
+        attrs.append(f'width="{info["width"]}" height="{info["height"]}"')
+    if info and info['srcset'] and ' srcset=' not in tag:
+        attrs.append(f'srcset="{html.escape(info["srcset"])}" sizes="{image_store.SIZES}"')
+    if not attrs:
+        return tag
+    end = -2 if tag.endswith('/>') else -1
+    return f'{tag[:end].rstrip()} {" ".join(attrs)} {tag[end:]}'
+
+
+def render_toc_html(toc):
+    """Voci <li> della TOC dei viewer"""
+    return ''.join(
+        f'<li class="level-{item["level"]}"><a href="#{html.escape(item["id"])}">{html.escape(item["title"])}</a></li>'
+        for item in toc)
+
+
+@functools.lru_cache(maxsize=None)
+def code_themes_css():
+    """CSS Pygments di tutti i temi, selezionati con l'attributo data-code-theme"""
+    if HtmlFormatter is None:
+        return ''
+    parts = []
+    for name, style in CODE_THEMES.items():
+        formatter = HtmlFormatter(style=style)
+        selector = f'[data-code-theme="{name}"] .codehilite'
+        parts.extend(formatter.get_background_style_defs(selector))
+        parts.extend(formatter.get_token_style_defs(selector))
+    return '\n'.join(parts) + '\n'
+
+
+class RenderCache:
+    """Cache LRU dei render indicizzata per hash del contenuto"""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._items = OrderedDict()   # sha1 -> risultato di render_markdown
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, text):
+        """Render con cache; ritorna (hash, risultato) con risultato None se non disponibile"""
+        key = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        with self._lock:
+            result = self._items.get(key)
+            if result is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return key, result
+        result = render_markdown(text)
+        if result is None:
+            return key, None
+        with self._lock:
+            self.misses += 1
+            self._items[key] = result
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return key, result
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._items), 'maxsize': self.maxsize,
+                    'hits': self.hits, 'misses': self.misses}
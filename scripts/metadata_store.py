@@ -0,0 +1,354 @@
+"""
+metadata_store.py
+Metadati dei file in md/ tenuti in memoria (titolo, tag, parole, dimensione, mtime).
+
+I record vengono validati con stat(): un file viene riletto solo se mtime o
+dimensione sono cambiati. Totali e conteggio dei tag sono mantenuti in modo
+incrementale, così /api/stats è un'aggregazione in memoria.
+
+Indici secondari, aggiornati insieme ai record: tag -> insieme dei percorsi
+e, per ogni campo del frontmatter (più name, title, modified, words, size),
+una lista ordinata di (chiave, percorso). /api/query interseca gli insiemi e
+risolve uguaglianze e intervalli con bisect, /api/tags legge i conteggi.
+Le stesse liste ordinate servono le pagine di /api/files e /api/search
+(page()), insieme al numero di file sotto ogni cartella.
+"""
+import bisect
+import heapq
+import threading
+import time
+
+from pagination import is_under
+from regenerate_preview import document_meta, frontmatter_value, scan_document
+
+# Campi sempre presenti, dai metadati del file: sono gli ordinamenti paginabili
+BUILTIN_FIELDS = {
+    'path': lambda e: e['path'],
+    'name': lambda e: e['name'],
+    # Il titolo mostrato è il testo originale; confronti e ordine usano il valore tipizzato
+    'title': lambda e: e['title'] if e.get('fields', {}).get('title') in (None, '') else e['fields']['title'],
+    'modified': lambda e: e['modified'],
+    'words': lambda e: e['word_count'],
+    'size': lambda e: e['size']
+}
+RANGE_OPS = ('>=', '<=', '>', '<', '=')
+MAX_PATH = '\U0010ffff'   # maggiore di ogni percorso: (chiave, MAX_PATH) chiude le voci con quella chiave
+
+
+def sort_key(value):
+    """Chiave confrontabile per valori di tipo misto: prima i numeri, poi il testo (senza maiuscole)"""
+    if isinstance(value, (bool, int, float)):
+        return (0, float(value))
+    return (1, str(value).casefold())
+
+
+def parse_filter(expr):
+    """'campo', 'campo=valore', 'campo>=valore', 'campo=da..a' -> (campo, op, valore/i)"""
+    for op in RANGE_OPS:
+        field, sep, raw = expr.partition(op)
+        if sep and field.strip():
+            field = field.strip().lower()
+            if op == '=' and '..' in raw:
+                low, high = raw.split('..', 1)
+                return field, '..', (frontmatter_value(low), frontmatter_value(high))
+            return field, op, frontmatter_value(raw)
+    return expr.strip().lower(), None, None
+
+
+class MetadataStore:
+    """Record di metadati per percorso relativo con totali incrementali"""
+
+    def __init__(self, base_dir, max_age=5.0):
+        self.base_dir = base_dir
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._entries = {}        # percorso -> record (senza testo)
+        self._total_words = 0
+        self._total_size = 0
+        self._by_tag = {}         # tag -> insieme di percorsi
+        self._postings = {}       # campo -> lista ordinata di (sort_key, percorso)
+        self._folder_counts = {}  # cartella -> file .md contenuti (anche nelle sottocartelle)
+        self.version = 0          # cambia a ogni record aggiunto o rimosso (solo in questo processo)
+        self._last_validate = 0.0
+        self.reads = 0            # file letti dall'avvio (per diagnostica e /api/metrics)
+        self.bytes_read = 0
+
+    def validate(self, force=False):
+        """Riallinea i record ai file con stat(); rilegge solo i file cambiati.
+
+        Senza force non fa nulla se l'ultima validazione è più recente di
+        max_age secondi: nel frattempo i record sono tenuti aggiornati dalle
+        mutazioni tramite refresh().
+        """
+        with self._lock:
+            if not force and time.time() - self._last_validate < self.max_age:
+                return
+            seen = set()
+            for path in self.base_dir.rglob('*.md'):
+                if path.is_file():
+                    rel = path.relative_to(self.base_dir).as_posix()
+                    if self._update(rel, path) is not None:
+                        seen.add(rel)
+            for rel in [r for r in self._entries if r not in seen]:
+                self._drop(rel)
+            self._last_validate = time.time()
+
+    def refresh(self, paths):
+        """Aggiorna i record dei percorsi relativi indicati (file o cartelle)"""
+        with self._lock:
+            for rel in paths:
+                rel = rel.replace('\\', '/').strip('/')
+                full = self.base_dir / rel
+                for known in [r for r in self._entries if r == rel or r.startswith(rel + '/')]:
+                    if not (self.base_dir / known).is_file():
+                        self._drop(known)
+                if full.is_file() and full.suffix.lower() == '.md':
+                    self._update(rel, full)
+                elif full.is_dir():
+                    for path in full.rglob('*.md'):
+                        if path.is_file():
+                            self._update(path.relative_to(self.base_dir).as_posix(), path)
+
+    def get(self, rel):
+        """Record di un file, validato con un solo stat() (None se non esiste)"""
+        full = self.base_dir / rel
+        with self._lock:
+            if not full.is_file():
+                self._drop(rel)
+                return None
+            entry = self._update(rel, full)
+            return dict(entry) if entry else None
+
+    def _update(self, rel, path):
+        """Record aggiornato del file (None se è sparito: eliminato o rinominato nel frattempo)"""
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            self._drop(rel)
+            return None
+        entry = self._entries.get(rel)
+        if entry and entry['modified'] == st.st_mtime and entry['size'] == st.st_size:
+            return entry
+        try:
+            doc = scan_document(path, st)
+        except (OSError, UnicodeDecodeError):
+            return entry
+        self.reads += 1
+        self.bytes_read += st.st_size
+        self._drop(rel)
+        entry = document_meta(doc)
+        entry['path'] = rel
+        entry['name'] = path.name
+        self._entries[rel] = entry
+        self._total_words += entry['word_count']
+        self._total_size += entry['size']
+        for tag in entry['tags']:
+            self._by_tag.setdefault(tag, set()).add(rel)
+        for field, key in self._field_keys(entry):
+            bisect.insort(self._postings.setdefault(field, []), (key, rel))
+        for folder in self._ancestors(rel):
+            self._folder_counts[folder] = self._folder_counts.get(folder, 0) + 1
+        self.version += 1
+        return entry
+
+    def _drop(self, rel):
+        entry = self._entries.pop(rel, None)
+        if entry is None:
+            return
+        self._total_words -= entry['word_count']
+        self._total_size -= entry['size']
+        for tag in entry['tags']:
+            paths = self._by_tag.get(tag)
+            if paths is not None:
+                paths.discard(rel)
+                if not paths:
+                    del self._by_tag[tag]
+        for field, key in self._field_keys(entry):
+            postings = self._postings[field]
+            i = bisect.bisect_left(postings, (key, rel))
+            if i < len(postings) and postings[i] == (key, rel):
+                del postings[i]
+            if not postings:
+                del self._postings[field]
+        for folder in self._ancestors(rel):
+            self._folder_counts[folder] -= 1
+            if not self._folder_counts[folder]:
+                del self._folder_counts[folder]
+        self.version += 1
+
+    @staticmethod
+    def _ancestors(rel):
+        """Cartelle che contengono il percorso ('a/b/c.md' -> 'a', 'a/b')"""
+        parts = rel.split('/')[:-1]
+        return ['/'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+    def folder_count(self, folder):
+        """File .md sotto una cartella, sottocartelle incluse ('' = tutti)"""
+        with self._lock:
+            return len(self._entries) if not folder else self._folder_counts.get(folder, 0)
+
+    @staticmethod
+    def _field_keys(entry):
+        """(campo, chiave) indicizzati per un record; i campi lista danno una chiave per voce"""
+        keys = {(field, sort_key(get(entry))) for field, get in BUILTIN_FIELDS.items()}
+        for field, value in entry.get('fields', {}).items():
+            if field in BUILTIN_FIELDS:
+                continue
+            for item in (value if isinstance(value, list) else [value]):
+                if item is not None:
+                    keys.add((field, sort_key(item)))
+        return keys
+
+    def stats(self, recent=10):
+        """Statistiche globali calcolate dai record in memoria"""
+        self.validate()
+        with self._lock:
+            latest = heapq.nlargest(recent, self._entries.values(), key=lambda e: e['modified'])
+            return {
+                'total_files': len(self._entries),
+                'total_words': self._total_words,
+                'total_size': self._total_size,
+                'tags': {tag: len(paths) for tag, paths in self._by_tag.items()},
+                'recent_files': [{
+                    'path': e['path'],
+                    'name': e['name'],
+                    'modified': e['modified'],
+                    'word_count': e['word_count']
+                } for e in latest]
+            }
+
+    def tags(self):
+        """Tag con numero di file, dal più usato (a parità, in ordine alfabetico)"""
+        self.validate()
+        with self._lock:
+            counts = [(tag, len(paths)) for tag, paths in self._by_tag.items()]
+        counts.sort(key=lambda item: (-item[1], item[0].casefold()))
+        return [{'tag': tag, 'count': count} for tag, count in counts]
+
+    def _matching(self, field, op, value):
+        """Percorsi che soddisfano un filtro su un campo (insieme)"""
+        postings = self._postings.get(field, [])
+        if op is None:
+            return {rel for _, rel in postings}
+        if op == '..':
+            low, high = sort_key(value[0]), sort_key(value[1])
+            start = bisect.bisect_left(postings, (low,))
+            end = bisect.bisect_left(postings, (high, MAX_PATH))
+        else:
+            key = sort_key(value)
+            # Gli intervalli aperti restano nel tipo del valore (numeri o testo)
+            type_start = bisect.bisect_left(postings, ((key[0],),))
+            type_end = bisect.bisect_left(postings, ((key[0] + 1,),))
+            first = bisect.bisect_left(postings, (key,))
+            after = bisect.bisect_left(postings, (key, MAX_PATH))
+            start, end = {
+                '=': (first, after),
+                '>=': (first, type_end),
+                '>': (after, type_end),
+                '<=': (type_start, after),
+                '<': (type_start, first)
+            }[op]
+        return {rel for _, rel in postings[start:end]}
+
+    def query(self, tags=(), filters=(), sort='name', limit=100, cursor=None, folder=''):
+        """Documenti con tutti i tag e i filtri indicati, ordinati per un campo.
+
+        filters: espressioni di parse_filter(). sort: nome di un campo,
+        con '-' davanti per l'ordine decrescente; i documenti senza quel campo
+        vengono in fondo. Con gli ordinamenti di BUILTIN_FIELDS la risposta è
+        paginata come page(). Ritorna (totale, record, cursore successivo o None).
+        """
+        self.validate()
+        descending = sort.startswith('-')
+        sort_field = sort.lstrip('-').lower() or 'name'
+        with self._lock:
+            candidates = None
+            for tag in tags:
+                paths = self._by_tag.get(tag, set())
+                candidates = set(paths) if candidates is None else candidates & paths
+            for expr in filters:
+                paths = self._matching(*parse_filter(expr))
+                candidates = paths if candidates is None else candidates & paths
+            if sort_field in BUILTIN_FIELDS:
+                return self._page(sort_field, descending, limit, cursor, folder, candidates)
+            if cursor is not None:
+                raise ValueError('invalid_cursor')
+            if candidates is None:
+                candidates = set(self._entries)
+            if folder:
+                candidates = {rel for rel in candidates if is_under(rel, folder)}
+
+            # La lista ordinata del campo dà già l'ordine: si scorre tenendo i candidati
+            ordered = []
+            seen = set()
+            postings = self._postings.get(sort_field, [])
+            for _, rel in (reversed(postings) if descending else postings):
+                if rel in candidates and rel not in seen:
+                    seen.add(rel)
+                    ordered.append(rel)
+            ordered.extend(sorted(candidates - seen))
+            results = [dict(self._entries[rel]) for rel in ordered[:limit]]
+        return len(candidates), results, None
+
+    def page(self, sort='path', limit=100, cursor=None, folder='', candidates=None):
+        """Una pagina di record in uno degli ordinamenti mantenuti (BUILTIN_FIELDS).
+
+        sort: campo, con '-' davanti per l'ordine decrescente. cursor: valori
+        del cursore della pagina precedente (pagination.decode_cursor). folder:
+        solo i file sotto questa cartella. candidates: percorsi a cui limitarsi
+        (es. i risultati di una ricerca). Ritorna (totale, record, cursore
+        successivo o None); ValueError per ordinamento o cursore non validi.
+        """
+        descending = sort.startswith('-')
+        field = sort.lstrip('-').lower() or 'path'
+        if field not in BUILTIN_FIELDS:
+            raise ValueError('invalid_sort')
+        self.validate()
+        with self._lock:
+            return self._page(field, descending, limit, cursor, folder, candidates)
+
+    def _page(self, field, descending, limit, cursor, folder, candidates):
+        postings = self._postings.get(field, [])
+        lo, hi = 0, len(postings)
+        if field == 'path' and folder:
+            # Nell'ordine per percorso i file di una cartella sono contigui
+            prefix = folder.casefold() + '/'
+            lo = bisect.bisect_left(postings, ((1, prefix),))
+            hi = bisect.bisect_left(postings, ((1, prefix + MAX_PATH),))
+        if cursor is not None:
+            position = self._cursor_position(cursor, field, descending)
+            if descending:
+                hi = min(hi, bisect.bisect_left(postings, position))
+            else:
+                lo = max(lo, bisect.bisect_right(postings, position))
+
+        page = []
+        next_cursor = None
+        for i in (range(hi - 1, lo - 1, -1) if descending else range(lo, hi)):
+            rel = postings[i][1]
+            if (candidates is not None and rel not in candidates) or (folder and not is_under(rel, folder)):
+                continue
+            if len(page) == limit:
+                (rank, value), last = postings[page[-1]]
+                next_cursor = [field, descending, rank, value, last]
+                break
+            page.append(i)
+
+        if candidates is None:
+            total = self.folder_count(folder)
+        else:
+            total = sum(1 for rel in candidates if rel in self._entries and is_under(rel, folder))
+        return total, [dict(self._entries[postings[i][1]]) for i in page], next_cursor
+
+    @staticmethod
+    def _cursor_position(cursor, field, descending):
+        """(chiave, percorso) dell'ultimo elemento della pagina precedente"""
+        try:
+            cursor_field, cursor_descending, rank, value, rel = cursor
+            key = (0, float(value)) if rank == 0 else (1, str(value))
+        except (TypeError, ValueError):
+            raise ValueError('invalid_cursor')
+        # Un cursore vale solo per l'ordinamento con cui è stato prodotto
+        if cursor_field != field or cursor_descending != descending or rank not in (0, 1):
+            raise ValueError('invalid_cursor')
+        return key, str(rel)
@@ -0,0 +1,187 @@
+"""
+metrics.py
+Metriche del server in memoria, esportate nel formato testuale di Prometheus.
+
+Counter, Gauge e Histogram sono volutamente minimi: un lock per metrica e,
+per ogni osservazione, un bisect sui bucket, così il costo per richiesta resta
+di pochi microsecondi. I valori che un servizio tiene già (hit della cache di
+render, profondità della coda di rigenerazione...) non vengono duplicati: le
+funzioni registrate con collect() li leggono solo quando /api/metrics viene
+interrogato. Con più worker ogni processo ha le proprie metriche.
+"""
+from bisect import bisect_left
+import math
+import threading
+
+# Secondi: dalle risposte servite dalla cache alle build complete
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUILD_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}   # tupla dei valori delle etichette -> valore
+
+    def _header(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = self._header()
+        lines.extend(f'{self.name}{_labels(self.label_names, key)} {_number(value)}' for key, value in items)
+        return lines
+
+    def values(self):
+        """Valori correnti: tupla delle etichette -> valore"""
+        with self._lock:
+            return dict(self._values)
+
+
+class Counter(_Metric):
+    """Contatore monotono"""
+    kind = 'counter'
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    """Valore che sale e scende (es. richieste in corso)"""
+    kind = 'gauge'
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, amount=1, *labels):
+        self.inc(-amount, *labels)
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    """Distribuzione per bucket, con somma e conteggio (quantili stimati da histogram_quantile)"""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, ([*counts], total, count)) for key, (counts, total, count) in self._values.items())
+        lines = self._header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), counts):
+                cumulative += n
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f'{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, key)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, key)} {count}')
+        return lines
+
+    def summary(self):
+        """Per serie: conteggio, media e p50/p95/p99 stimati dai bucket (in unità osservate)"""
+        with self._lock:
+            items = [(key, ([*counts], total, count)) for key, (counts, total, count) in self._values.items()]
+        result = {}
+        for key, (counts, total, count) in items:
+            result[key] = {'count': count, 'mean': total / count if count else None,
+                           **{f'p{q}': self._quantile(counts, count, q / 100) for q in (50, 95, 99)}}
+        return result
+
+    def _quantile(self, counts, count, q):
+        # Come histogram_quantile di Prometheus: interpolazione lineare nel bucket
+        if not count:
+            return None
+        rank = q * count
+        cumulative = 0
+        for i, n in enumerate(counts):
+            if cumulative + n >= rank and n:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / n
+            cumulative += n
+        return self.buckets[-1]
+
+
+class Registry:
+    """Metriche dell'applicazione e funzioni lette al momento dell'esportazione"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._add(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def collect(self, name, help_text, kind, read, labels=()):
+        """Metrica letta solo all'esportazione: read() ritorna un numero o {etichette: numero}"""
+        self._collectors.append((name, help_text, kind, read, tuple(labels)))
+
+    def render(self):
+        """Testo nel formato di esposizione di Prometheus (text/plain; version=0.0.4)"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, help_text, kind, read, label_names in self._collectors:
+            try:
+                value = read()
+            except Exception:
+                continue   # un servizio non ancora avviato non blocca le altre metriche
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            series = value if isinstance(value, dict) else {(): value}
+            for key, number in sorted(series.items()):
+                key = key if isinstance(key, tuple) else (key,)
+                lines.append(f'{name}{_labels(label_names, key)} {_number(number)}')
+        return '\n'.join(lines) + '\n'
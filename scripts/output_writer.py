@@ -0,0 +1,49 @@
+"""
+output_writer.py
+Scrittura degli output generati (viewer, preview.html, asset, manifest).
+
+write_if_changed() non tocca un file che contiene già i byte da scrivere:
+mtime ed ETag restano invariati e i viewer aperti non si ricaricano. Le
+scritture passano da un file temporaneo nella stessa cartella e os.replace(),
+quindi chi legge vede il file vecchio o quello nuovo, mai uno scritto a metà.
+"""
+import os
+
+
+def atomic_write(path, data):
+    """Scrive bytes o testo UTF-8 in path tramite file temporaneo + os.replace"""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Il pid nel nome evita collisioni tra i processi di una build con --jobs
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            tmp_path.unlink()
+        except OSError:
+            pass
+        raise
+    return len(data)
+
+
+def same_content(path, data):
+    """True se il file esiste e contiene già esattamente data (bytes)"""
+    try:
+        if path.stat().st_size != len(data):
+            return False
+        return path.read_bytes() == data
+    except OSError:
+        return False
+
+
+def write_if_changed(path, data):
+    """Scrive solo se il contenuto è diverso; ritorna i byte scritti (0 = invariato)"""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    if same_content(path, data):
+        return 0
+    return atomic_write(path, data)
@@ -0,0 +1,54 @@
+"""
+pagination.py
+Cursori opachi per la paginazione di /api/files, /api/search e /api/query.
+
+Il cursore contiene la chiave di ordinamento dell'ultimo elemento restituito
+(paginazione per chiave, non per offset): la pagina successiva riparte subito
+dopo quella chiave con un bisect sull'ordinamento già mantenuto in memoria,
+e file aggiunti o rimossi nel frattempo non fanno saltare né ripetere voci.
+"""
+import base64
+import json
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+def encode_cursor(values):
+    """Lista JSON-serializzabile -> stringa opaca per i client"""
+    data = json.dumps(values, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Inverso di encode_cursor (None se assente); solleva ValueError se non valido"""
+    if not token:
+        return None
+    try:
+        data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(data.decode('utf-8'))
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError('invalid_cursor') from e
+    if not isinstance(values, list):
+        raise ValueError('invalid_cursor')
+    return values
+
+
+def parse_limit(value, default=DEFAULT_LIMIT, maximum=MAX_LIMIT):
+    """Parametro limit limitato a [1, maximum]; solleva ValueError se non è un intero"""
+    if value in (None, ''):
+        return default
+    try:
+        return max(1, min(int(value), maximum))
+    except ValueError as e:
+        raise ValueError('invalid_limit') from e
+
+
+def normalize_folder(value):
+    """Prefisso di cartella relativo a md/ ('' = tutte)"""
+    return (value or '').replace('\\', '/').strip('/')
+
+
+def is_under(rel, folder):
+    """True se il percorso sta sotto la cartella (o la cartella è '')"""
+    return not folder or rel.startswith(folder + '/')
@@ -0,0 +1,165 @@
+"""
+regen_service.py
+Servizio di rigenerazione in-process: un worker in background con una coda che
+accorpa le richieste e chiama regenerate_preview.build() senza avviare processi.
+
+Le richieste arrivate mentre una build è in corso vengono unite in un'unica
+build successiva; ogni richiesta riceve un id per consultarne lo stato.
+"""
+from collections import OrderedDict
+import itertools
+import threading
+import time
+
+import regenerate_preview
+
+
+class RegenerationService:
+    """Worker singolo con coda coalescente di rigenerazioni mirate"""
+
+    def __init__(self, build=regenerate_preview.build, logger=None, history=200, on_events=None,
+                 on_build=None):
+        self._build = build
+        self._logger = logger
+        self._on_events = on_events   # callback(eventi) con i cambiamenti per percorso
+        self._on_build = on_build     # callback(secondi, risultato, errore) a fine build (metriche)
+        self._history = history
+        self._cond = threading.Condition()
+        self._ids = itertools.count(1)
+        self._jobs = OrderedDict()   # id -> stato, ultimi `history` job
+        self._pending = []           # id dei job in attesa della prossima build
+        self._pending_paths = set()
+        self._pending_full = False
+        self._thread = None
+        self._stopping = False
+
+    def start(self):
+        """Avvia il worker (idempotente)"""
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='regen-service', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """Ferma il worker dopo aver completato i job già in coda"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def enqueue(self, paths=None, reason=''):
+        """Accoda una rigenerazione per i percorsi relativi a md/ indicati.
+
+        paths=None richiede una scansione completa (sempre incrementale).
+        Ritorna subito lo stato del job.
+        """
+        self.start()
+        with self._cond:
+            job_id = next(self._ids)
+            job = {
+                'id': job_id,
+                'status': 'queued',
+                'reason': reason,
+                'paths': sorted(paths) if paths is not None else None,
+                'queued_at': time.time(),
+                'finished_at': None,
+                'result': None,
+                'error': None
+            }
+            self._jobs[job_id] = job
+            while len(self._jobs) > self._history:
+                self._jobs.popitem(last=False)
+            self._pending.append(job_id)
+            if paths is None:
+                self._pending_full = True
+            else:
+                self._pending_paths.update(paths)
+            self._cond.notify_all()
+            return dict(job)
+
+    def status(self, job_id):
+        """Stato di un job (None se sconosciuto o uscito dallo storico)"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def wait(self, job_id, timeout=None):
+        """Attende la fine di un job e ne ritorna lo stato"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None or job['status'] in ('done', 'error'):
+                    return dict(job) if job else None
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return dict(job)
+                self._cond.wait(remaining)
+
+    def queue_depth(self):
+        """Numero di job in attesa della prossima build"""
+        with self._cond:
+            return len(self._pending)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopping:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                batch = self._pending
+                changed = None if self._pending_full else set(self._pending_paths)
+                self._pending = []
+                self._pending_paths = set()
+                self._pending_full = False
+                for job_id in batch:
+                    if job_id in self._jobs:
+                        self._jobs[job_id]['status'] = 'running'
+
+            started = time.perf_counter()
+            result, error = None, None
+            try:
+                result = self._build(incremental=True, changed=changed)
+            except Exception as e:
+                error = str(e)
+            duration_ms = (time.perf_counter() - started) * 1000
+            if self._on_build:
+                try:
+                    self._on_build(duration_ms / 1000, result, error)
+                except Exception as e:
+                    if self._logger:
+                        self._logger.error(f'Errore callback build: {e}')
+            events = result.pop('events', []) if result else []
+            if events and self._on_events:
+                try:
+                    self._on_events(events)
+                except Exception as e:
+                    if self._logger:
+                        self._logger.error(f'Errore notifica eventi: {e}')
+
+            if self._logger:
+                if error:
+                    self._logger.error(f'Errore rigenerazione: {error}')
+                else:
+                    self._logger.info(
+                        f'✓ Rigenerazione completata in {duration_ms:.0f} ms '
+                        f'({len(batch)} richieste, {len(changed) if changed is not None else "tutti i"} percorsi)',
+                        extra={'duration_ms': round(duration_ms, 1)})
+                    for failure in result.get('errors', []):
+                        self._logger.warning(f'Viewer non generato per {failure["path"]}: {failure["error"]}',
+                                             extra={'path': failure['path']})
+
+            with self._cond:
+                for job_id in batch:
+                    job = self._jobs.get(job_id)
+                    if job:
+                        job['status'] = 'error' if error else 'done'
+                        job['finished_at'] = time.time()
+                        job['duration_ms'] = round(duration_ms, 1)
+                        job['result'] = result
+                        job['error'] = error
+                self._cond.notify_all()
@@ -1,28 +1,62 @@
 """
 regenerate_preview_v2.py
 Genera preview.html e viewer HTML avanzati con tutte le funzionalità
+
+Uso:
+  python scripts/regenerate_preview.py                 # rigenerazione completa
+  python scripts/regenerate_preview.py --incremental   # solo i file cambiati (manifest)
+  python scripts/regenerate_preview.py --jobs 4        # viewer generati da 4 processi
+  python scripts/regenerate_preview.py --incremental --changed=Corso1/lezione1.md   # solo i percorsi indicati
+  python scripts/regenerate_preview.py --incremental --sizes   # report byte grezzi vs gzip/Brotli
 """
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+import argparse
+import hashlib
 import html
+import os
 import re
 import datetime
+import functools
 import json
+import time
+import zlib
+
+from compression import (BROTLI_QUALITY_ASSETS, ENCODINGS, has_siblings, is_sibling_name,
+                         remove_siblings, size_report, write_siblings)
+from file_lock import FileLock
+from output_writer import atomic_write, write_if_changed
+from md_render import DEFAULT_CODE_THEME, code_themes_css, engine_version, render_markdown, render_toc_html
 
 ROOT = Path(__file__).resolve().parent.parent
 MD_DIR = ROOT / 'md'
 WEB_DIR = ROOT / 'web'
+CACHE_DIR = ROOT / 'cache'
+MANIFEST_FILE = CACHE_DIR / 'build_manifest.json'
+MANIFEST_VERSION = 1
+# Una build alla volta anche tra processi (worker del server, watcher)
+BUILD_LOCK = FileLock(CACHE_DIR / 'build.lock')
+# Le modifiche fatte fuori dall'API le rigenera un solo processo: il watcher
+# se è attivo (tiene WATCHER_LOCK_FILE), altrimenti il worker che tiene
+# EXTERNAL_LOCK_FILE; gli altri aggiornano solo gli indici in memoria
+WATCHER_LOCK_FILE = CACHE_DIR / 'watcher.lock'
+EXTERNAL_LOCK_FILE = CACHE_DIR / 'external_regen.lock'
+# CSS/JS condivisi di viewer e preview.html: sorgenti in scripts/assets/,
+# pubblicati in web/assets/ con l'hash del contenuto nel nome
+ASSETS_SRC = Path(__file__).resolve().parent / 'assets'
+ASSETS_DIR = WEB_DIR / 'assets'
+ASSET_SOURCES = ('viewer.css', 'viewer.js', 'preview.css', 'preview.js')
+# Contenuto delle cartelle di preview.html, caricato da preview.js all'apertura:
+# la pagina contiene solo il primo livello, qualunque sia la dimensione del vault
+TREE_DIR = WEB_DIR / '_tree'
 WEB_DIR.mkdir(exist_ok=True)
 
-# Scansiona ricorsivamente tutti i file .md
-md_files = sorted([p for p in MD_DIR.rglob('*.md') if p.is_file()])
-
 # Struttura ad albero per organizzare i file
 def build_tree_structure(files, base_dir):
     """Costruisce una struttura ad albero di cartelle e file"""
     tree = {}
     for f in files:
-        rel_path = f.relative_to(base_dir)
-        parts = rel_path.parts
+        parts = rel_key(f).split('/') if base_dir == MD_DIR else f.relative_to(base_dir).parts
         current = tree
         for i, part in enumerate(parts[:-1]):
             if part not in current:
@@ -33,88 +67,266 @@ def build_tree_structure(files, base_dir):
         current['__files__'].append(f)
     return tree
 
-def get_file_stats(file_path):
-    """Ottieni statistiche del file"""
-    stats = file_path.stat()
-    content = file_path.read_text(encoding='utf-8')
-    word_count = len(re.findall(r'\b\w+\b', content))
+# Regex precompilate: \w+ conta le stesse parole di \b\w+\b senza i controlli di confine
+WORD_RE = re.compile(r'\w+')
+FRONTMATTER_RE = re.compile(r'^---\s*\n(.*?)\n---\s*\n', re.DOTALL)
+FIELD_RE = re.compile(r'^([A-Za-z_][\w-]*)\s*:\s*(.*)$')
+NUMBER_RE = re.compile(r'-?\d+(\.\d+)?')
+ISO_DATE_RE = re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})')
+IT_DATE_RE = re.compile(r'(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})')   # formato di toLocaleDateString('it-IT')
+
+def frontmatter_value(raw, typed=True):
+    """Valore tipizzato di un campo: lista [a, b], numero, booleano, data (ISO) o testo.
+
+    Con typed=False il testo così com'è scritto (senza virgolette), per i
+    campi mostrati all'utente: `1.10` resta "1.10", `007` resta "007".
+    """
+    raw = raw.strip()
+    if raw.startswith('[') and raw.endswith(']'):
+        items = (frontmatter_value(item, typed) for item in raw[1:-1].split(','))
+        return [item for item in items if item not in (None, '')]
+    if len(raw) >= 2 and raw[0] == raw[-1] and raw[0] in '"\'':
+        return raw[1:-1]
+    if not raw:
+        return None
+    if not typed:
+        return raw
+    lowered = raw.lower()
+    if lowered in ('true', 'false'):
+        return lowered == 'true'
+    if NUMBER_RE.fullmatch(raw):
+        return float(raw) if '.' in raw else int(raw)
+    # Date normalizzate a YYYY-MM-DD: confronti e ordinamento come testo
+    match = ISO_DATE_RE.fullmatch(raw)
+    if match:
+        year, month, day = match.groups()
+    else:
+        match = IT_DATE_RE.fullmatch(raw)
+        if match:
+            day, month, year = match.groups()
+    if match:
+        try:
+            return datetime.date(int(year), int(month), int(day)).isoformat()
+        except ValueError:
+            pass
+    return raw
+
+def parse_frontmatter(fm, typed=True):
+    """Campi `chiave: valore` del frontmatter (chiavi in minuscolo), liste anche a righe `- voce`"""
+    fields = {}
+    key = None
+    for line in fm.splitlines():
+        stripped = line.strip()
+        if key and stripped.startswith('- '):
+            if not isinstance(fields[key], list):
+                fields[key] = []
+            value = frontmatter_value(stripped[2:], typed)
+            if value not in (None, ''):
+                fields[key].append(value)
+            continue
+        match = FIELD_RE.match(line)
+        if match:
+            key = match.group(1).lower()
+            fields[key] = frontmatter_value(match.group(2), typed)
+    return fields
+
+def parse_metadata(content, default_title):
+    """Estrae titolo, tag, campi del frontmatter e conteggio parole dal testo di un documento"""
+    word_count = len(WORD_RE.findall(content))
     
-    # Parse frontmatter
-    tags = []
-    title = file_path.stem
-    frontmatter_match = re.match(r'^---\s*\n(.*?)\n---\s*\n', content, re.DOTALL)
+    # Parse frontmatter: valori tipizzati per /api/query e ordinamenti,
+    # testo originale per titolo e tag mostrati
+    fields = {}
+    text = {}
+    frontmatter_match = FRONTMATTER_RE.match(content) if content.startswith('---') else None
     if frontmatter_match:
-        fm = frontmatter_match.group(1)
-        tags_match = re.search(r'tags:\s*\[(.*?)\]', fm)
-        if tags_match:
-            tags = [t.strip().strip('"\'') for t in tags_match.group(1).split(',')]
-        title_match = re.search(r'title:\s*(.+)', fm)
-        if title_match:
-            title = title_match.group(1).strip().strip('"\'')
+        fields = parse_frontmatter(frontmatter_match.group(1))
+        text = parse_frontmatter(frontmatter_match.group(1), typed=False)
+    tags = text.get('tags') or []
+    if not isinstance(tags, list):
+        tags = [tags]
+    title = text.get('title')
+    if isinstance(title, list):
+        title = ', '.join(title)
     
     return {
-        'modified': stats.st_mtime,
-        'size': stats.st_size,
         'word_count': word_count,
         'read_time': max(1, word_count // 200),  # ~200 parole/minuto
         'tags': tags,
-        'title': title
+        'title': title or default_title,
+        'fields': fields
     }
 
-def render_tree_html(tree, base_path='', level=0):
-    """Renderizza l'albero come HTML con cartelle espandibili"""
+def scan_document(file_path, stats=None):
+    """Legge il file una sola volta e produce il record usato da tutte le fasi
+    (viewer, albero, tag cloud, preview): testo, titolo, tag, parole, lettura, mtime, dimensione"""
+    if stats is None:
+        stats = file_path.stat()
+    text = file_path.read_text(encoding='utf-8')
+    return {
+        'text': text,
+        'modified': stats.st_mtime,
+        'size': stats.st_size,
+        **parse_metadata(text, file_path.stem)
+    }
+
+def document_meta(doc):
+    """Record senza testo: è ciò che finisce nel manifest e serve a preview.html"""
+    return {k: v for k, v in doc.items() if k != 'text'}
+
+@functools.lru_cache(maxsize=65536)
+def rel_key(file_path):
+    """Percorso relativo a md/ in formato posix (chiave del manifest)"""
+    return file_path.relative_to(MD_DIR).as_posix()
+
+@functools.lru_cache(maxsize=65536)
+def file_item_html(rel, name, indent, word_count, read_time, modified, tags):
+    """Voce di un file nell'albero di preview.html (in cache finché i metadati non cambiano)"""
+    viewer_name = rel[:-len(Path(rel).suffix)] + '.html'
+    # Crea attributi data per info aggiuntive
+    data_attrs = f'data-words="{word_count}" data-readtime="{read_time}" data-modified="{modified}"'
+    html_parts = [
+        f'{indent}<a class="file-item" href="{viewer_name}" {data_attrs}>',
+        f'{indent}  <span class="file-icon">📄</span>',
+        f'{indent}  <span class="file-name">{html.escape(name)}</span>',
+        f'{indent}  <span class="file-meta">{word_count} parole • {read_time} min</span>'
+    ]
+    if tags:
+        tags_html = ' '.join([f'<span class="tag">{html.escape(t)}</span>' for t in tags])
+        html_parts.append(f'{indent}  <span class="file-tags">{tags_html}</span>')
+    html_parts.append(f'{indent}</a>')
+    return '\n'.join(html_parts)
+
+def count_tree_files(tree):
+    """File .md di una cartella dell'albero, sottocartelle incluse"""
+    return len(tree.get('__files__', ())) + sum(count_tree_files(sub) for name, sub in tree.items()
+                                                 if name != '__files__')
+
+def tree_fragment_name(folder_rel):
+    """Percorso (relativo a web/) del frammento con il contenuto di una cartella"""
+    return f'{TREE_DIR.name}/{content_hash(folder_rel)[:12]}.html'
+
+def render_tree_html(tree, metas, base_path='', level=0, fragments=None):
+    """Renderizza l'albero come HTML con cartelle espandibili.
+
+    Con fragments (dict) le sottocartelle restano vuote: il loro contenuto
+    finisce in fragments[percorso cartella] e preview.js lo carica all'apertura.
+    """
     html_parts = []
     indent = '  ' * level
     
     # Prima renderizziamo le cartelle
     folders = sorted([k for k in tree.keys() if k != '__files__'])
     for folder in folders:
-        folder_id = f"folder-{hash(base_path + folder) % 100000}"
+        folder_rel = base_path + folder
+        # crc32 invece di hash(): deve essere stabile tra processi per non cambiare preview.html
+        folder_id = f"folder-{zlib.crc32(folder_rel.encode('utf-8')) % 100000}"
         html_parts.append(f'{indent}<div class="folder-item">')
         html_parts.append(f'{indent}  <div class="folder-header" onclick="toggleFolder(\'{folder_id}\')">')
         html_parts.append(f'{indent}    <span class="folder-icon">📁</span>')
         html_parts.append(f'{indent}    <span class="folder-name">{html.escape(folder)}</span>')
-        html_parts.append(f'{indent}  </div>')
-        html_parts.append(f'{indent}  <div class="folder-content" id="{folder_id}">')
-        sub_html = render_tree_html(tree[folder], base_path + folder + '/', level + 1)
-        html_parts.append(sub_html)
+        if fragments is None:
+            html_parts.append(f'{indent}  </div>')
+            html_parts.append(f'{indent}  <div class="folder-content" id="{folder_id}">')
+            html_parts.append(render_tree_html(tree[folder], metas, folder_rel + '/', level + 1))
+        else:
+            html_parts.append(f'{indent}    <span class="folder-files">{count_tree_files(tree[folder])}</span>')
+            html_parts.append(f'{indent}  </div>')
+            src = tree_fragment_name(folder_rel)
+            html_parts.append(f'{indent}  <div class="folder-content" id="{folder_id}" data-src="{src}">')
+            fragments[folder_rel] = render_tree_html(tree[folder], metas, folder_rel + '/', 0, fragments)
         html_parts.append(f'{indent}  </div>')
         html_parts.append(f'{indent}</div>')
     
     # Poi renderizziamo i file nella cartella corrente
     if '__files__' in tree:
         for f in sorted(tree['__files__'], key=lambda x: x.name):
-            rel_path = f.relative_to(MD_DIR)
-            viewer_name = str(rel_path.with_suffix('.html')).replace('\\', '/')
-            stats = get_file_stats(f)
-            
-            # Crea attributi data per info aggiuntive
-            data_attrs = f'data-words="{stats["word_count"]}" data-readtime="{stats["read_time"]}" data-modified="{stats["modified"]}"'
-            
-            html_parts.append(f'{indent}<a class="file-item" href="{viewer_name}" {data_attrs}>')
-            html_parts.append(f'{indent}  <span class="file-icon">📄</span>')
-            html_parts.append(f'{indent}  <span class="file-name">{html.escape(f.name)}</span>')
-            html_parts.append(f'{indent}  <span class="file-meta">{stats["word_count"]} parole • {stats["read_time"]} min</span>')
-            if stats['tags']:
-                tags_html = ' '.join([f'<span class="tag">{html.escape(t)}</span>' for t in stats['tags'][:3]])
-                html_parts.append(f'{indent}  <span class="file-tags">{tags_html}</span>')
-            html_parts.append(f'{indent}</a>')
+            rel = rel_key(f)
+            stats = metas[rel]
+            html_parts.append(file_item_html(rel, f.name, indent, stats['word_count'], stats['read_time'],
+                                             stats['modified'], tuple(stats['tags'][:3])))
     
     return '\n'.join(html_parts)
 
-tree = build_tree_structure(md_files, MD_DIR)
-
-# Genera viewer per ogni file
-for md in md_files:
-    text = md.read_text(encoding='utf-8')
-    text_escaped = text.replace('</script>', r'<\/script>')
+def write_tree_fragments(fragments):
+    """Scrive in web/_tree/ i frammenti cambiati e rimuove quelli di cartelle sparite.
+
+    Ritorna i byte scritti (copie compresse incluse).
+    """
+    TREE_DIR.mkdir(exist_ok=True)
+    current = set()
+    written = 0
+    for folder_rel, fragment_html in fragments.items():
+        path = WEB_DIR / tree_fragment_name(folder_rel)
+        current.add(path.name)
+        size = write_if_changed(path, fragment_html)
+        if size or not has_siblings(path):
+            written += size + write_siblings(path, fragment_html)
+    for path in TREE_DIR.iterdir():
+        name = path.name.rsplit('.', 1)[0] if is_sibling_name(path.name) else path.name
+        if path.is_file() and name not in current:
+            path.unlink()
+    return written
+
+@functools.lru_cache(maxsize=None)
+def asset_bundle():
+    """Asset condivisi: nome logico -> (percorso relativo a web/, contenuto).
+
+    Il nome pubblicato contiene l'hash del contenuto, quindi il file non cambia
+    mai e il browser può tenerlo in cache senza rivalidarlo.
+    """
+    sources = {name: (ASSETS_SRC / name).read_bytes() for name in ASSET_SOURCES}
+    sources['code-themes.css'] = code_themes_css().encode('utf-8')
+    bundle = {}
+    for name, data in sources.items():
+        stem, ext = os.path.splitext(name)
+        bundle[name] = (f'assets/{stem}.{content_hash(data)[:10]}{ext}', data)
+    return bundle
+
+def asset_urls():
+    """Nome logico -> percorso fingerprintato, da usare nei template"""
+    return {name: url for name, (url, _) in asset_bundle().items()}
+
+def publish_assets():
+    """Scrive in web/assets/ gli asset mancanti e rimuove le versioni superate.
+
+    Ritorna il numero di file scritti.
+    """
+    ASSETS_DIR.mkdir(exist_ok=True)
+    current = set()
+    written = 0
+    for url, data in asset_bundle().values():
+        path = WEB_DIR / url
+        current.add(path.name)
+        if not path.exists():
+            atomic_write(path, data)
+            print(f'Generato asset: {url}')
+            written += 1
+        if not has_siblings(path):
+            write_siblings(path, data, brotli_quality=BROTLI_QUALITY_ASSETS)
+    for path in ASSETS_DIR.iterdir():
+        name = path.name
+        # Le copie .gz/.br seguono il file da cui derivano
+        if is_sibling_name(name):
+            name = name.rsplit('.', 1)[0]
+        if path.is_file() and name not in current:
+            path.unlink()
+            print(f'Rimosso asset superato: assets/{path.name}')
+    return written
+
+def format_modified(timestamp):
+    """Data di modifica come mostrata nei viewer"""
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%d/%m/%Y %H:%M')
+
+def render_viewer(md, doc):
+    """Genera l'HTML del viewer a partire dal record del documento.
+
+    CSS e JS stanno negli asset condivisi: il viewer contiene solo contenuto e metadati.
+    """
+    assets = asset_urls()
+    text_escaped = doc['text'].replace('</script>', r'<\/script>')
     
     rel_path = md.relative_to(MD_DIR)
-    viewer_rel_path = rel_path.with_suffix('.html')
-    viewer_path = WEB_DIR / viewer_rel_path
-    viewer_path.parent.mkdir(parents=True, exist_ok=True)
-    
-    stats = get_file_stats(md)
     
     # Calcola percorso relativo per tornare alla root
     depth = len(rel_path.parts) - 1
@@ -129,71 +341,34 @@ for md in md_files:
     breadcrumb_parts.append(f'<span class="breadcrumb-sep">/</span><span class="breadcrumb-file">{html.escape(md.name)}</span>')
     breadcrumb_html = ''.join(breadcrumb_parts)
     
-    modified_date = datetime.datetime.fromtimestamp(stats['modified']).strftime('%d/%m/%Y %H:%M')
+    modified_date = format_modified(doc['modified'])
+
+    # Rendering lato server se disponibile, altrimenti marked + highlight.js nel browser
+    rendered = render_markdown(doc['text'])
+    if rendered:
+        content_html = rendered['html']
+        toc_html = render_toc_html(rendered['toc'])
+        code_css = f'<link rel="stylesheet" href="{back_to_root}{assets["code-themes.css"]}">'
+        client_scripts = ''
+    else:
+        content_html = 'Caricamento…'
+        toc_html = ''
+        code_css = '<link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.8.0/styles/atom-one-dark.min.css" id="hljs-theme">'
+        client_scripts = f"""<script id="md-content" type="text/plain">{text_escaped}</script>
+  <script src="https://cdnjs.cloudflare.com/ajax/libs/marked/5.1.1/marked.min.js"></script>
+  <script src="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.8.0/highlight.min.js"></script>"""
     
     viewer_html = f"""<!doctype html>
-<html lang="it" data-theme="dark">
+<html lang="it" data-theme="dark" data-code-theme="{DEFAULT_CODE_THEME}">
 <head>
   <meta charset="utf-8">
   <meta name="viewport" content="width=device-width,initial-scale=1">
   <link rel="icon" href="data:image/svg+xml,<svg xmlns=%22http://www.w3.org/2000/svg%22 viewBox=%220 0 100 100%22><text y=%22.9em%22 font-size=%2290%22>📚</text></svg>">
-  <title>{html.escape(stats['title'])}</title>
-  <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.8.0/styles/atom-one-dark.min.css" id="hljs-theme">
-  <style>
-    :root[data-theme="dark"]{{--bg:#0b0f12;--panel:#0f1720;--text:#e6eef6;--muted:#98a0ac;--accent:#4cc9f0;--border:rgba(255,255,255,0.07);--hover:rgba(255,255,255,0.05)}}
-    :root[data-theme="light"]{{--bg:#f5f7fa;--panel:#ffffff;--text:#1a202c;--muted:#718096;--accent:#0066cc;--border:rgba(0,0,0,0.1);--hover:rgba(0,0,0,0.03)}}
-    *{{box-sizing:border-box}}
-    body{{background:var(--bg);color:var(--text);font-family:Inter,Segoe UI,Roboto,Arial,sans-serif;margin:0;padding:0;transition:background 0.2s,color 0.2s}}
-    .top-bar{{background:var(--panel);border-bottom:1px solid var(--border);padding:12px 24px;position:sticky;top:0;z-index:100;display:flex;align-items:center;justify-content:space-between;gap:12px}}
-    .breadcrumb{{font-size:13px;color:var(--muted)}}
-    .breadcrumb a{{color:var(--accent);text-decoration:none}}
-    .breadcrumb a:hover{{text-decoration:underline}}
-    .breadcrumb-sep{{margin:0 6px;opacity:0.5}}
-    .breadcrumb-file{{color:var(--text);font-weight:500}}
-    .top-actions{{display:flex;gap:8px;align-items:center}}
-    .btn{{background:transparent;border:1px solid var(--border);color:var(--text);padding:6px 12px;border-radius:6px;cursor:pointer;font-size:13px;text-decoration:none;display:inline-flex;align-items:center;gap:6px;transition:background 0.15s}}
-    .btn:hover{{background:var(--hover)}}
-    .theme-toggle{{background:var(--panel);border:1px solid var(--border);border-radius:6px;padding:4px;display:flex;gap:4px}}
-    .theme-toggle button{{background:transparent;border:none;padding:4px 8px;border-radius:4px;cursor:pointer;font-size:12px;color:var(--muted);transition:all 0.15s}}
-    .theme-toggle button.active{{background:var(--accent);color:white}}
-    .wrap{{max-width:1200px;margin:0 auto;padding:24px;display:grid;grid-template-columns:200px 1fr;gap:24px}}
-    .sidebar{{position:sticky;top:80px;height:fit-content;max-height:calc(100vh - 120px);overflow-y:auto}}
-    .toc{{background:var(--panel);padding:16px;border-radius:12px;border:1px solid var(--border)}}
-    .toc h3{{margin:0 0 12px 0;font-size:13px;text-transform:uppercase;letter-spacing:0.5px;color:var(--muted)}}
-    .toc ul{{list-style:none;padding:0;margin:0}}
-    .toc li{{margin:4px 0}}
-    .toc a{{color:var(--text);text-decoration:none;font-size:13px;display:block;padding:4px 8px;border-radius:4px;transition:background 0.15s}}
-    .toc a:hover{{background:var(--hover)}}
-    .toc li.level-2{{padding-left:12px}}
-    .toc li.level-3{{padding-left:24px}}
-    .main-content{{min-width:0}}
-    .file-meta-box{{background:var(--panel);padding:16px;border-radius:12px;margin-bottom:20px;border:1px solid var(--border);display:flex;flex-wrap:wrap;gap:16px;font-size:13px}}
-    .meta-item{{display:flex;align-items:center;gap:6px;color:var(--muted)}}
-    .meta-item strong{{color:var(--text)}}
-    main{{background:var(--panel);padding:32px;border-radius:12px;border:1px solid var(--border);box-shadow:0 4px 12px rgba(0,0,0,0.1)}}
-    main h1,main h2,main h3,main h4,main h5,main h6{{color:var(--text);margin-top:24px;margin-bottom:12px}}
-    main h1{{font-size:32px;border-bottom:2px solid var(--border);padding-bottom:12px}}
-    main h2{{font-size:24px}}
-    main h3{{font-size:20px}}
-    main p,main li{{line-height:1.7;color:var(--text)}}
-    main ul,main ol{{margin-left:1.5em}}
-    main pre{{background:var(--bg);border:1px solid var(--border);border-radius:8px;padding:16px;overflow-x:auto}}
-    main code{{background:var(--bg);padding:2px 6px;border-radius:4px;font-size:0.9em;border:1px solid var(--border)}}
-    main pre code{{background:transparent;padding:0;border:none}}
-    main table{{border-collapse:collapse;width:100%;margin:16px 0}}
-    main th,main td{{border:1px solid var(--border);padding:8px 12px;text-align:left}}
-    main th{{background:var(--bg);font-weight:600}}
-    main blockquote{{border-left:4px solid var(--accent);padding-left:16px;margin:16px 0;color:var(--muted);font-style:italic}}
-    main a{{color:var(--accent);text-decoration:none}}
-    main a:hover{{text-decoration:underline}}
-    main img{{max-width:100%;height:auto;border-radius:8px;margin:16px 0}}
-    footer{{text-align:center;color:var(--muted);margin-top:32px;font-size:13px;padding:24px}}
-    .tag{{background:var(--accent);color:white;padding:2px 8px;border-radius:12px;font-size:11px;display:inline-block}}
-    @media print{{.top-bar,.sidebar,.top-actions{{display:none}}.wrap{{grid-template-columns:1fr}}}}
-    @media (max-width:900px){{.wrap{{grid-template-columns:1fr}}.sidebar{{display:none}}}}
-  </style>
+  <title>{html.escape(doc['title'])}</title>
+  {code_css}
+  <link rel="stylesheet" href="{back_to_root}{assets['viewer.css']}">
 </head>
-<body>
+<body data-path="{html.escape(rel_path.as_posix())}" data-name="{html.escape(md.name)}">
   <div class="top-bar">
     <div class="breadcrumb">{breadcrumb_html}</div>
     <div class="top-actions">
@@ -218,19 +393,19 @@ for md in md_files:
     <aside class="sidebar">
       <div class="toc">
         <h3>Contenuti</h3>
-        <ul id="toc-list"></ul>
+        <ul id="toc-list">{toc_html}</ul>
       </div>
     </aside>
 
     <div class="main-content">
       <div class="file-meta-box">
         <div class="meta-item">📅 Modificato: <strong>{modified_date}</strong></div>
-        <div class="meta-item">📝 Parole: <strong>{stats['word_count']}</strong></div>
-        <div class="meta-item">⏱️ Lettura: <strong>{stats['read_time']} min</strong></div>
-        <div class="meta-item">💾 Dimensione: <strong>{stats['size']} bytes</strong></div>
+        <div class="meta-item">📝 Parole: <strong>{doc['word_count']}</strong></div>
+        <div class="meta-item">⏱️ Lettura: <strong>{doc['read_time']} min</strong></div>
+        <div class="meta-item">💾 Dimensione: <strong>{doc['size']} bytes</strong></div>
       </div>
       
-      <main id="content">Caricamento…</main>
+      <main id="content">{content_html}</main>
     </div>
   </div>
 
@@ -238,198 +413,43 @@ for md in md_files:
     File sorgente: <code>{html.escape(str(rel_path))}</code>
   </footer>
 
-  <script id="md-content" type="text/plain">{text_escaped}</script>
-  <script src="https://cdnjs.cloudflare.com/ajax/libs/marked/5.1.1/marked.min.js"></script>
-  <script src="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.8.0/highlight.min.js"></script>
-  <script>
-    // Gestione tema
-    function setTheme(theme) {{
-      document.documentElement.setAttribute('data-theme', theme);
-      localStorage.setItem('theme', theme);
-      document.querySelectorAll('.theme-toggle button').forEach(b => {{
-        b.classList.toggle('active', b.dataset.theme === theme);
-      }});
-    }}
-    const savedTheme = localStorage.getItem('theme') || 'dark';
-    setTheme(savedTheme);
-
-    // Gestione code theme
-    function changeCodeTheme(theme) {{
-      const link = document.getElementById('hljs-theme');
-      link.href = `https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.8.0/styles/${{theme}}.min.css`;
-      localStorage.setItem('codeTheme', theme);
-    }}
-    const savedCodeTheme = localStorage.getItem('codeTheme') || 'atom-one-dark';
-    document.getElementById('hljs-selector').value = savedCodeTheme;
-    changeCodeTheme(savedCodeTheme);
-
-    // Render markdown
-    const md = document.getElementById('md-content').textContent;
-    const content = document.getElementById('content');
-    marked.setOptions({{ headerIds: true, mangle: false }});
-    content.innerHTML = marked.parse(md);
-    document.querySelectorAll('pre code').forEach(el => hljs.highlightElement(el));
-
-    // Genera TOC
-    const headers = content.querySelectorAll('h1, h2, h3');
-    const tocList = document.getElementById('toc-list');
-    headers.forEach(h => {{
-      const li = document.createElement('li');
-      li.className = 'level-' + h.tagName.substring(1);
-      const a = document.createElement('a');
-      a.textContent = h.textContent;
-      a.href = '#' + h.id;
-      a.onclick = (e) => {{
-        e.preventDefault();
-        h.scrollIntoView({{ behavior: 'smooth', block: 'start' }});
-      }};
-      li.appendChild(a);
-      tocList.appendChild(li);
-    }});
-
-    // Favoriti
-    function toggleFavorite() {{
-      const path = '{str(rel_path).replace(chr(92), '/')}';
-      let favs = JSON.parse(localStorage.getItem('favorites') || '[]');
-      const index = favs.indexOf(path);
-      if (index > -1) {{
-        favs.splice(index, 1);
-        document.getElementById('fav-btn').textContent = '⭐';
-      }} else {{
-        favs.push(path);
-        document.getElementById('fav-btn').textContent = '⭐✨';
-      }}
-      localStorage.setItem('favorites', JSON.stringify(favs));
-    }}
-    const path = '{str(rel_path).replace(chr(92), '/')}';
-    const favs = JSON.parse(localStorage.getItem('favorites') || '[]');
-    if (favs.includes(path)) {{
-      document.getElementById('fav-btn').textContent = '⭐✨';
-    }}
-
-    // Export PDF
-    function exportPDF() {{
-      window.print();
-    }}
-
-    // Recent files
-    let recent = JSON.parse(localStorage.getItem('recentFiles') || '[]');
-    recent = recent.filter(r => r !== path);
-    recent.unshift(path);
-    recent = recent.slice(0, 20);
-    localStorage.setItem('recentFiles', JSON.stringify(recent));
-
-    // Auto-reload
-    let lastCheck = Date.now();
-    setInterval(() => {{
-      fetch(location.href, {{method: 'HEAD', cache: 'no-cache'}})
-        .then(res => {{
-          const lastMod = res.headers.get('last-modified');
-          if (lastMod && new Date(lastMod).getTime() > lastCheck) {{
-            if (Notification.permission === 'granted') {{
-              new Notification('File aggiornato', {{body: '{html.escape(md.name)}'}});
-            }}
-            location.reload();
-          }}
-        }}).catch(() => {{}});
-    }}, 2000);
-
-    // Chiedi permesso notifiche
-    if (Notification.permission === 'default') {{
-      Notification.requestPermission();
-    }}
-  </script>
+  {client_scripts}
+  <script src="{back_to_root}{assets['viewer.js']}"></script>
 </body>
 </html>"""
 
-    viewer_path.write_text(viewer_html, encoding='utf-8')
-    print(f'Generato viewer: {viewer_rel_path}')
+    return viewer_html
 
-# Genera preview.html avanzato
-if md_files:
-    links_html = render_tree_html(tree)
-else:
-    links_html = '<div class="empty">Nessun file .md trovato</div>'
+def render_preview(md_files, metas):
+    """Genera preview.html a partire dai metadati dei file.
 
-# Colleziona tutti i tag
-all_tags = {}
-for md in md_files:
-    stats = get_file_stats(md)
-    for tag in stats['tags']:
-        all_tags[tag] = all_tags.get(tag, 0) + 1
+    Ritorna (HTML della pagina, frammenti delle cartelle per write_tree_fragments).
+    """
+    assets = asset_urls()
+    fragments = {}
+    if md_files:
+        tree = build_tree_structure(md_files, MD_DIR)
+        links_html = render_tree_html(tree, metas, fragments=fragments)
+    else:
+        links_html = '<div class="empty">Nessun file .md trovato</div>'
 
-tags_cloud = ' '.join([f'<span class="tag-cloud-item" data-count="{count}">{html.escape(tag)}</span>' 
-                        for tag, count in sorted(all_tags.items(), key=lambda x: x[1], reverse=True)[:20]])
+    # Colleziona tutti i tag
+    all_tags = {}
+    for md in md_files:
+        for tag in metas[rel_key(md)]['tags']:
+            all_tags[tag] = all_tags.get(tag, 0) + 1
 
-preview_html = f"""<!doctype html>
+    tags_cloud = ' '.join([f'<span class="tag-cloud-item" data-count="{count}">{html.escape(tag)}</span>' 
+                            for tag, count in sorted(all_tags.items(), key=lambda x: x[1], reverse=True)[:20]])
+
+    preview_html = f"""<!doctype html>
 <html lang="it" data-theme="dark">
 <head>
   <meta charset="utf-8">
   <meta name="viewport" content="width=device-width,initial-scale=1">
   <link rel="icon" href="data:image/svg+xml,<svg xmlns=%22http://www.w3.org/2000/svg%22 viewBox=%220 0 100 100%22><text y=%22.9em%22 font-size=%2290%22>📚</text></svg>">
   <title>Documenti Markdown - AppuntiApp</title>
-  <style>
-    :root[data-theme="dark"]{{--bg:#0b0f12;--panel:#0f1720;--text:#e6eef6;--muted:#98a0ac;--accent:#4cc9f0;--border:rgba(255,255,255,0.07);--hover:rgba(255,255,255,0.05)}}
-    :root[data-theme="light"]{{--bg:#f5f7fa;--panel:#ffffff;--text:#1a202c;--muted:#718096;--accent:#0066cc;--border:rgba(0,0,0,0.1);--hover:rgba(0,0,0,0.03)}}
-    *{{box-sizing:border-box}}
-    body{{background:var(--bg);color:var(--text);font-family:Inter,Segoe UI,Roboto,Arial,sans-serif;margin:0;padding:28px;transition:background 0.2s,color 0.2s}}
-    .wrap{{max-width:1200px;margin:0 auto}}
-    header{{display:flex;align-items:center;justify-content:space-between;gap:12px;flex-wrap:wrap}}
-    h1{{font-size:28px;margin:0}}
-    .meta{{color:var(--muted);font-size:13px}}
-    .header-actions{{display:flex;gap:8px;align-items:center}}
-    .btn{{background:transparent;border:1px solid var(--border);color:var(--text);padding:8px 14px;border-radius:8px;cursor:pointer;font-size:13px;text-decoration:none;transition:background 0.15s}}
-    .btn:hover{{background:var(--hover)}}
-    .theme-toggle{{background:var(--panel);border:1px solid var(--border);border-radius:6px;padding:4px;display:flex;gap:4px}}
-    .theme-toggle button{{background:transparent;border:none;padding:4px 8px;border-radius:4px;cursor:pointer;font-size:12px;color:var(--muted);transition:all 0.15s}}
-    .theme-toggle button.active{{background:var(--accent);color:white}}
-    .search-box{{margin-top:20px;background:var(--panel);padding:16px;border-radius:12px;border:1px solid var(--border)}}
-    .search-input{{width:100%;padding:12px;background:var(--bg);border:1px solid var(--border);border-radius:8px;color:var(--text);font-size:14px}}
-    .search-input:focus{{outline:none;border-color:var(--accent)}}
-    .filters{{display:flex;gap:8px;margin-top:12px;flex-wrap:wrap}}
-    .filter-btn{{padding:6px 12px;background:var(--bg);border:1px solid var(--border);border-radius:6px;cursor:pointer;font-size:12px;color:var(--text);transition:all 0.15s}}
-    .filter-btn:hover{{background:var(--hover)}}
-    .filter-btn.active{{background:var(--accent);color:white;border-color:var(--accent)}}
-    .tags-cloud{{margin-top:12px;display:flex;flex-wrap:wrap;gap:8px}}
-    .tag-cloud-item{{padding:4px 10px;background:var(--panel);border:1px solid var(--border);border-radius:12px;font-size:11px;cursor:pointer;transition:all 0.15s}}
-    .tag-cloud-item:hover{{background:var(--accent);color:white}}
-    main{{margin-top:20px;display:grid;grid-template-columns:340px 1fr;gap:20px}}
-    .panel{{background:var(--panel);padding:20px;border-radius:12px;border:1px solid var(--border)}}
-    .list{{overflow-y:auto;max-height:calc(100vh - 300px)}}
-    .list h3{{margin:0 0 16px 0;color:var(--accent);font-size:16px}}
-    .folder-item{{margin-bottom:4px}}
-    .folder-header{{display:flex;align-items:center;gap:8px;padding:8px 10px;cursor:pointer;border-radius:8px;transition:background 0.15s;font-weight:500}}
-    .folder-header:hover{{background:var(--hover)}}
-    .folder-icon{{font-size:16px}}
-    .folder-name{{font-size:14px}}
-    .folder-content{{margin-left:20px;display:none;margin-top:6px}}
-    .folder-content.open{{display:block}}
-    .file-item{{display:flex;flex-direction:column;gap:4px;color:var(--text);text-decoration:none;padding:10px;border-radius:8px;margin-bottom:4px;border:1px solid var(--border);transition:all 0.15s;position:relative}}
-    .file-item:hover{{background:var(--hover);border-color:var(--accent);transform:translateX(4px)}}
-    .file-item-header{{display:flex;align-items:center;gap:8px}}
-    .file-icon{{font-size:16px}}
-    .file-name{{font-size:13px;font-weight:500;flex:1}}
-    .file-meta{{font-size:11px;color:var(--muted);margin-top:2px}}
-    .file-tags{{display:flex;gap:4px;margin-top:6px;flex-wrap:wrap}}
-    .tag{{background:var(--accent);color:white;padding:2px 8px;border-radius:10px;font-size:10px}}
-    .side-panel h3{{margin:0 0 16px 0;color:var(--accent);font-size:16px}}
-    .tabs{{display:flex;gap:4px;margin-bottom:16px;border-bottom:1px solid var(--border)}}
-    .tab{{padding:10px 16px;cursor:pointer;border-bottom:2px solid transparent;transition:all 0.15s;font-size:13px}}
-    .tab:hover{{color:var(--accent)}}
-    .tab.active{{border-bottom-color:var(--accent);color:var(--accent);font-weight:500}}
-    .tab-content{{display:none}}
-    .tab-content.active{{display:block}}
-    .recent-item,.fav-item{{display:flex;align-items:center;gap:8px;padding:8px;border-radius:6px;margin-bottom:4px;border:1px solid var(--border);font-size:13px;color:var(--text);text-decoration:none;transition:background 0.15s}}
-    .recent-item:hover,.fav-item:hover{{background:var(--hover)}}
-    .stats-grid{{display:grid;grid-template-columns:repeat(2,1fr);gap:12px;margin-bottom:16px}}
-    .stat-box{{background:var(--bg);padding:12px;border-radius:8px;border:1px solid var(--border)}}
-    .stat-label{{font-size:11px;color:var(--muted);text-transform:uppercase;letter-spacing:0.5px}}
-    .stat-value{{font-size:20px;font-weight:600;color:var(--text);margin-top:4px}}
-    footer{{text-align:center;color:var(--muted);margin-top:32px;font-size:13px}}
-    .empty{{color:var(--muted);font-size:14px;text-align:center;padding:40px}}
-    .no-results{{display:none;text-align:center;padding:40px;color:var(--muted)}}
-    @media (max-width:900px){{main{{grid-template-columns:1fr}}.side-panel{{order:-1}}}}
-  </style>
+  <link rel="stylesheet" href="{assets['preview.css']}">
 </head>
 <body>
   <div class="wrap">
@@ -490,7 +510,7 @@ preview_html = f"""<!doctype html>
             </div>
             <div class="stat-box">
               <div class="stat-label">Cartelle</div>
-              <div class="stat-value" id="folder-count">-</div>
+              <div class="stat-value" id="folder-count">{len(fragments)}</div>
             </div>
           </div>
           <a href="stats.html" class="btn" style="display:block;text-align:center">Vedi tutte le statistiche →</a>
@@ -507,157 +527,427 @@ preview_html = f"""<!doctype html>
     </footer>
   </div>
 
-  <script>
-    // Gestione tema
-    function setTheme(theme) {{
-      document.documentElement.setAttribute('data-theme', theme);
-      localStorage.setItem('theme', theme);
-      document.querySelectorAll('.theme-toggle button').forEach(b => {{
-        b.classList.toggle('active', b.dataset.theme === theme);
-      }});
-    }}
-    const savedTheme = localStorage.getItem('theme') || 'dark';
-    setTheme(savedTheme);
-
-    // Keyboard shortcuts
-    document.addEventListener('keydown', e => {{
-      if (e.key === '/' && e.target.tagName !== 'INPUT') {{
-        e.preventDefault();
-        document.getElementById('search-input').focus();
-      }}
-      if (e.key === 'Escape') {{
-        document.getElementById('search-input').blur();
-        document.getElementById('search-input').value = '';
-        filterFiles('');
-      }}
-      if (e.key === 'n' && e.ctrlKey) {{
-        e.preventDefault();
-        window.location.href = 'editor.html';
-      }}
-    }});
-
-    // Ricerca
-    const searchInput = document.getElementById('search-input');
-    let searchTimeout;
-    searchInput.addEventListener('input', e => {{
-      clearTimeout(searchTimeout);
-      searchTimeout = setTimeout(() => filterFiles(e.target.value), 300);
-    }});
-
-    function filterFiles(query) {{
-      query = query.toLowerCase();
-      const items = document.querySelectorAll('.file-item');
-      let visibleCount = 0;
-      
-      items.forEach(item => {{
-        const text = item.textContent.toLowerCase();
-        const match = text.includes(query);
-        item.style.display = match ? '' : 'none';
-        if (match) visibleCount++;
-      }});
-
-      document.getElementById('no-results').style.display = visibleCount === 0 ? 'block' : 'none';
-      document.getElementById('file-list').style.display = visibleCount === 0 ? 'none' : 'block';
-    }}
-
-    // Tag cloud
-    document.querySelectorAll('.tag-cloud-item').forEach(tag => {{
-      tag.addEventListener('click', () => {{
-        searchInput.value = tag.textContent;
-        filterFiles(tag.textContent);
-      }});
-    }});
-
-    // Folders toggle
-    function toggleFolder(id) {{
-      const folder = document.getElementById(id);
-      if (folder) folder.classList.toggle('open');
-    }}
-
-    // Espandi tutte le cartelle all'avvio
-    document.querySelectorAll('.folder-content').forEach(f => f.classList.add('open'));
-
-    // Ordinamento
-    function sortBy(type) {{
-      document.querySelectorAll('.filter-btn').forEach(b => b.classList.remove('active'));
-      event.target.classList.add('active');
-      
-      const items = Array.from(document.querySelectorAll('.file-item'));
-      items.sort((a, b) => {{
-        if (type === 'name') return a.querySelector('.file-name').textContent.localeCompare(b.querySelector('.file-name').textContent);
-        if (type === 'date') return parseFloat(b.dataset.modified) - parseFloat(a.dataset.modified);
-        if (type === 'words') return parseInt(b.dataset.words) - parseInt(a.dataset.words);
-        return 0;
-      }});
-      
-      // Riattacca al DOM (semplificato - in produzione serve logica più complessa per cartelle)
-      // Per ora lasciamo l'ordinamento base
-    }}
-
-    function showAll() {{
-      searchInput.value = '';
-      filterFiles('');
-      document.querySelectorAll('.filter-btn').forEach(b => b.classList.remove('active'));
-      event.target.classList.add('active');
-    }}
-
-    // Tabs
-    function switchTab(tab) {{
-      document.querySelectorAll('.tab').forEach(t => t.classList.remove('active'));
-      document.querySelectorAll('.tab-content').forEach(t => t.classList.remove('active'));
-      event.target.classList.add('active');
-      document.getElementById(tab + '-tab').classList.add('active');
-    }}
-
-    // Recenti e Preferiti
-    function loadRecents() {{
-      const recent = JSON.parse(localStorage.getItem('recentFiles') || '[]');
-      const container = document.getElementById('recent-list');
-      if (recent.length === 0) {{
-        container.innerHTML = '<div class="empty">Nessun file recente</div>';
-        return;
-      }}
-      container.innerHTML = recent.slice(0, 10).map(path => 
-        `<a href="${{path.replace(/\\.md$/, '.html')}}" class="recent-item">
-          <span>📄</span>
-          <span>${{path.split('/').pop()}}</span>
-        </a>`
-      ).join('');
-    }}
-
-    function loadFavorites() {{
-      const favs = JSON.parse(localStorage.getItem('favorites') || '[]');
-      const container = document.getElementById('fav-list');
-      if (favs.length === 0) {{
-        container.innerHTML = '<div class="empty">Nessun preferito</div>';
-        return;
-      }}
-      container.innerHTML = favs.map(path => 
-        `<a href="${{path.replace(/\\.md$/, '.html')}}" class="fav-item">
-          <span>⭐</span>
-          <span>${{path.split('/').pop()}}</span>
-        </a>`
-      ).join('');
-    }}
-
-    loadRecents();
-    loadFavorites();
-
-    // Conta cartelle
-    const folderCount = document.querySelectorAll('.folder-item').length;
-    document.getElementById('folder-count').textContent = folderCount;
-
-    // Check server live
-    fetch('/api/files')
-      .then(() => {{
-        document.getElementById('live-indicator').innerHTML = '🟢 Live';
-      }})
-      .catch(() => {{}});
-  </script>
+  <script src="{assets['preview.js']}"></script>
 </body>
 </html>"""
 
-preview_path = WEB_DIR / 'preview.html'
-preview_path.write_text(preview_html, encoding='utf-8')
-print('Generato indice avanzato: preview.html')
-print('Operazione completata.')
+    return preview_html, fragments
+
+# Ultimo manifest letto o scritto da questo processo con (mtime_ns, dimensione) del
+# file: un processo che resta attivo (server, watcher) non rilegge né riparsa il JSON
+# finché un altro processo non lo riscrive. Il manifest in memoria non va modificato.
+_manifest_memo = {}
+
+def _manifest_stamp():
+    st = MANIFEST_FILE.stat()
+    return (st.st_mtime_ns, st.st_size)
+
+def load_manifest():
+    """Carica il manifest della build precedente (vuoto se assente o di un'altra versione)"""
+    try:
+        stamp = _manifest_stamp()
+        if _manifest_memo.get('stamp') == stamp:
+            manifest = _manifest_memo['manifest']
+        else:
+            manifest = json.loads(MANIFEST_FILE.read_text(encoding='utf-8'))
+            _manifest_memo.update(stamp=stamp, manifest=manifest)
+    except (OSError, ValueError):
+        return {'files': {}}
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('generator') != generator_fingerprint():
+        # Template cambiati: gli output registrati vanno comunque rigenerati
+        return {'files': manifest.get('files', {}), 'stale': True}
+    return manifest
+
+def save_manifest(manifest):
+    """Salva il manifest in modo atomico (file temporaneo + rename)"""
+    atomic_write(MANIFEST_FILE, json.dumps(manifest, ensure_ascii=False))
+    _manifest_memo.update(stamp=_manifest_stamp(), manifest=manifest)
+
+@functools.lru_cache(maxsize=None)
+def generator_fingerprint():
+    """Hash di questo script: se cambiano i template la build incrementale riparte da zero"""
+    # Calcolato una sola volta: in-process conta la versione caricata, non quella su disco.
+    # Include il motore di rendering (e image_store, per gli srcset): cambiarlo (o installarlo) rigenera tutti i viewer
+    # e gli asset condivisi, il cui nome fingerprintato compare in ogni viewer
+    # Anche le codifiche precompresse: installare brotli produce i .br mancanti
+    renderer = Path(__file__).with_name('md_render.py').read_bytes()
+    renderer += Path(__file__).with_name('image_store.py').read_bytes()
+    assets = ' '.join(sorted(asset_urls().values()) + list(ENCODINGS))
+    return content_hash(Path(__file__).read_bytes() + renderer + engine_version().encode() + assets.encode())
+
+def content_hash(data):
+    """SHA-1 di testo o bytes"""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha1(data).hexdigest()
+
+def remove_output(output_path):
+    """Elimina un HTML generato orfano, le sue copie .gz/.br e le cartelle rimaste vuote in web/"""
+    if output_path.exists():
+        output_path.unlink()
+    remove_siblings(output_path)
+    parent = output_path.parent
+    while parent != WEB_DIR and WEB_DIR in parent.parents:
+        try:
+            parent.rmdir()
+        except OSError:
+            break
+        parent = parent.parent
+
+def is_under(rel, prefixes):
+    """True se il percorso relativo coincide o sta sotto uno dei prefissi"""
+    return any(rel == p or rel.startswith(p + '/') for p in prefixes)
+
+def collect_sources(previous, changed):
+    """Sorgenti di una build mirata: quelli noti dal manifest fuori dai percorsi
+    cambiati più quelli presenti su disco sotto i percorsi cambiati"""
+    files = {rel for rel in previous if not is_under(rel, changed)}
+    for rel in changed:
+        full = MD_DIR / rel
+        if full.is_file() and full.suffix.lower() == '.md':
+            files.add(rel)
+        elif full.is_dir():
+            files.update(rel_key(f) for f in full.rglob('*.md') if f.is_file())
+    # Stesso ordine di sorted() sui Path (per componenti), senza costruirli per confrontarli
+    return [MD_DIR / rel for rel in sorted(files, key=lambda rel: rel.split('/'))]
+
+def generate_viewer(task):
+    """Legge, renderizza e (se cambiato) scrive il viewer di un file.
+
+    Eseguita nel processo principale o in un processo del pool: riceve
+    (percorso, stat, voce del manifest o None) e ritorna la nuova voce del
+    manifest con tempi e byte; un'eccezione diventa il campo 'error'.
+    """
+    md, st, entry = task
+    rel = rel_key(md)
+    timings = {'scan': 0.0, 'render': 0.0, 'write': 0.0}
+    result = {'rel': rel, 'worker': os.getpid(), 'timings': timings, 'bytes_read': 0, 'written': 0,
+              'compressed': 0}
+    try:
+        viewer_rel_path = md.relative_to(MD_DIR).with_suffix('.html')
+        viewer_path = WEB_DIR / viewer_rel_path
+
+        # Unica lettura e unica passata di regex per file
+        started = time.perf_counter()
+        doc = scan_document(md, st)
+        timings['scan'] += time.perf_counter() - started
+        result['bytes_read'] = st.st_size
+
+        source_hash = content_hash(doc['text'])
+        # mtime None: voce di una build fallita, il viewer va rigenerato
+        if (entry and entry['mtime'] is not None and entry['hash'] == source_hash and viewer_path.exists()
+                and format_modified(entry['mtime']) == format_modified(st.st_mtime)):
+            # Solo l'mtime è cambiato (es. touch): il viewer sarebbe identico
+            result['entry'] = dict(entry, mtime=st.st_mtime, meta=dict(entry['meta'], modified=st.st_mtime))
+            return result
+
+        started = time.perf_counter()
+        viewer_html = render_viewer(md, doc)
+        output_hash = content_hash(viewer_html)
+        timings['render'] += time.perf_counter() - started
+        # Hash uguale a quello nel manifest: nemmeno la lettura per il confronto
+        if not (entry and entry['output_hash'] == output_hash and viewer_path.exists()):
+            started = time.perf_counter()
+            result['written'] = write_if_changed(viewer_path, viewer_html)
+            if result['written'] or not has_siblings(viewer_path):
+                result['compressed'] = write_siblings(viewer_path, viewer_html)
+            timings['write'] += time.perf_counter() - started
+
+        result['entry'] = {
+            'mtime': st.st_mtime,
+            'size': st.st_size,
+            'hash': source_hash,
+            'output': viewer_rel_path.as_posix(),
+            'output_hash': output_hash,
+            'meta': document_meta(doc)
+        }
+    except Exception as e:
+        result['error'] = f'{type(e).__name__}: {e}'
+    return result
+
+def run_tasks(tasks, jobs=1):
+    """Applica generate_viewer ai task mantenendone l'ordine.
+
+    Con jobs > 1 i task sono distribuiti a blocchi su un ProcessPoolExecutor:
+    il render è CPU-bound e nei thread resterebbe serializzato dal GIL.
+    """
+    if jobs <= 1 or len(tasks) < 2:
+        yield from map(generate_viewer, tasks)
+        return
+    jobs = min(jobs, len(tasks))
+    chunksize = max(1, len(tasks) // (jobs * 4))
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        yield from pool.map(generate_viewer, tasks, chunksize=chunksize)
+
+def build(incremental=False, changed=None, jobs=1):
+    """Rigenera viewer e preview.html.
+
+    In modalità incrementale rilegge e riscrive solo i file la cui sorgente è
+    cambiata rispetto al manifest, e preview.html solo se albero o metadati
+    sono cambiati. In entrambe le modalità gli output orfani vengono rimossi.
+
+    changed: percorsi relativi a md/ (file o cartelle) toccati dalla modifica.
+    Se indicato, in modalità incrementale gli altri file non vengono nemmeno
+    controllati con stat() e la build costa O(file cambiati).
+
+    jobs: processi per lettura, render e scrittura dei viewer (1 = nel processo
+    corrente). Gli errori di un singolo file non fermano la build: finiscono
+    in 'errors' e il file viene ritentato alla build successiva.
+
+    Le build di processi diversi sono serializzate da cache/build.lock; gli
+    eventi includono anche i cambiamenti scritti da un altro processo dopo
+    l'ultima build di questo.
+    """
+    with BUILD_LOCK:
+        return _build(incremental, changed, jobs)
+
+def _build(incremental, changed, jobs):
+    seen = _manifest_memo.get('manifest')
+    manifest = load_manifest()
+    previous = manifest['files']
+    # Manifest riscritto da un altro processo: i suoi cambiamenti diventano
+    # eventi anche per i client collegati a questo
+    external = []
+    if seen is not None and _manifest_memo.get('manifest') is not seen:
+        external = external_changes(seen['files'], previous)
+    reuse = incremental and not manifest.get('stale')
+    if changed is not None:
+        changed = {p.replace('\\', '/').strip('/') for p in changed}
+    if reuse and changed and '' not in changed:
+        md_files = collect_sources(previous, changed)
+    else:
+        changed = None
+        md_files = sorted([p for p in MD_DIR.rglob('*.md') if p.is_file()])
+    entries = {}
+    metas = {}
+    written = skipped = removed = 0
+    bytes_written = 0
+    workers = {}   # pid -> file elaborati e tempo di lavoro
+    errors = []
+    # Percorsi sorgente il cui viewer è stato scritto o rimosso (per le notifiche push)
+    updated = []
+    # Tempi per fase (secondi) e I/O di lettura, riportati con --timings
+    timings = {'scan': 0.0, 'render': 0.0, 'write': 0.0, 'preview': 0.0}
+    files_read = bytes_read = 0
+    build_started = time.perf_counter()
+
+    # Prima passata: solo stat() e confronto col manifest; i file da rileggere
+    # vengono poi letti, renderizzati e scritti da generate_viewer()
+    tasks = []
+    for md in md_files:
+        rel = rel_key(md)
+        entry = previous.get(rel) if reuse else None
+        if entry and changed is not None and not is_under(rel, changed):
+            entries[rel] = entry
+            metas[rel] = entry['meta']
+            skipped += 1
+            continue
+
+        st = md.stat()
+        viewer_path = WEB_DIR / md.relative_to(MD_DIR).with_suffix('.html')
+        if entry and entry['mtime'] == st.st_mtime and entry['size'] == st.st_size and viewer_path.exists():
+            entries[rel] = entry
+            metas[rel] = entry['meta']
+            skipped += 1
+            continue
+        tasks.append((md, st, entry))
+
+    # Risultati nell'ordine dei file qualunque sia il numero di processi
+    failed = set()
+    for result in run_tasks(tasks, jobs):
+        rel = result['rel']
+        worker = workers.setdefault(result['worker'], {'files': 0, 'ms': 0.0})
+        worker['files'] += 1
+        worker['ms'] += sum(result['timings'].values()) * 1000
+        if 'error' in result:
+            print(f'Errore generando il viewer di {rel}: {result["error"]}')
+            errors.append({'path': rel, 'error': result['error']})
+            entry = previous.get(rel)
+            if entry:
+                # Resta il viewer precedente; mtime None forza un nuovo tentativo alla prossima build
+                entries[rel] = dict(entry, mtime=None)
+                metas[rel] = entry['meta']
+            else:
+                failed.add(rel)
+            continue
+        for phase in ('scan', 'render', 'write'):
+            timings[phase] += result['timings'][phase]
+        files_read += 1
+        bytes_read += result['bytes_read']
+        bytes_written += result['compressed']
+        if result['written']:
+            print(f'Generato viewer: {result["entry"]["output"]}')
+            written += 1
+            bytes_written += result['written']
+            updated.append(rel)
+        else:
+            skipped += 1
+        entries[rel] = result['entry']
+        metas[rel] = result['entry']['meta']
+    if failed:
+        md_files = [md for md in md_files if rel_key(md) not in failed]
+
+    # Output di file non più presenti (eliminati, rinominati, spostati)
+    deleted = []
+    for rel, entry in previous.items():
+        if rel not in entries:
+            deleted.append(rel)
+            output_path = WEB_DIR / entry['output']
+            if output_path.exists():
+                print(f'Rimosso viewer orfano: {entry["output"]}')
+                removed += 1
+            remove_output(output_path)
+
+    # Asset fingerprintati prima di preview.html, che li referenzia
+    assets_written = publish_assets()
+
+    # Copia non fingerprintata dei temi per editor.html (pagina statica)
+    themes_css = code_themes_css()
+    themes_path = WEB_DIR / 'code-themes.css'
+    if themes_css and (write_if_changed(themes_path, themes_css) or not has_siblings(themes_path)):
+        write_siblings(themes_path, themes_css, brotli_quality=BROTLI_QUALITY_ASSETS)
+        print('Generato code-themes.css')
+
+    # preview.html dipende solo da albero e metadati: la chiave li riassume
+    preview_key = content_hash(json.dumps(
+        [ROOT.name, sorted((rel, entries[rel]['meta']) for rel in entries)],
+        sort_keys=True, ensure_ascii=False))
+    preview_path = WEB_DIR / 'preview.html'
+    preview_bytes = 0
+    if (reuse and manifest.get('preview_key') == preview_key and preview_path.exists()
+            and has_siblings(preview_path) and TREE_DIR.is_dir()):
+        print('preview.html invariato')
+    else:
+        started = time.perf_counter()
+        preview_html, fragments = render_preview(md_files, metas)
+        preview_bytes = write_if_changed(preview_path, preview_html)
+        if preview_bytes or not has_siblings(preview_path):
+            bytes_written += write_siblings(preview_path, preview_html)
+        bytes_written += write_tree_fragments(fragments)
+        timings['preview'] += time.perf_counter() - started
+        if preview_bytes:
+            bytes_written += preview_bytes
+            print('Generato indice avanzato: preview.html')
+        else:
+            print('preview.html invariato')
+
+    save_manifest({
+        'version': MANIFEST_VERSION,
+        'generator': generator_fingerprint(),
+        'preview_key': preview_key,
+        'files': entries
+    })
+    print(f'Operazione completata. Viewer scritti: {written}, invariati: {skipped}, rimossi: {removed}')
+    timings['total'] = time.perf_counter() - build_started
+    return {
+        'events': external + change_events(previous, entries, updated, deleted),
+        'written': written,
+        'skipped': skipped,
+        'removed': removed,
+        'preview_written': preview_bytes > 0,
+        'assets_written': assets_written,
+        'bytes_written': bytes_written,
+        'errors': errors,
+        'workers': [{'pid': pid, 'files': w['files'], 'ms': round(w['ms'], 2)}
+                    for pid, w in sorted(workers.items())],
+        'documents': len(md_files),
+        'files_read': files_read,
+        'bytes_read': bytes_read,
+        'timings_ms': {k: round(v * 1000, 2) for k, v in timings.items()}
+    }
+
+def change_events(previous, entries, updated, deleted):
+    """Eventi per percorso di una build: changed, deleted e renamed.
+
+    Un file sparito e uno nuovo con lo stesso hash sorgente sono un renamed
+    (rinomina o spostamento, anche di un'intera cartella).
+    """
+    new_by_hash = {}
+    for rel in updated:
+        if rel not in previous:
+            new_by_hash.setdefault(entries[rel]['hash'], []).append(rel)
+    events = []
+    renamed_to = set()
+    for rel in deleted:
+        old = previous[rel]
+        candidates = new_by_hash.get(old['hash'])
+        if candidates:
+            new = candidates.pop(0)
+            renamed_to.add(new)
+            events.append({'type': 'renamed', 'path': new, 'from': rel,
+                           'url': entries[new]['output'], 'old_url': old['output']})
+        else:
+            events.append({'type': 'deleted', 'path': rel, 'url': old['output']})
+    events.extend({'type': 'changed', 'path': rel, 'url': entries[rel]['output']}
+                  for rel in updated if rel not in renamed_to)
+    return events
+
+def manifest_changes():
+    """Eventi delle build fatte da altri processi dall'ultimo manifest visto da questo (senza build)"""
+    with BUILD_LOCK:
+        seen = _manifest_memo.get('manifest')
+        load_manifest()
+        current = _manifest_memo.get('manifest')
+    if seen is None or current is None or current is seen:
+        return []
+    return external_changes(seen['files'], current['files'])
+
+def external_changes(seen, current):
+    """Eventi dei cambiamenti tra due versioni del manifest (build di un altro processo)"""
+    updated = [rel for rel, entry in current.items()
+               if rel not in seen or seen[rel]['output_hash'] != entry['output_hash']]
+    deleted = [rel for rel in seen if rel not in current]
+    return change_events(seen, current, updated, deleted)
+
+def print_timings(result):
+    """Report dei tempi per fase di una build"""
+    t = result['timings_ms']
+    print(f'Documenti: {result["documents"]} • letture: {result["files_read"]} '
+          f'({result["bytes_read"] / 1024:.1f} KB, una per file rigenerato) • '
+          f'scritti: {result["bytes_written"] / 1024:.1f} KB')
+    print(f'Tempi (ms): scansione {t["scan"]:.1f} • render {t["render"]:.1f} • '
+          f'scrittura {t["write"]:.1f} • preview {t["preview"]:.1f} • totale {t["total"]:.1f}')
+    if len(result['workers']) > 1:
+        # Con più processi scansione, render e scrittura sono sommati su tutti i worker
+        for w in result['workers']:
+            print(f'  worker {w["pid"]}: {w["files"]} file in {w["ms"]:.1f} ms')
+    if result['errors']:
+        print(f'Errori: {len(result["errors"])} file non generati')
+
+def print_size_report(report):
+    """Tabella dei byte grezzi e compressi di web/ per categoria"""
+    def ratio(value, raw):
+        return f'{value / 1024:10.1f} KB ({value / raw:4.0%})' if value and raw else f'{"n/d":>19}'
+
+    print(f'{"":8} {"file":>6} {"grezzo":>13} {"gzip":>19} {"brotli":>19}')
+    totals = {'files': 0, 'raw': 0, 'gzip': 0, 'br': 0}
+    for category, row in sorted(report.items()) + [('totale', totals)]:
+        if category != 'totale':
+            for key in totals:
+                totals[key] += row[key]
+        print(f'{category:8} {row["files"]:6} {row["raw"] / 1024:10.1f} KB '
+              f'{ratio(row["gzip"], row["raw"])} {ratio(row["br"], row["raw"])}')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Genera preview.html e i viewer HTML dai file in md/')
+    parser.add_argument('--incremental', action='store_true',
+                        help='rigenera solo i file cambiati rispetto al manifest della build precedente')
+    parser.add_argument('--timings', action='store_true',
+                        help='stampa i tempi per fase (scansione, render, scrittura, preview)')
+    parser.add_argument('--jobs', type=int, default=1, metavar='N',
+                        help='processi per la generazione dei viewer (0 = numero di CPU)')
+    parser.add_argument('--changed', action='append', metavar='PATH',
+                        help='percorso relativo a md/ cambiato (ripetibile); con --incremental '
+                             'controlla solo questi percorsi')
+    parser.add_argument('--sizes', action='store_true',
+                        help='stampa i byte di HTML e asset in web/ grezzi e con gzip/Brotli')
+    args = parser.parse_args(argv)
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    result = build(incremental=args.incremental, changed=args.changed, jobs=jobs)
+    if args.timings:
+        print_timings(result)
+    if args.sizes:
+        print_size_report(size_report(WEB_DIR))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,504 @@
+"""
+search_index.py
+Indice invertito full-text dei file in md/, persistito su disco.
+
+token -> {percorso: [righe in cui compare]}: le righe servono sia per i
+frammenti di contesto dei risultati sia per verificare le frasi, rileggendo
+dal disco solo i file coinvolti (il testo non resta in memoria). L'indice
+viene caricato all'avvio, riallineato con stat() ai file su disco e
+aggiornato in modo incrementale dagli endpoint che modificano i file.
+
+Sintassi delle query:
+  parola            token esatto
+  par*              prefisso (anche l'ultima parola mentre si digita)
+  "due parole"      frase (parole consecutive sulla stessa riga)
+Tutti i termini devono comparire; i risultati sono ordinati con BM25.
+"""
+from bisect import bisect_left, insort
+import contextlib
+import functools
+import gc
+import heapq
+import math
+import pickle
+import re
+import sys
+import threading
+import time
+
+from output_writer import atomic_write
+from pagination import is_under
+
+INDEX_VERSION = 2
+TOKEN_RE = re.compile(r'\w+')
+PHRASE_RE = re.compile(r'"([^"]*)"')
+
+# Parametri BM25
+K1 = 1.2
+B = 0.75
+NAME_BOOST = 2.0
+MAX_PREFIX_EXPANSION = 100
+MAX_MATCHES = 3
+
+
+def occurrences(value):
+    """Righe di una posting come sequenza (le posting singole sono salvate come int)"""
+    return (value,) if type(value) is int else value
+
+
+def tokenize(text):
+    """token -> righe in cui compare (lista, in ordine)"""
+    found = {}
+    for i, line in enumerate(text.split('\n')):
+        for token in TOKEN_RE.findall(line.lower()):
+            lines = found.get(token)
+            if lines is None:
+                # intern: lo stesso oggetto nelle posting e in _docs, salvato una volta nel pickle
+                found[sys.intern(token)] = [i]
+            else:
+                lines.append(i)
+    return found
+
+
+@functools.lru_cache(maxsize=256)
+def read_lines(path, mtime, size):
+    """Righe di un file indicizzato, per frasi e frammenti (() se non leggibile).
+
+    mtime e dimensione fanno parte della chiave: un file modificato si rilegge.
+    """
+    try:
+        return tuple(path.read_text(encoding='utf-8').split('\n'))
+    except (OSError, UnicodeDecodeError):
+        return ()
+
+
+@contextlib.contextmanager
+def gc_paused():
+    """Sospende il GC ciclico durante le operazioni che creano milioni di oggetti"""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class SearchIndex:
+    """Indice invertito thread-safe con aggiornamenti incrementali"""
+
+    def __init__(self, base_dir, index_file, logger=None):
+        self.base_dir = base_dir
+        self.index_file = index_file
+        self._logger = logger
+        self._lock = threading.RLock()
+        self._docs = {}       # percorso -> {'mtime', 'size', 'name', 'length', 'tokens' (distinti)}
+        # token -> {percorso: riga (int) se compare una volta sola, altrimenti tupla di righe}:
+        # la forma compatta riduce memoria, oggetti e tempi di salvataggio/caricamento
+        self._postings = {}
+        self._names = None    # (nomi minuscoli uniti da '\n', offset, percorsi), ricostruito se None
+        self._vocab = []      # token ordinati per le query per prefisso (None = da ricostruire)
+        self._total_length = 0
+        self._loaded = False
+        self._dirty = False
+        self._save_timer = None
+        self._last_sync = 0.0
+        self._syncing = False
+        self.reads = 0        # file letti e indicizzati dall'avvio (per /api/metrics)
+        self.bytes_read = 0
+
+    # --- Persistenza -------------------------------------------------------
+
+    def ensure_loaded(self):
+        """Carica l'indice da disco e lo riallinea ai file (solo la prima volta)"""
+        with self._lock:
+            if self._loaded:
+                return
+            started = time.perf_counter()
+            self._load()
+            self._loaded = True
+            self.sync()
+            if self._dirty:
+                self.save()
+            if self._logger:
+                self._logger.info(f'Indice di ricerca pronto: {len(self._docs)} documenti, '
+                                  f'{len(self._postings)} token ({(time.perf_counter() - started) * 1000:.0f} ms)')
+
+    def _load(self):
+        try:
+            with gc_paused():
+                data = pickle.loads(self.index_file.read_bytes())
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError):
+            return
+        if data.get('version') != INDEX_VERSION:
+            return
+        self._docs = data['docs']
+        self._postings = data['postings']
+        self._vocab = sorted(self._postings)
+        self._total_length = sum(d['length'] for d in self._docs.values())
+
+    def save(self):
+        """Scrive l'indice su disco in modo atomico"""
+        # pickle e non JSON: i percorsi condivisi tra le posting vengono serializzati
+        # una volta sola e il caricamento è molto più veloce
+        with self._lock:
+            payload = pickle.dumps({
+                'version': INDEX_VERSION,
+                'docs': self._docs,
+                'postings': self._postings
+            }, protocol=pickle.HIGHEST_PROTOCOL)
+            self._dirty = False
+        # File temporaneo per processo: più worker possono salvare insieme
+        atomic_write(self.index_file, payload)
+
+    def schedule_save(self, delay=5.0):
+        """Salva dopo `delay` secondi, accorpando le modifiche ravvicinate"""
+        with self._lock:
+            if self._save_timer:
+                self._save_timer.cancel()
+            self._save_timer = threading.Timer(delay, self.save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def flush(self):
+        """Salva subito le modifiche pendenti (chiamato alla chiusura del server)"""
+        with self._lock:
+            if self._save_timer:
+                self._save_timer.cancel()
+                self._save_timer = None
+            dirty = self._dirty and self._loaded
+        if dirty:
+            self.save()
+
+    # --- Aggiornamento -----------------------------------------------------
+
+    def sync(self):
+        """Riallinea l'indice ai file su disco confrontando mtime e dimensione.
+
+        Scansione, letture e tokenizzazione avvengono senza lock, che viene
+        preso solo per applicare ogni modifica: le query non aspettano il
+        disco. Un documento aggiornato nel frattempo da refresh() non viene
+        toccato.
+        """
+        with self._lock:
+            known = {rel: (doc['mtime'], doc['size']) for rel, doc in self._docs.items()}
+        with gc_paused():
+            seen = set()
+            for path in self.base_dir.rglob('*.md'):
+                rel = path.relative_to(self.base_dir).as_posix()
+                try:
+                    if not path.is_file():
+                        continue
+                    st = path.stat()
+                    if known.get(rel) != (st.st_mtime, st.st_size):
+                        text = path.read_text(encoding='utf-8')
+                        found = tokenize(text)
+                        with self._lock:
+                            self.reads += 1
+                            self.bytes_read += st.st_size
+                            if self._current(rel) == known.get(rel):
+                                self._add_doc(rel, found, st.st_mtime, st.st_size)
+                except FileNotFoundError:
+                    continue   # eliminato o rinominato durante la scansione
+                except (OSError, UnicodeDecodeError):
+                    pass
+                seen.add(rel)
+            with self._lock:
+                for rel in [r for r in known if r not in seen and self._current(r) == known[r]]:
+                    self._remove_doc(rel)
+                self._last_sync = time.time()
+
+    def _current(self, rel):
+        doc = self._docs.get(rel)
+        return (doc['mtime'], doc['size']) if doc else None
+
+    def sync_in_background(self, max_age=10.0):
+        """Avvia un riallineamento in background se l'ultimo è più vecchio di max_age secondi.
+
+        Copre le modifiche fatte fuori dalle API (editor esterni, watcher)
+        senza mai bloccare le query.
+        """
+        with self._lock:
+            if self._syncing or time.time() - self._last_sync < max_age:
+                return
+            self._syncing = True
+
+        def run():
+            try:
+                self.sync()
+                if self._dirty:
+                    self.schedule_save()
+            finally:
+                self._syncing = False
+
+        threading.Thread(target=run, name='search-sync', daemon=True).start()
+
+    def refresh(self, paths):
+        """Aggiorna l'indice per i percorsi relativi indicati (file o cartelle,
+        esistenti o appena eliminati)"""
+        with self._lock:
+            if not self._loaded:
+                return
+            for rel in paths:
+                rel = rel.replace('\\', '/').strip('/')
+                full = self.base_dir / rel
+                for known in [r for r in self._docs if r == rel or r.startswith(rel + '/')]:
+                    if not (self.base_dir / known).is_file():
+                        self._remove_doc(known)
+                if full.is_file() and full.suffix.lower() == '.md':
+                    targets = [full]
+                elif full.is_dir():
+                    targets = full.rglob('*.md')
+                else:
+                    targets = []
+                for path in targets:
+                    try:
+                        if path.is_file():
+                            self._index_if_changed(path.relative_to(self.base_dir).as_posix(), path)
+                    except FileNotFoundError:
+                        continue   # sparito nel frattempo: lo rimuove il prossimo evento o sync()
+            if self._dirty:
+                self.schedule_save()
+
+    def _index_if_changed(self, rel, path):
+        """Reindicizza se mtime o dimensione sono cambiati (FileNotFoundError se il file è sparito)"""
+        st = path.stat()
+        doc = self._docs.get(rel)
+        if doc and doc['mtime'] == st.st_mtime and doc['size'] == st.st_size:
+            return
+        try:
+            text = path.read_text(encoding='utf-8')
+        except (OSError, UnicodeDecodeError):
+            return
+        self.reads += 1
+        self.bytes_read += st.st_size
+        self._add_doc(rel, tokenize(text), st.st_mtime, st.st_size)
+
+    def _add_doc(self, rel, occurrences, mtime, size):
+        """Indicizza un documento già tokenizzato: un solo accesso all'indice per token distinto"""
+        self._remove_doc(rel)
+        length = 0
+        new_tokens = []
+        for token, found in occurrences.items():
+            docs = self._postings.get(token)
+            if docs is None:
+                docs = self._postings[token] = {}
+                new_tokens.append(token)
+            docs[rel] = found[0] if len(found) == 1 else tuple(found)
+            length += len(found)
+        if self._vocab is not None:
+            # Pochi token nuovi (modifica tipica): inserimento ordinato; altrimenti
+            # (indicizzazione iniziale) il vocabolario si ricostruisce alla prima query
+            if len(new_tokens) <= 64:
+                for token in new_tokens:
+                    insort(self._vocab, token)
+            else:
+                self._vocab = None
+        self._docs[rel] = {
+            'mtime': mtime,
+            'size': size,
+            'name': rel.rsplit('/', 1)[-1],
+            'length': length,
+            'tokens': tuple(occurrences)
+        }
+        self._names = None
+        self._total_length += length
+        self._dirty = True
+
+    def _remove_doc(self, rel):
+        doc = self._docs.pop(rel, None)
+        if doc is None:
+            return
+        self._names = None
+        for token in doc['tokens']:
+            docs = self._postings.get(token)
+            if docs is None:
+                continue
+            docs.pop(rel, None)
+            if not docs:
+                del self._postings[token]
+                if self._vocab is not None:
+                    i = bisect_left(self._vocab, token)
+                    if i < len(self._vocab) and self._vocab[i] == token:
+                        del self._vocab[i]
+        self._total_length -= doc['length']
+        self._dirty = True
+
+    # --- Ricerca -----------------------------------------------------------
+
+    def _expand_prefix(self, prefix):
+        if self._vocab is None:
+            self._vocab = sorted(self._postings)
+        i = bisect_left(self._vocab, prefix)
+        tokens = []
+        while i < len(self._vocab) and self._vocab[i].startswith(prefix) and len(tokens) < MAX_PREFIX_EXPANSION:
+            tokens.append(self._vocab[i])
+            i += 1
+        return tokens
+
+    def _term_clause(self, token, prefix):
+        """Clausola per un token esatto o un prefisso: (hits, frequenza, righe)"""
+        if not prefix:
+            hits = self._postings.get(token, {})
+            return hits, lambda rel: len(occurrences(hits[rel])), lambda rel: occurrences(hits[rel])
+        expanded = [self._postings[t] for t in self._expand_prefix(token)]
+        counts = {}
+        for docs in expanded:
+            for rel, lines in docs.items():
+                counts[rel] = counts.get(rel, 0) + len(occurrences(lines))
+        return counts, counts.__getitem__, lambda rel: [i for docs in expanded if rel in docs
+                                                         for i in occurrences(docs[rel])]
+
+    def _phrase_clause(self, tokens):
+        """Clausola per una frase: documenti e righe in cui i token compaiono consecutivi"""
+        if len(tokens) == 1:
+            return self._term_clause(tokens[0], False)
+        postings = [self._postings.get(t) for t in tokens]
+        hits = {}
+        if all(postings):
+            pattern = re.compile(r'\b' + r'\W+'.join(re.escape(t) for t in tokens) + r'\b')
+            candidates = set(min(postings, key=len))
+            for docs in postings:
+                candidates.intersection_update(docs)
+            for rel in candidates:
+                # Solo le righe che contengono tutti i token vengono verificate con la regex
+                common = set(occurrences(postings[0][rel])).intersection(
+                    *(occurrences(docs[rel]) for docs in postings[1:]))
+                if not common:
+                    continue
+                doc_lines = self._lines(rel)
+                lines = sorted(i for i in common if i < len(doc_lines) and pattern.search(doc_lines[i].lower()))
+                if lines:
+                    hits[rel] = lines
+        return hits, lambda rel: len(hits[rel]), hits.__getitem__
+
+    def _name_hits(self, needle):
+        """Percorsi il cui nome file contiene `needle`: una find() su tutti i nomi concatenati"""
+        if not needle or '\n' in needle:
+            return set()
+        if self._names is None:
+            rels = sorted(self._docs)
+            offsets = []
+            position = 0
+            for rel in rels:
+                offsets.append(position)
+                position += len(self._docs[rel]['name']) + 1
+            self._names = ('\n'.join(self._docs[rel]['name'].lower() for rel in rels), offsets, rels)
+        blob, offsets, rels = self._names
+        hits = set()
+        i = blob.find(needle)
+        while i != -1:
+            k = bisect_left(offsets, i + 1) - 1
+            hits.add(rels[k])
+            i = blob.find(needle, offsets[k + 1] if k + 1 < len(offsets) else len(blob))
+        return hits
+
+    def parse_query(self, query):
+        """Scompone la query in clausole (token, prefisso?) e frasi"""
+        phrases = [TOKEN_RE.findall(p.lower()) for p in PHRASE_RE.findall(query)]
+        rest = PHRASE_RE.sub(' ', query)
+        terms = []
+        for match in re.finditer(r'(\w+)(\*?)', rest.lower()):
+            terms.append((match.group(1), bool(match.group(2))))
+        # Ricerca mentre si digita: l'ultima parola è un prefisso
+        if terms and re.search(r'\w$', query):
+            terms[-1] = (terms[-1][0], True)
+        return terms, [p for p in phrases if p]
+
+    def search(self, query, limit=50, after=None, folder='', order=None):
+        """Esegue la query; ritorna (totale, risultati della pagina, cursore successivo o None).
+
+        Senza `order` i risultati sono per rilevanza e `after` è il cursore
+        [punteggio, percorso] della pagina precedente. `order` è una funzione
+        (percorsi trovati) -> (totale, percorsi della pagina, cursore) per gli
+        altri ordinamenti (MetadataStore.page). folder: solo i file sotto
+        questa cartella.
+        """
+        with self._lock:
+            terms, phrases = self.parse_query(query)
+            clauses = [self._term_clause(t, prefix) for t, prefix in terms]
+            clauses += [self._phrase_clause(p) for p in phrases]
+
+            candidates = set()
+            if clauses:
+                ordered = sorted(clauses, key=lambda c: len(c[0]))
+                candidates = set(ordered[0][0])
+                for hits, _, _ in ordered[1:]:
+                    candidates.intersection_update(hits)
+                    if not candidates:
+                        break
+
+            # Compatibilità: i file il cui nome contiene la query compaiono sempre
+            name_hits = self._name_hits(query.strip().lower())
+
+            n_docs = len(self._docs) or 1
+            avg_length = (self._total_length / n_docs) or 1
+            weights = [math.log(1 + (n_docs - len(hits) + 0.5) / (len(hits) + 0.5)) * (K1 + 1)
+                       for hits, _, _ in clauses]
+            scored = []
+            for rel in candidates | name_hits:
+                score = NAME_BOOST if rel in name_hits else 0.0
+                if rel in candidates:
+                    norm = K1 * (1 - B + B * self._docs[rel]['length'] / avg_length)
+                    for (_, tf_of, _), weight in zip(clauses, weights):
+                        tf = tf_of(rel)
+                        score += weight * tf / (tf + norm)
+                scored.append((score, rel))
+            if folder:
+                scored = [(score, rel) for score, rel in scored if is_under(rel, folder)]
+            scores = dict((rel, score) for score, rel in scored)
+
+            next_cursor = None
+            if order is not None:
+                total, paths, next_cursor = order(set(scores))
+                top = [(scores[rel], rel) for rel in paths if rel in scores]
+            else:
+                total = len(scored)
+                if after is not None:
+                    # Paginazione per chiave: solo i risultati dopo l'ultimo della pagina precedente
+                    try:
+                        last = (-float(after[0]), str(after[1]))
+                    except (TypeError, ValueError, IndexError):
+                        raise ValueError('invalid_cursor')
+                    scored = [r for r in scored if (-r[0], r[1]) > last]
+                # Solo i primi `limit` vengono formattati con i frammenti di contesto
+                top = heapq.nsmallest(limit + 1, scored, key=lambda r: (-r[0], r[1])) if limit else sorted(scored, key=lambda r: (-r[0], r[1]))
+                if limit and len(top) > limit:
+                    top = top[:limit]
+                    next_cursor = list(top[-1])
+            page = []
+            for score, rel in top:
+                lines = set()
+                if rel in candidates:
+                    for _, _, lines_of in clauses:
+                        lines.update(lines_of(rel))
+                doc = self._docs[rel]
+                page.append((score, rel, sorted(lines), doc['mtime'], doc['size']))
+        # I frammenti si leggono dal disco fuori dal lock
+        return total, [self._format_result(*hit) for hit in page], next_cursor
+
+    def _lines(self, rel):
+        doc = self._docs[rel]
+        return read_lines(self.base_dir / rel, doc['mtime'], doc['size'])
+
+    def _format_result(self, score, rel, lines, mtime, size):
+        doc_lines = read_lines(self.base_dir / rel, mtime, size) if lines else ()
+        matches = []
+        for i in lines[:MAX_MATCHES]:
+            start = max(0, i - 1)
+            end = min(len(doc_lines), i + 2)
+            matches.append({
+                'line': i + 1,
+                'context': '\n'.join(doc_lines[start:end])[:200]
+            })
+        return {
+            'path': rel,
+            'name': rel.rsplit('/', 1)[-1],
+            'score': round(score, 4),
+            'matches': matches
+        }
+
+    def stats(self):
+        """Dimensioni dell'indice"""
+        with self._lock:
+            return {'documents': len(self._docs), 'tokens': len(self._postings)}
@@ -0,0 +1,146 @@
+"""
+serve.py
+Avvio di produzione dell'API server con un server WSGI al posto di app.run().
+
+Uso:
+  python scripts/serve.py                          # server scelto in automatico
+  python scripts/serve.py --workers 2 --threads 32 # più processi (solo gunicorn)
+  python scripts/serve.py --server waitress --threads 32 --timeout 120
+
+Con gunicorn (Linux/macOS) si usano worker gthread: `workers` processi con
+`threads` thread ciascuno. Su Windows, o senza gunicorn, si usa waitress: un
+solo processo con `threads` thread. Se nessuno dei due è installato si torna
+al server di sviluppo di Flask con un avviso.
+
+Ogni connessione /api/events occupa un thread per tutta la sua durata: per
+non esaurire i thread del worker gli stream aperti sono limitati a
+`--max-streams` per processo (default metà dei thread); oltre il limite
+/api/events risponde 503 e viewer e console ripiegano sul polling. Con molti
+viewer aperti conviene asgi_server.py, dove gli stream non occupano thread.
+I valori predefiniti si possono cambiare anche con le variabili d'ambiente
+APPUNTI_HOST, APPUNTI_PORT, APPUNTI_WORKERS, APPUNTI_THREADS, APPUNTI_SSE_MAX,
+APPUNTI_KEEPALIVE, APPUNTI_TIMEOUT.
+"""
+from pathlib import Path
+import argparse
+import os
+import sys
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+ROOT = SCRIPTS_DIR.parent
+if str(SCRIPTS_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPTS_DIR))
+
+
+def env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Server di produzione per API e pagine in web/')
+    parser.add_argument('--host', default=os.environ.get('APPUNTI_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=env_int('APPUNTI_PORT', 5000))
+    parser.add_argument('--server', choices=['auto', 'gunicorn', 'waitress', 'flask'], default='auto')
+    parser.add_argument('--workers', type=int, default=env_int('APPUNTI_WORKERS', 1),
+                        help='processi worker (solo gunicorn)')
+    parser.add_argument('--threads', type=int, default=env_int('APPUNTI_THREADS', 32),
+                        help='thread per worker (ogni stream /api/events ne occupa uno)')
+    parser.add_argument('--max-streams', type=int, default=env_int('APPUNTI_SSE_MAX', 0),
+                        help='stream /api/events aperti per worker (default metà dei thread)')
+    parser.add_argument('--keep-alive', type=int, default=env_int('APPUNTI_KEEPALIVE', 5),
+                        help='secondi di attesa di una nuova richiesta su una connessione keep-alive')
+    parser.add_argument('--timeout', type=int, default=env_int('APPUNTI_TIMEOUT', 120),
+                        help='secondi: worker bloccato (gunicorn) o connessione inattiva (waitress)')
+    return parser.parse_args(argv)
+
+
+def pick_server(requested):
+    """Server da usare: quello richiesto o il primo disponibile"""
+    if requested != 'auto':
+        return requested
+    if os.name != 'nt':
+        try:
+            import gunicorn  # noqa: F401
+            return 'gunicorn'
+        except ImportError:
+            pass
+    try:
+        import waitress  # noqa: F401
+        return 'waitress'
+    except ImportError:
+        return 'flask'
+
+
+def run_gunicorn(args):
+    from gunicorn.app.base import BaseApplication
+
+    class AppuntiApplication(BaseApplication):
+        def load_config(self):
+            options = {
+                'bind': f'{args.host}:{args.port}',
+                'workers': args.workers,
+                'worker_class': 'gthread',
+                'threads': args.threads,
+                'keepalive': args.keep_alive,
+                'timeout': args.timeout,
+                'graceful_timeout': 10,
+                'preload_app': False   # ogni worker importa l'app e avvia i propri servizi
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from wsgi import application
+            return application
+
+    AppuntiApplication().run()
+
+
+def run_waitress(args):
+    from waitress import serve
+    from wsgi import application
+    serve(application, host=args.host, port=args.port, threads=args.threads,
+          channel_timeout=args.timeout,
+          connection_limit=max(100, args.threads * 4),
+          send_bytes=1)   # niente buffer in uscita: gli eventi SSE partono subito
+
+
+def run_flask(args):
+    from api_server import app, start_background_services
+    print('gunicorn e waitress non installati: uso il server di sviluppo di Flask '
+          '(python -m pip install waitress)')
+    start_background_services()
+    app.run(host=args.host, port=args.port, debug=False, threaded=True)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = pick_server(args.server)
+    if server != 'gunicorn' and args.workers > 1:
+        print(f'{server} usa un solo processo: --workers {args.workers} ignorato')
+        args.workers = 1
+    # Letto da api_server all'import, anche nei worker di gunicorn (ereditano l'ambiente)
+    os.environ['APPUNTI_WORKERS'] = str(args.workers)
+    os.environ['APPUNTI_THREADS'] = str(args.threads)
+    if args.max_streams < 1:
+        args.max_streams = max(1, args.threads // 2)
+    os.environ['APPUNTI_SSE_MAX'] = str(args.max_streams)
+
+    # PID del processo principale (il master con gunicorn) per avvia.bat e gli script di stop
+    pid_file = ROOT / 'api_server.pid'
+    pid_file.write_text(str(os.getpid()))
+    print(f'Serving web/ and API on http://localhost:{args.port} '
+          f'({server}, {args.workers} worker x {args.threads} thread, '
+          f'max {args.max_streams} stream /api/events per worker)')
+    try:
+        {'gunicorn': run_gunicorn, 'waitress': run_waitress, 'flask': run_flask}[server](args)
+    finally:
+        if pid_file.exists():
+            pid_file.unlink()
+
+
+if __name__ == '__main__':
+    main()
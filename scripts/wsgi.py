@@ -0,0 +1,16 @@
+"""
+wsgi.py
+Entry point WSGI dell'API server per gunicorn, waitress o altri server.
+
+  cd scripts && gunicorn -w 2 -k gthread --threads 16 wsgi:app
+  cd scripts && waitress-serve --threads 16 wsgi:app
+
+Di solito si usa scripts/serve.py, che sceglie il server e imposta worker,
+thread, keep-alive e timeout. Ogni worker che importa questo modulo carica i
+propri indici e avvia il proprio observer su md/.
+"""
+from api_server import app, start_background_services
+
+start_background_services()
+
+application = app